@@ -0,0 +1,1321 @@
+"""
+Micro-benchmarks for the hot paths in main.py. No hardware or display needed.
+
+    python bench.py pairing
+    python bench.py watcher --nfiles 100000
+    python bench.py index
+    python bench.py rx --lines 200000
+    python bench.py slider
+    python bench.py timeline
+    python bench.py csv
+    python bench.py pipeline --fps 100 --seconds 10
+    python bench.py reconnect
+    python bench.py exif --nfiles 2000
+    python bench.py repair --sizes 10000,100000,1000000
+    python bench.py units --sizes 1,4,16 --fps 10
+    python bench.py capture --fps 20 --seconds 10
+    python bench.py sequencer --steps 2000
+    python bench.py store --sizes 100000,1000000
+    python bench.py suite [--quick] [--out new.json] [--baseline old.json]
+    python bench.py compare old.json new.json
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import Future
+from pathlib import Path
+
+from main import (PairingEngine, MATCH_TOLERANCE_SEC, EXPOSURE_POLL_DITHER, IMAGE_PATTERN, IMAGE_SCAN_INTERVAL_SEC,
+                  ImageIndex, ScandirWatcher, InotifyWatcher, TcpClient, CoalescingSender,
+                  ExposureTimeline, SessionWriter, CSV_HEADER, ExposurePipeline, UI_FPS, SessionManager,
+                  ConnectionSupervisor, ExifReader, read_exif_time, TrafficCapture, ReplayClient, TrafficReplay,
+                  capture_files, Sequencer, SessionStore, query_pairs, unmatched, export_run_csv)
+from simulator import NanoSimulator, FakeCamera, exif_jpeg
+import repair
+
+
+# ---------- Pairing ----------
+def _legacy_greedy(exposures, images, tol):
+    """The old App.try_match_pairs loop (sort + nested scan), kept for comparison."""
+    exposures.sort(key=lambda x: x[0])
+    images.sort(key=lambda x: x[0])
+    matched = set()
+    for ets, _ in exposures:
+        best_idx = None
+        best_dt = None
+        for ii, (its, _) in enumerate(images):
+            if ii in matched:
+                continue
+            dt = abs(its - ets)
+            if best_dt is None or dt < best_dt:
+                best_dt, best_idx = dt, ii
+        if best_idx is not None and best_dt <= tol:
+            matched.add(best_idx)
+    return len(matched)
+
+
+def _pairing_workload(backlog, events, seed=1):
+    """Stale backlog plus live pairs that land between its entries, in random time order and overlapping.
+
+    Every 10 s slot holds at most one stale exposure (at +0 s) and image (at +5 s), which can never
+    pair, and one live pair at +2.3 s; the live pairs visit the slots out of order, several are in
+    flight at once and the image sometimes arrives before its exposure.
+    Returns (stale [(side, t, item)], live [(side, t, item)]); side 1 is an image.
+    """
+    rnd = random.Random(seed)
+    pairs = events // 2
+    slots = max(backlog, pairs)
+    stale = []
+    for k in range(backlog):
+        s = k * slots // backlog
+        stale.append((0, s * 10.0, -1 - k))
+        stale.append((1, s * 10.0 + 5.0, -1 - k))
+    order = []
+    for j, s in enumerate(rnd.sample(range(slots), pairs)):
+        t = s * 10.0 + 2.3
+        for side, ts in ((0, t), (1, t + rnd.uniform(0.1, 0.6))):
+            order.append((j + rnd.uniform(0, 8), (side, ts, j)))
+    order.sort(key=lambda o: o[0])
+    return stale, [ev for _, ev in order]
+
+
+def _feed_pairing(eng, evs):
+    """Feed (side, t, item) events; return how many paired."""
+    paired = 0
+    for side, t, item in evs:
+        paired += (eng.add_image(t, item) if side else eng.add_exposure(t, item)) is not None
+    return paired
+
+
+def bench_pairing(sizes, events=20000, legacy_max=2000):
+    """Per-event cost of pairing with `n` stale unmatched items already waiting on each side,
+    while live pairs match inside that backlog, out of order and interleaved."""
+    print(f"{'pending':>10} {'engine us/event':>16} {'legacy us/event':>16}")
+    for n in sizes:
+        eng = PairingEngine(MATCH_TOLERANCE_SEC, expiry=None)
+        stale, live = _pairing_workload(n, events)
+        _feed_pairing(eng, stale)
+
+        start = time.perf_counter()
+        paired = _feed_pairing(eng, live)
+        per_event = (time.perf_counter() - start) / len(live) * 1e6
+        if paired != len(live) // 2:
+            print(f"  only {paired} of {len(live) // 2} live pairs matched")
+
+        legacy = ""
+        if n <= legacy_max:
+            # old code re-ran the whole match on every event; time a handful of calls
+            exps = [(t, item) for side, t, item in stale if not side]
+            imgs = [(t, item) for side, t, item in stale if side]
+            reps = 20
+            start = time.perf_counter()
+            for _ in range(reps):
+                _legacy_greedy(exps, imgs, MATCH_TOLERANCE_SEC)
+            legacy = f"{(time.perf_counter() - start) / reps * 1e6:16.1f}"
+        print(f"{n:>10} {per_event:16.2f} {legacy:>16}")
+
+
+# ---------- Folder watcher ----------
+def _legacy_scan(folder, seen):
+    """The old App.scan_image_folder walk: iterdir + is_file + regex + stat per file."""
+    for p in Path(folder).iterdir():
+        if not p.is_file():
+            continue
+        if p.name in seen or not IMAGE_PATTERN.match(p.name):
+            continue
+        p.stat()
+        seen.add(p.name)
+
+
+def _tick_cpu(fn, reps):
+    start = time.process_time()
+    for _ in range(reps):
+        fn()
+    return (time.process_time() - start) / reps * 1e3
+
+
+def _latency(watcher, folder, trials, start_no):
+    """Time from a new file being written to the watch loop reporting it."""
+    out = []
+    for k in range(trials):
+        name = f"DSC{start_no + k:05d}.jpg"
+        written = []
+
+        def writer():
+            time.sleep(random.uniform(0.0, IMAGE_SCAN_INTERVAL_SEC))
+            written.append(time.perf_counter())
+            with open(os.path.join(folder, name), "wb") as f:
+                f.write(b"\xff\xd8")
+
+        th = threading.Thread(target=writer)
+        th.start()
+        while True:
+            watcher.wait(IMAGE_SCAN_INTERVAL_SEC)
+            if any(n == name for n, _ in watcher.poll()):
+                seen_at = time.perf_counter()
+                break
+        th.join()
+        out.append((seen_at - written[0]) * 1e3)
+    return statistics.median(out), max(out)
+
+
+def bench_watcher(files, trials=10):
+    folder = tempfile.mkdtemp(prefix="bench_watch_")
+    try:
+        print(f"filling {folder} with {files} files ...")
+        for k in range(files):
+            open(os.path.join(folder, f"DSC{k:05d}.jpg"), "wb").close()
+        # age the directory mtime so an idle tick is a true no-op
+        old = time.time() - 60
+        os.utime(folder, (old, old))
+
+        legacy_seen = set()
+        _legacy_scan(folder, legacy_seen)
+        print(f"{'backend':>10} {'idle tick ms CPU':>17} {'median latency ms':>18} {'max latency ms':>15}")
+        print(f"{'legacy':>10} {_tick_cpu(lambda: _legacy_scan(folder, legacy_seen), 3):17.2f}"
+              f" {IMAGE_SCAN_INTERVAL_SEC * 500:>18.0f} {IMAGE_SCAN_INTERVAL_SEC * 1000:>15.0f}  (expected, 300 ms timer)")
+
+        backends = [ScandirWatcher]
+        try:
+            InotifyWatcher(folder).close()
+            backends.append(InotifyWatcher)
+        except (OSError, AttributeError):
+            print("inotify not available here, skipping")
+        next_no = files
+        for cls in backends:
+            w = cls(folder)
+            w.snapshot()
+            os.utime(folder, (old, old))
+            w.poll()
+            idle = _tick_cpu(w.poll, 50)
+            med, worst = _latency(w, folder, trials, next_no)
+            next_no += trials
+            w.close()
+            print(f"{cls.name:>10} {idle:17.3f} {med:18.2f} {worst:15.2f}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# ---------- Seen-image index ----------
+def bench_index(sizes):
+    """Memory held by the seen-names record after n sequential files (a few out of order)."""
+    print(f"{'files':>10} {'set KiB':>10} {'index KiB':>10} {'index ns/check':>15}")
+    for n in sizes:
+        names = [f"DSC{k:05d}.jpg" for k in range(n)]
+        # every 50th pair arrives swapped, like two files finishing writes out of order
+        for k in range(0, n - 1, 50):
+            names[k], names[k + 1] = names[k + 1], names[k]
+
+        tracemalloc.start()
+        legacy = set(names)
+        set_kib = tracemalloc.get_traced_memory()[0] / 1024
+        del legacy
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        idx = ImageIndex()
+        for name in names:
+            idx.add(name)
+        idx_kib = tracemalloc.get_traced_memory()[0] / 1024
+        tracemalloc.stop()
+
+        probe = names[: min(n, 100000)]
+        start = time.perf_counter()
+        for name in probe:
+            name in idx
+        ns = (time.perf_counter() - start) / len(probe) * 1e9
+        print(f"{n:>10} {set_kib:10.0f} {idx_kib:10.1f} {ns:15.0f}")
+
+
+# ---------- RX framing ----------
+def _rx_payload(lines):
+    rnd = random.Random(2)
+    out = []
+    for k in range(lines):
+        if rnd.random() < 0.7:
+            out.append(f"EXPOSURE_COUNT {k}\n")
+        else:
+            out.append(f"RS485: ~comms status strobe=042 lamp=080 lamp_on=1 temp=23.{k % 10}C|SUBC24991\r\n")
+    return "".join(out).encode()
+
+
+def _legacy_rx(sock, on_line, counter):
+    """The old _rx_loop framing (1024-byte recv, buf += data, split per line), with copy accounting."""
+    buf = b""
+    while True:
+        data = sock.recv(1024)
+        if not data:
+            break
+        counter[0] += len(buf) + len(data)            # buf += data builds a new bytes
+        buf += data
+        while b"\n" in buf:
+            line, buf = buf.split(b"\n", 1)
+            counter[0] += len(line) + len(buf)        # split copies both halves
+            on_line(line.decode(errors="ignore").strip())
+            counter[0] += len(line)                   # decode
+
+
+def bench_rx(lines):
+    payload = _rx_payload(lines)
+    print(f"{lines} lines, {len(payload) / 1e6:.1f} MB through a local socketpair")
+    print(f"{'framing':>22} {'lines/s':>12} {'copied B/line':>14} {'callbacks':>10}")
+
+    def run(reader):
+        a, b = socket.socketpair()
+        th = threading.Thread(target=lambda: (b.sendall(payload), b.close()))
+        start = time.perf_counter()
+        th.start()
+        result = reader(a)
+        elapsed = time.perf_counter() - start
+        th.join()
+        a.close()
+        return elapsed, result
+
+    got = []
+    copied = [0]
+    elapsed, _ = run(lambda s: _legacy_rx(s, got.append, copied))
+    print(f"{'legacy (1024 B)':>22} {len(got) / elapsed:12.0f} {copied[0] / len(got):14.1f} {len(got):>10}")
+
+    for size in (1024, 16384, 65536):
+        got = []
+        calls = [0]
+        done = threading.Event()
+
+        def on_lines(batch):
+            calls[0] += 1
+            if batch == ["[Disconnected]"]:
+                done.set()
+            else:
+                got.extend(batch)
+
+        def reader(sock):
+            client = TcpClient(None, on_lines=on_lines, recv_size=size)
+            client.attach(sock)
+            done.wait()
+            return client
+
+        elapsed, client = run(reader)
+        # decode touches every line byte once; partial lines shifted to the front are the rest
+        line_bytes = sum(len(x) for x in got) + len(got) + client.framer.moved
+        print(f"{f'framer ({size} B)':>22} {len(got) / elapsed:12.0f}"
+              f" {line_bytes / len(got):14.1f} {calls[0]:>10}")
+
+
+# ---------- Slider streaming ----------
+def simulate_drag(rate, seconds=2.0, motion_hz=120, rtt=0.025):
+    """Drag a slider 0 -> 100 and back for `seconds` on a simulated clock.
+    Returns (motion events, commands sent, value acknowledged last, value released at)."""
+    clock = [0.0]
+    replies = []          # (due time, future)
+
+    def send(channel, value):
+        f = Future()
+        f.set_running_or_notify_cancel()
+        replies.append((clock[0] + rtt, f))
+        return f
+
+    cs = CoalescingSender(send, rate=rate, clock=lambda: clock[0])
+    events = int(seconds * motion_hz)
+    value = 0
+    # keep ticking a little past the release so the final value settles
+    for k in range(events + int(0.5 * motion_hz)):
+        clock[0] = k / motion_hz
+        for r in [r for r in replies if r[0] <= clock[0]]:
+            replies.remove(r)
+            r[1].set_result("OK STROBE_INTENSITY")
+        if k < events:
+            phase = k / events
+            value = int(round(100 * (2 * phase if phase < 0.5 else 2 - 2 * phase)))
+            cs.update("STROBE_INTENSITY", value)
+        else:
+            cs.pump()    # what the GUI's after() timer does
+    return events, cs.sent, cs.acked.get("STROBE_INTENSITY"), value
+
+
+def bench_slider():
+    print("simulated 2 s drag 0 -> 100 -> 0 at 120 motion events/s, 25 ms device reply")
+    print(f"{'mode':>22} {'commands':>9} {'final acked':>12}")
+    print(f"{'send every callback':>22} {240:>9} {'-':>12}")
+    print(f"{'release only (old)':>22} {1:>9} {'-':>12}")
+    for rate in (5, 10, 20):
+        events, sent, acked, final = simulate_drag(rate)
+        assert acked == final, (acked, final)
+        print(f"{f'coalesced @ {rate} Hz':>22} {sent:>9} {acked:>12}")
+
+
+# ---------- Exposure timeline ----------
+def simulate_timeline(poll_sec, fps=5.0, seconds=600, jitter=0.001, rtt=(0.005, 0.060), seed=3):
+    """Camera firing at `fps` (with jitter), polled every `poll_sec` over a link with random RTT.
+    Returns (old abs errors, new abs errors, new error bounds, frames the old way logged)."""
+    rnd = random.Random(seed)
+    frames = [k / fps + rnd.uniform(-jitter, jitter) for k in range(1, int(seconds * fps))]
+    tl = ExposureTimeline()
+    tl.reset(0.0)
+    old_err, new_err, bounds = [], [], []
+    old_logged = 0
+    last_count = 0
+    t = 0.0
+    i = 0
+    while t < seconds:
+        t += poll_sec * (1.0 + rnd.uniform(-EXPOSURE_POLL_DITHER, EXPOSURE_POLL_DITHER))
+        r = rnd.uniform(*rtt)
+        read_at = t + r * rnd.uniform(0.2, 0.8)       # when the Nano's loop got to it
+        while i < len(frames) and frames[i] <= read_at:
+            i += 1
+        count = i
+        replied = t + r
+        if count != last_count:
+            # old behaviour: one entry stamped at reply time, for the latest count only
+            old_err.append(abs(replied - frames[count - 1]))
+            old_logged += 1
+            last_count = count
+        for n, est, err in tl.observe(t, replied, count):
+            new_err.append(abs(est - frames[n - 1]))
+            bounds.append(err)
+    return old_err, new_err, bounds, old_logged, len(new_err)
+
+
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))] if xs else float("nan")
+
+
+def bench_timeline():
+    print("5 fps camera, 10 min, RTT 5-60 ms")
+    print(f"{'poll ms':>8} {'old frames':>11} {'old p50 ms':>11} {'old p99 ms':>11}"
+          f" {'new frames':>11} {'new p50 ms':>11} {'new p99 ms':>11} {'in bound':>9}")
+    for poll in (0.25, 0.5, 1.0, 2.0, 5.0):
+        old_err, new_err, bounds, old_n, new_n = simulate_timeline(poll)
+        inside = sum(1 for e, b in zip(new_err, bounds) if e <= b) / max(1, len(new_err))
+        print(f"{poll * 1000:8.0f} {old_n:>11} {_pct(old_err, .5) * 1e3:11.1f} {_pct(old_err, .99) * 1e3:11.1f}"
+              f" {new_n:>11} {_pct(new_err, .5) * 1e3:11.1f} {_pct(new_err, .99) * 1e3:11.1f} {inside:9.1%}")
+
+
+# ---------- Session CSV ----------
+def bench_csv(rows=20000):
+    folder = tempfile.mkdtemp(prefix="bench_csv_")
+    row = ["2025-01-01 12:00:00.000", 1, "2025-01-01 12:00:00.250", "DSC00001.jpg", 250, 12]
+    try:
+        print(f"{rows} rows into {folder}")
+        print(f"{'writer':>28} {'us/row':>8} {'flushes':>8}")
+        path = os.path.join(folder, "legacy.csv")
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerow(CSV_HEADER)
+        start = time.perf_counter()
+        for _ in range(rows):
+            # the old per-match pattern: reopen in append mode for every pair
+            with open(path, "a", newline="") as f:
+                csv.writer(f).writerow(row)
+        print(f"{'reopen per row (old)':>28} {(time.perf_counter() - start) / rows * 1e6:8.2f} {rows:>8}")
+
+        for label, kwargs in (("SessionWriter", {}),
+                              ("SessionWriter, fsync 1 s", {"fsync_sec": 1.0}),
+                              ("SessionWriter, rotate 256k", {"rotate_bytes": 256 * 1024})):
+            w = SessionWriter(os.path.join(folder, "session.csv"), **kwargs)
+            start = time.perf_counter()
+            for _ in range(rows):
+                w.write_rows([row])
+                w.tick()
+            w.close()
+            per_row = (time.perf_counter() - start) / rows * 1e6
+            print(f"{label:>28} {per_row:8.2f} {w.flushes:>8}   {w.stats()}, {w.part} file(s)")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# ---------- Backend pipeline stress ----------
+def bench_pipeline(fps, seconds):
+    folder = tempfile.mkdtemp(prefix="bench_pipe_")
+    sim = NanoSimulator(port=0, fps=fps, limit=fps * seconds).start()
+    cam = FakeCamera(folder, delay=0.15)
+    sim.add_listener(cam.on_exposure)
+    pipe = None
+    client = TcpClient(None, on_lines=lambda lines: pipe.on_lines(lines))
+    pipe = ExposurePipeline(client)
+    client.connect(*sim.address)
+    try:
+        pipe.start_run(os.path.join(folder, "exposure_log_bench.csv"), folder).result(5)
+
+        # stand-in for App._ui_tick: drain what the GUI would draw, at UI_FPS
+        ui_time, ui_worst, most_lines, ticks = 0.0, 0.0, 0, 0
+        end = time.monotonic() + seconds + 2.0
+        while time.monotonic() < end:
+            time.sleep(1.0 / UI_FPS)
+            t0 = time.perf_counter()
+            log, rx = pipe.log.drain(), pipe.rx.drain()
+            text = "\n".join(log) + "\n".join(rx)
+            stats = pipe.stats()
+            took = time.perf_counter() - t0
+            ui_time += took
+            ui_worst = max(ui_worst, took)
+            most_lines = max(most_lines, len(log) + len(rx))
+            ticks += 1
+        pipe.stop_run().result(5)
+        stats = pipe.stats()
+        wall = seconds + 2.0
+        print(f"camera {fps} fps for {seconds} s ({fps * 60} exposures/min)")
+        print(f"  exposures {stats['exposures']}, images {stats['images']}, pairs written {stats['pairs']},"
+              f" waiting {stats['pending_exposures']}/{stats['pending_images']}")
+        print(f"  backend busy {stats['busy_sec'] / wall * 1e3:.1f} ms/s")
+        print(f"  UI thread {ui_time / wall * 1e3:.2f} ms/s over {ticks} frames,"
+              f" worst frame {ui_worst * 1e3:.2f} ms, most lines in a frame {most_lines}")
+        print(f"  dropped log lines {pipe.log.dropped} (pane cap keeps UI work bounded)")
+    finally:
+        pipe.close()
+        client.close()
+        sim.close()
+        cam.close()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# ---------- Reconnect ----------
+def reconnect_run(mode, drops=5, fps=20, gap=2.0, stall=4.0):
+    """Break the link `drops` times ("close", "stall" or "reboot") during a run.
+    Returns (recovery seconds, exposures logged, exposures fired, csv gaps,
+    csv duplicates, strobe setting restored)."""
+    folder = tempfile.mkdtemp(prefix="bench_reconnect_")
+    sim = NanoSimulator(port=0, fps=fps).start()
+    cam = FakeCamera(folder, delay=0.1)
+    sim.add_listener(cam.on_exposure)
+    fired = [0]
+    sim.add_listener(lambda n, t: fired.__setitem__(0, fired[0] + 1))
+    pipe = None
+    client = TcpClient(None, on_lines=lambda lines: pipe.on_lines(lines))
+    pipe = ExposurePipeline(client)
+    sup = ConnectionSupervisor()
+    csv_path = os.path.join(folder, "exposure_log_bench.csv")
+    try:
+        client.connect(*sim.address)
+        sup.watch(client, *sim.address, pipe)
+        client.send_line("STROBE_INTENSITY 40")
+        pipe.start_run(csv_path, folder).result(5)
+        for k in range(drops):
+            time.sleep(gap)
+            if mode == "stall":
+                sim.stall(stall)
+            elif mode == "reboot":
+                sim.reboot()
+            else:
+                sim.drop_client()
+            # one outage at a time, so each recovery is timed on its own
+            deadline = time.monotonic() + 30
+            while len(sup.recoveries) <= k and time.monotonic() < deadline:
+                time.sleep(0.05)
+        time.sleep(1.0)
+        pipe.stop_run().result(5)
+        strobe_ok = sim.strobe_intensity == 40
+        counts = []
+        with open(csv_path, newline="") as f:
+            for row in csv.DictReader(f):
+                counts.append(int(row["ExposureCount"]))
+        gaps = sum(1 for a, b in zip(counts, counts[1:]) if b > a + 1)
+        dups = len(counts) - len(set(counts))
+        return sup.recoveries, pipe.count, fired[0], gaps, dups, strobe_ok
+    finally:
+        sup.close()
+        pipe.close()
+        client.close()
+        sim.close()
+        cam.close()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def bench_reconnect(drops=5, fps=20, gap=2.0, stall=4.0):
+    """Break the link on purpose and time how long until the new one answers.
+    Also checks that exposure numbering in the CSV stays continuous."""
+    print(f"{drops} drops per mode, {fps} fps, {gap:.0f} s after each recovery, stalls last {stall:.0f} s")
+    print(f"{'mode':>8} {'recovered':>10} {'p50 s':>7} {'max s':>7} {'exposures':>10} {'device':>7}"
+          f" {'csv gaps':>9} {'csv dups':>9}")
+    for mode in ("close", "stall", "reboot"):
+        rec, logged, fired, gaps, dups, strobe_ok = reconnect_run(mode, drops, fps, gap, stall)
+        print(f"{mode:>8} {len(rec):>4}/{drops:<5} {_pct(rec, .5):7.2f} {max(rec, default=float('nan')):7.2f}"
+              f" {logged:>10} {fired:>7} {gaps:>9} {dups:>9}"
+              f"{'' if strobe_ok else '  (strobe not restored)'}")
+
+
+# ---------- Exif timestamps ----------
+def _exif_pairing(source, fps, seconds, delay=0.3, jitter=0.08, drop=0.05, clock_offset=42.0):
+    """One simulated run; returns (pairs, wrong pairs, |Delta_ms| list)."""
+    folder = tempfile.mkdtemp(prefix="bench_exif_")
+    sim = NanoSimulator(port=0, fps=fps, limit=fps * seconds).start()
+    cam = FakeCamera(folder, delay=delay, jitter=jitter, drop=drop, seed=5, exif=True, clock_offset=clock_offset)
+    sim.add_listener(cam.on_exposure)
+    pipe = None
+    client = TcpClient(None, on_lines=lambda lines: pipe.on_lines(lines))
+    pipe = ExposurePipeline(client, image_timestamps=source)
+    csv_path = os.path.join(folder, "exposure_log_bench.csv")
+    try:
+        client.connect(*sim.address)
+        pipe.start_run(csv_path, folder).result(5)
+        time.sleep(seconds + delay + jitter + 1.0)
+        pipe.stop_run().result(5)
+        truth = {name: n for n, name, _ in cam.written}
+        with open(csv_path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        wrong = sum(1 for r in rows if truth.get(r["ImageFile"]) != int(r["ExposureCount"]))
+        return len(rows), wrong, [abs(int(r["Delta_ms"])) for r in rows]
+    finally:
+        pipe.close()
+        client.close()
+        sim.close()
+        cam.close()
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def bench_exif(files, body=256 * 1024, rates=(5, 20), seconds=20):
+    """Per-image cost of the Exif capture-time read, and what it does for pairing."""
+    folder = tempfile.mkdtemp(prefix="bench_exif_")
+    try:
+        filler = os.urandom(body)
+        now = time.time()
+        names = []
+        for k in range(files):
+            name = f"DSC{k:05d}.jpg"
+            with open(os.path.join(folder, name), "wb") as f:
+                f.write(exif_jpeg(now + k * 0.05, pad=16384)[:-2] + filler + b"\xff\xd9")
+            names.append(name)
+        paths = [os.path.join(folder, n) for n in names]
+        print(f"{files} files of {(body + 16384) // 1024} KB (page cache warm)")
+
+        took = []
+        for p in paths:
+            t0 = time.perf_counter()
+            read_exif_time(p)
+            took.append(time.perf_counter() - t0)
+        print(f"  read_exif_time      p50 {_pct(took, .5) * 1e6:7.1f} us   p99 {_pct(took, .99) * 1e6:7.1f} us")
+
+        reader = ExifReader()
+        for label in ("reader, first read", "reader, cache hit"):
+            took = []
+            for p in paths:
+                t0 = time.perf_counter()
+                reader.capture_time(p)
+                took.append(time.perf_counter() - t0)
+            print(f"  {label:<19} p50 {_pct(took, .5) * 1e6:7.1f} us   p99 {_pct(took, .99) * 1e6:7.1f} us")
+        reader.close()
+
+        # what a scan tick pays: hand a batch to the pool and return
+        reader = ExifReader()
+        found = [(n, 0.0) for n in names]
+        done = threading.Event()
+        t0 = time.perf_counter()
+        reader.submit(folder, found, lambda results: done.set())
+        queued = time.perf_counter() - t0
+        done.wait(60)
+        total = time.perf_counter() - t0
+        reader.close()
+        print(f"  submit {files} files: scan thread blocked {queued * 1e3:.1f} ms,"
+              f" all read after {total * 1e3:.0f} ms ({total / files * 1e6:.1f} us/image)")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    print(f"pairing for {seconds} s, file written 0.3 +/- 0.08 s after the exposure,"
+          f" 5% frames dropped, camera clock 42 s off")
+    print(f"{'fps':>4} {'timestamps':>11} {'pairs':>6} {'wrong':>6} {'|delta| p50':>12} {'p99 ms':>7}")
+    for fps in rates:
+        for source in ("mtime", "exif"):
+            pairs, wrong, deltas = _exif_pairing(source, fps, seconds)
+            print(f"{fps:>4} {source:>11} {pairs:>6} {wrong:>6} {_pct(deltas, .5):>12.0f} {_pct(deltas, .99):>7.0f}")
+
+
+# ---------- Offline re-pairing ----------
+def _mispaired_frames(n, fps=5.0, lag=0.3, jitter=0.08, drop=0.05, seed=11):
+    """Exposure times, (image time, name) sorted, and {image name: true exposure count}."""
+    rnd = random.Random(seed)
+    t0 = datetime.datetime(2024, 5, 1, 10, 0, 0).timestamp()
+    exps, imgs, truth = [], [], {}
+    for k in range(1, n + 1):
+        t = t0 + k / fps + rnd.uniform(-0.002, 0.002)
+        exps.append(t)
+        if rnd.random() >= drop:
+            name = f"DSC{len(imgs) + 1:07d}.jpg"
+            imgs.append((t + lag + rnd.uniform(-jitter, jitter), name))
+            truth[name] = str(k)
+    imgs.sort()
+    return exps, imgs, truth
+
+
+def _mispaired_session(path, n, fps=5.0, lag=0.3, jitter=0.08, drop=0.05, seed=11):
+    """Write a session CSV whose images were handed out in order, so every
+    dropped frame shifts the rest by one (what a bad live run looks like).
+    Returns {image name: true exposure count}."""
+    exps, imgs, truth = _mispaired_frames(n, fps, lag, jitter, drop, seed)
+    fmt = lambda x: datetime.datetime.fromtimestamp(x).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(CSV_HEADER)
+        for k, t in enumerate(exps):
+            if k < len(imgs):
+                its, name = imgs[k]
+                w.writerow([fmt(t), k + 1, fmt(its), name, int(round((its - t) * 1000)), 3])
+            else:
+                w.writerow([fmt(t), k + 1, "", "", "", 3])
+    return truth
+
+
+def _mispaired_db(path, n, seed=11):
+    """The same session in a session database: every exposure and image, with
+    the live pairs shifted as in the CSV. Returns the truth map."""
+    exps, imgs, truth = _mispaired_frames(n, seed=seed)
+    store = SessionStore(path)
+    run = store.begin_run("", "exposure_log.csv", None, exps[0])
+    store.add_exposures([(run, k + 1, t, 3.0) for k, t in enumerate(exps)])
+    store.add_images([(run, name, t, None) for t, name in imgs])
+    store.add_pairs([(run, k + 1, name, et, it, int(round((it - et) * 1000)), 3.0)
+                     for k, (et, (it, name)) in enumerate(zip(exps, imgs))])
+    store.close(timeout=None)
+    return truth
+
+
+def _mispaired_session(path, n, fps=5.0, lag=0.3, jitter=0.08, drop=0.05, seed=11):
+    """Write a session CSV whose images were handed out in order, so every
+    dropped frame shifts the rest by one (what a bad live run looks like).
+    Returns {image name: true exposure count}."""
+    exps, imgs, truth = _mispaired_frames(n, fps, lag, jitter, drop, seed)
+    fmt = lambda x: datetime.datetime.fromtimestamp(x).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(CSV_HEADER)
+        for k, t in enumerate(exps):
+            if k < len(imgs):
+                its, name = imgs[k]
+                w.writerow([fmt(t), k + 1, fmt(its), name, int(round((its - t) * 1000)), 3])
+            else:
+                w.writerow([fmt(t), k + 1, "", "", "", 3])
+    return truth
+
+
+def _repair_check(summary, truth):
+    wrong = 0
+    with open(summary["output"], newline="") as f:
+        for row in csv.DictReader(f):
+            wrong += truth.get(row["ImageFile"]) != row["ExposureCount"]
+    return wrong
+
+
+def bench_repair(sizes, sessions=8):
+    """Re-pair mis-paired sessions from their own CSV and from a session
+    database: time per size, with NumPy (if installed) and with the bisect
+    fallback, then several sessions on a pool."""
+    folder = tempfile.mkdtemp(prefix="bench_repair_")
+    try:
+        print("5 fps, images 0.3 +/- 0.08 s after their exposure, 5% frames dropped, input pairs shifted")
+        print(f"{'exposures':>10} {'input':>6} {'matcher':>8} {'pairs':>9} {'wrong':>6} {'in csv':>7} {'lag ms':>7}"
+              f" {'seconds':>8}")
+        numpy = repair.np
+        for n in sizes:
+            path = os.path.join(folder, f"exposure_log_{n}.csv")
+            truth = _mispaired_session(path, n)
+            in_csv = _repair_check({"output": path}, truth)
+            db = os.path.join(folder, f"sessions_{n}.db")
+            _mispaired_db(db, n)
+            for source, run in (("csv", None), ("db", 1)):
+                src = path if run is None else db
+                for name, mod in (("numpy", numpy), ("bisect", None)):
+                    if name == "numpy" and mod is None:
+                        continue
+                    repair.np = mod
+                    t0 = time.perf_counter()
+                    summary = repair.repair_session(src, out_dir=folder, run=run)
+                    took = time.perf_counter() - t0
+                    print(f"{n:>10} {source:>6} {name:>8} {summary['pairs']:>9} {_repair_check(summary, truth):>6}"
+                          f" {in_csv:>7} {summary['lag_ms']:>7.0f} {took:>8.2f}")
+        repair.np = numpy
+        if numpy is None:
+            print("  (numpy not installed: bisect fallback only)")
+
+        n = min(sizes[-1], 100000)
+        paths = []
+        for k in range(sessions):
+            paths.append(os.path.join(folder, f"exposure_log_pool{k}.csv"))
+            _mispaired_session(paths[-1], n, seed=k)
+        for jobs in sorted({1, os.cpu_count() or 1}):
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                repair.main(paths + ["--jobs", str(jobs)])
+            print(f"  {sessions} sessions x {n} exposures, {jobs} process(es): {time.perf_counter() - t0:.2f} s")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# ---------- Several units ----------
+_SIM_FARM = """
+import os, sys, time
+sys.path.insert(0, {here!r})
+from simulator import NanoSimulator, FakeCamera
+n, fps, root = int(sys.argv[1]), float(sys.argv[2]), sys.argv[3]
+keep = []
+for k in range(n):
+    folder = os.path.join(root, f"cam{{k}}")
+    os.makedirs(folder)
+    sim = NanoSimulator(port=0, fps=fps).start()
+    cam = FakeCamera(folder, delay=0.1)
+    sim.add_listener(cam.on_exposure)
+    keep.append((sim, cam))
+    print(sim.address[1], folder, flush=True)
+sys.stdin.read()
+"""
+
+
+def _units_run(mode, n, fps, seconds):
+    """n simulated units in a child process; returns (threads, client CPU s, pairs)."""
+    root = tempfile.mkdtemp(prefix="bench_units_")
+    here = os.path.dirname(os.path.abspath(__file__))
+    farm = subprocess.Popen([sys.executable, "-c", _SIM_FARM.format(here=here), str(n), str(fps), root],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        units = [farm.stdout.readline().split(" ", 1) for _ in range(n)]
+        before = threading.active_count()
+        if mode == "shared":
+            mgr = SessionManager()
+            for k, (port, folder) in enumerate(units):
+                mgr.add_unit(f"u{k}", "127.0.0.1", int(port), folder.strip())
+            for f in mgr.connect_all().values():
+                f.result(5)
+            pipes = [u.pipeline for u in mgr.units.values()]
+            closers = [mgr.close]
+        else:
+            pipes, closers = [], []
+            for port, folder in units:
+                pipe = None
+                client = TcpClient(None, on_lines=lambda lines, p=pipes, k=len(pipes): p[k].on_lines(lines))
+                pipe = ExposurePipeline(client)
+                pipes.append(pipe)
+                client.connect("127.0.0.1", int(port))
+                closers += [pipe.close, client.close]
+        for (port, folder), pipe in zip(units, pipes):
+            pipe.start_run(os.path.join(root, f"log_{port}.csv"), folder.strip()).result(5)
+        cpu0 = time.process_time()
+        time.sleep(seconds)
+        cpu = time.process_time() - cpu0
+        threads = threading.active_count() - before
+        for pipe in pipes:
+            pipe.stop_run().result(5)
+        pairs = sum(p.stats()["pairs"] for p in pipes)
+        for close in closers:
+            close()
+        return threads, cpu, pairs
+    finally:
+        farm.stdin.close()
+        farm.wait()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_units(counts, fps, seconds):
+    print(f"{fps} fps per unit, {seconds} s; simulators run in a child process so only client CPU is counted")
+    print(f"{'mode':>18} {'units':>6} {'threads':>8} {'CPU ms/s':>9} {'per unit':>9} {'pairs':>7}")
+    for n in counts:
+        for mode in ("thread per unit", "shared"):
+            threads, cpu, pairs = _units_run(mode, n, fps, seconds)
+            print(f"{mode:>18} {n:>6} {threads:>8} {cpu / seconds * 1e3:9.1f}"
+                  f" {cpu / seconds * 1e3 / n:9.2f} {pairs:>7}")
+
+
+# ---------- Traffic capture / replay ----------
+def _replay_rows(path):
+    with open(path, newline="") as f:
+        return [(r["ExposureCount"], r["ImageFile"], r["Delta_ms"]) for r in csv.DictReader(f)]
+
+
+def same_rows(live, replayed):
+    """Rows pairing the same exposure and image. Capture times are stored to the
+    microsecond, so a Delta_ms that sat on a rounding boundary live may come
+    back 1 ms off; that still counts as the same."""
+    return sum(a[:2] == b[:2] and abs(int(a[2]) - int(b[2])) <= 1 for a, b in zip(live, replayed))
+
+
+def record_and_replay(folder, fps, seconds, speeds=(0,)):
+    """Record a live run against the simulator, then replay its capture at each
+    speed. Returns (live rows, capture, [(speed, TrafficReplay, rows)])."""
+    cam_dir = os.path.join(folder, "cam")
+    os.mkdir(cam_dir)
+    sim = NanoSimulator(port=0, fps=fps, limit=fps * seconds).start()
+    cam = FakeCamera(cam_dir, delay=0.3, jitter=0.05, drop=0.05, seed=5)
+    sim.add_listener(cam.on_exposure)
+    pipe = None
+    client = TcpClient(None, on_lines=lambda lines: pipe.on_lines(lines))
+    pipe = ExposurePipeline(client, capture=TrafficCapture(os.path.join(folder, "cap")))
+    client.connect(*sim.address)
+    live_csv = os.path.join(folder, "live.csv")
+    try:
+        pipe.start_run(live_csv, cam_dir).result(5)
+        time.sleep(seconds + 1.0)
+        pipe.stop_run().result(5)
+        time.sleep(0.2)
+    finally:
+        pipe.close()
+        client.close()
+        sim.close()
+        cam.close()
+    replays = []
+    for speed in speeds:
+        out = os.path.join(folder, f"replay_{speed}")
+        os.mkdir(out)
+        rpipe = None
+        rclient = ReplayClient(None, on_lines=lambda lines: rpipe.on_lines(lines))
+        rpipe = ExposurePipeline(rclient)
+        replay = TrafficReplay(capture_files(pipe.capture.base), rpipe, speed, out).run()
+        rpipe.close()
+        replays.append((speed, replay, _replay_rows(replay.csv_paths[0])))
+    return _replay_rows(live_csv), pipe.capture, replays
+
+
+def bench_capture(fps, seconds, events=200000):
+    folder = tempfile.mkdtemp(prefix="bench_cap_")
+    try:
+        cap = TrafficCapture(os.path.join(folder, "synthetic"), keep_files=0)
+        start = time.perf_counter()
+        for i in range(events // 2):
+            cap.sent("GET_EXPOSURE_COUNT")
+            cap.received([f"EXPOSURE_COUNT {i}"])
+        took = time.perf_counter() - start
+        cap.close()
+        print(f"capture: {took / cap.events * 1e6:.2f} us/event, {cap.bytes / cap.events:.1f} B/event "
+              f"(7 B header) over {cap.events} poll lines")
+
+        live, capture, replays = record_and_replay(folder, fps, seconds, speeds=(0, 10))
+        print(f"recorded {fps} fps for {seconds} s: {capture.stats()}")
+        print(f"{'speed':>6} {'events':>7} {'seconds':>8} {'x real time':>12} {'pairs':>6} {'same as live':>13}")
+        for speed, replay, rows in replays:
+            same = same_rows(live, rows)
+            print(f"{speed or 'max':>6} {replay.events:>7} {replay.seconds:8.2f} "
+                  f"{replay.span / replay.seconds:12.1f} {len(rows):>6} {same:>6}/{len(live)}")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# ---------- Sequencer ----------
+def _chained_sends(client, steps):
+    """The after()-chain way: send, then sleep one interval; returns the send errors (ms)."""
+    start = time.monotonic()
+    futures = []
+    for k, (offset, cmd) in enumerate(steps):
+        futures.append((offset, client.send_line(cmd)))
+        if k + 1 < len(steps):
+            time.sleep(steps[k + 1][0] - offset)
+    errors = []
+    for offset, f in futures:
+        f.result(5)
+        errors.append((f.sent_at - start - offset) * 1e3)
+    return errors
+
+
+def bench_sequencer(steps, intervals=(0.01, 0.005, 0.001), latency=0.002, jitter=0.001):
+    sim = NanoSimulator(port=0, latency=latency, jitter=jitter, seed=2).start()
+    client = TcpClient(lambda line: None)
+    client.connect(*sim.address)
+    try:
+        print(f"{steps} STROBE_INTENSITY steps, Nano reply latency {latency * 1e3:.0f} +/- {jitter * 1e3:.0f} ms")
+        print(f"{'interval':>9} {'scheduler':>14} {'sent':>6} {'skipped':>8} "
+              f"{'|err| p50':>10} {'p99':>7} {'max':>7} {'last step':>10}")
+        for interval in intervals:
+            plan = [(k * interval, f"STROBE_INTENSITY {k % 101}") for k in range(steps)]
+            rows = []
+            if interval >= 0.005:
+                errs = _chained_sends(client, plan)
+                rows.append(("chained sleep", len(errs), 0, errs))
+            seq = Sequencer(client, plan).start()
+            seq.wait()
+            skipped = sum(1 for r in seq.results if r and r[4] == "skipped")
+            rows.append(("Sequencer", len(seq.errors_ms()), skipped, seq.errors_ms()))
+            for name, sent, skipped, errs in rows:
+                a = sorted(abs(e) for e in errs)
+                print(f"{interval * 1e3:7.0f}ms {name:>14} {sent:>6} {skipped:>8} {_pct(a, .5):10.2f}"
+                      f" {_pct(a, .99):7.2f} {a[-1]:7.2f} {errs[-1]:+10.2f}")
+    finally:
+        client.close()
+        sim.close()
+
+
+# ---------- Session store ----------
+def _fill_store(store, frames, run_frames=100000, fps=20.0, days=30, seed=4):
+    """Feed `frames` exposures through the store the way a live run does (one
+    add call per event) and return the per-call times (us). Runs are spread over
+    `days`; ~5% of exposures and ~3% of images stay unmatched, ~0.2% of pairs
+    are more than 500 ms apart."""
+    rnd = random.Random(seed)
+    t0 = time.time() - days * 86400
+    runs = max(1, frames // run_frames)
+    gap = days * 86400 / runs
+    calls = []
+    clock = time.perf_counter
+    for r in range(runs):
+        started = t0 + r * gap
+        run = store.begin_run("port" if r % 2 else "stbd", f"exposure_log_{r}.csv", "cam", started)
+        for k in range(1, min(run_frames, frames - r * run_frames) + 1):
+            ets = started + k / fps
+            a = clock()
+            store.add_exposures([(run, k, ets, rnd.gauss(0, 20))])
+            b = clock()
+            calls.append(b - a)
+            if rnd.random() < 0.05:
+                continue
+            its = ets + rnd.gauss(0.2, 0.03) + (rnd.choice((-0.6, 0.6)) if rnd.random() < 0.002 else 0.0)
+            name = f"DSC{k:07d}.jpg"
+            a = clock()
+            store.add_images([(run, name, its, None)])
+            b = clock()
+            calls.append(b - a)
+            if rnd.random() < 0.03:
+                continue
+            a = clock()
+            store.add_pairs([(run, k, name, ets, its, int(round((its - ets) * 1e3)), None)])
+            calls.append(clock() - a)
+        store.end_run(run, started + run_frames / fps)
+    return [c * 1e6 for c in calls]
+
+
+def _timed_query(fn, reps=5):
+    times = []
+    for _ in range(reps):
+        start = time.perf_counter()
+        result = fn()
+        times.append((time.perf_counter() - start) * 1e3)
+    return min(times), result
+
+
+def bench_store(sizes):
+    folder = tempfile.mkdtemp(prefix="bench_db_")
+    try:
+        print(f"{'exposures':>10} {'rows':>9} {'rows/s':>9} {'add us p50':>10} {'p99':>7} {'commits':>8} "
+              f"{'MB':>6} | query ms: {'|d|>500 7d':>10} {'unmatched':>9} {'export':>7} {'1h':>6}")
+        for n in sizes:
+            path = os.path.join(folder, f"s{n}.db")
+            store = SessionStore(path)
+            start = time.perf_counter()
+            calls = _fill_store(store, n)
+            store.close(timeout=None)
+            took = time.perf_counter() - start
+            calls.sort()
+            size = sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p)) / 1e6
+
+            db = sqlite3.connect(path)
+            week = time.time() - 7 * 86400
+            last = db.execute("SELECT MAX(id) FROM runs").fetchone()[0]
+            q_delta, found = _timed_query(lambda: query_pairs(db, since=week, min_abs_delta_ms=500))
+            q_lone, _ = _timed_query(lambda: unmatched(db, last))
+            out = os.path.join(folder, "export.csv")
+            q_export, exported = _timed_query(lambda: export_run_csv(db, last, out), reps=2)
+            end = db.execute("SELECT MAX(exposure_ts) FROM pairs").fetchone()[0]
+            q_hour, _ = _timed_query(lambda: query_pairs(db, since=end - 3600, until=end))
+            plan = db.execute("EXPLAIN QUERY PLAN SELECT * FROM pairs p WHERE +p.exposure_ts >= ? "
+                              "AND (p.delta_ms > 500 OR p.delta_ms < -500)", (week,)).fetchall()
+            db.close()
+            print(f"{n:>10} {store.rows_written:>9} {store.rows_written / took:>9.0f} {_pct(calls, .5):10.2f} "
+                  f"{_pct(calls, .99):7.2f} {store.commits:>8} {size:6.1f} |           {q_delta:10.1f} "
+                  f"{q_lone:9.1f} {q_export:7.1f} {q_hour:6.1f}   ({len(found)} pairs >500 ms, "
+                  f"{exported} exported)")
+        print("|d|>500 plan: " + "; ".join(row[-1] for row in plan))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+# ---------- Suite (machine-readable, for comparing commits) ----------
+SUITE_QUICK = {"rx": [10000, 100000], "pairing": [100, 10000], "scan": [1000, 10000],
+               "e2e": [20, 50], "e2e_seconds": 3}
+SUITE_FULL = {"rx": [10000, 100000, 1000000], "pairing": [100, 10000, 1000000],
+              "scan": [1000, 10000, 100000], "e2e": [20, 50, 100], "e2e_seconds": 8}
+
+
+def _result(ops, seconds, unit, samples, peak):
+    """One suite entry: throughput, per-op latency percentiles (us) and peak traced memory."""
+    return {"throughput": round(ops / seconds, 1) if seconds else None, "unit": unit,
+            "p50_us": round(_pct(samples, .5) * 1e6, 2), "p99_us": round(_pct(samples, .99) * 1e6, 2),
+            "peak_kib": round(peak / 1024, 1), "n": ops}
+
+
+def _traced(fn, *args):
+    """Run fn under tracemalloc; return (fn's result, peak bytes)."""
+    tracemalloc.start()
+    try:
+        out = fn(*args)
+        return out, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def suite_rx(lines, chunk=1000):
+    """Lines/s through TcpClient; latency is chunk sent -> its last line delivered."""
+    payload = _rx_payload(lines).split(b"\n")[:-1]
+    chunks = [b"\n".join(payload[i:i + chunk]) + b"\n" for i in range(0, len(payload), chunk)]
+
+    def run():
+        a, b = socket.socketpair()
+        sent, got = [], []
+        count = [0]
+        done = threading.Event()
+
+        def on_lines(batch):
+            if batch == ["[Disconnected]"]:
+                done.set()
+                return
+            before = count[0]
+            count[0] += len(batch)
+            now = time.perf_counter()
+            got.extend([now] * (count[0] // chunk - before // chunk))
+
+        def sender():
+            for c in chunks:
+                sent.append(time.perf_counter())
+                b.sendall(c)
+            b.close()
+
+        client = TcpClient(None, on_lines=on_lines)
+        start = time.perf_counter()
+        client.attach(a)
+        th = threading.Thread(target=sender)
+        th.start()
+        done.wait()
+        elapsed = time.perf_counter() - start
+        th.join()
+        client.close()
+        return count[0], elapsed, [r - s for s, r in zip(sent, got)]
+
+    n, elapsed, lat = run()
+    _, peak = _traced(run)
+    return _result(n, elapsed, "lines/s", lat, peak)
+
+
+def suite_pairing(backlog, events=20000):
+    """Per-event PairingEngine cost with `backlog` stale items waiting on each side and the
+    live pairs matching inside it (see _pairing_workload)."""
+    stale, live = _pairing_workload(backlog, events)
+
+    def run():
+        eng = PairingEngine(MATCH_TOLERANCE_SEC, expiry=None)
+        _feed_pairing(eng, stale)
+        times = []
+        clock = time.perf_counter
+        for side, t, item in live:
+            a = clock()
+            if side:
+                eng.add_image(t, item)
+            else:
+                eng.add_exposure(t, item)
+            times.append(clock() - a)
+        return times
+
+    times = run()
+    _, peak = _traced(run)
+    return _result(len(times), sum(times), "events/s", times, peak)
+
+
+def suite_scan(files, trials=200):
+    """Cost of one ScandirWatcher poll that finds a single new file in a folder of `files`."""
+    folder = tempfile.mkdtemp(prefix="bench_suite_scan_")
+    try:
+        for k in range(files):
+            open(os.path.join(folder, f"DSC{k:05d}.jpg"), "wb").close()
+
+        def run(start_no):
+            w = ScandirWatcher(folder)
+            w.snapshot()
+            times = []
+            for k in range(trials):
+                open(os.path.join(folder, f"DSC{start_no + k:05d}.jpg"), "wb").close()
+                a = time.perf_counter()
+                w.poll()
+                times.append(time.perf_counter() - a)
+            return times
+
+        times = run(files)
+        _, peak = _traced(run, files + trials)
+        return _result(len(times), sum(times), "polls/s", times, peak)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def suite_e2e(fps, seconds):
+    """Simulated Nano + camera through ExposurePipeline; latency is image file written ->
+    CSV row handed to the writer, throughput is rows per second of backend CPU."""
+    folder = tempfile.mkdtemp(prefix="bench_suite_e2e_")
+    sim = NanoSimulator(port=0, fps=fps, limit=int(fps * seconds)).start()
+    cam = FakeCamera(folder, delay=0.15)
+    sim.add_listener(cam.on_exposure)
+    pipe = None
+    client = TcpClient(None, on_lines=lambda lines: pipe.on_lines(lines))
+    pipe = ExposurePipeline(client)
+    rows_at = {}
+    write_pairs = pipe._write_pairs
+
+    def timed_write(pairs):
+        now = time.monotonic()
+        for _, (_, fname) in pairs:
+            rows_at[fname] = now
+        write_pairs(pairs)
+    pipe._write_pairs = timed_write
+
+    tracemalloc.start()
+    try:
+        client.connect(*sim.address)
+        pipe.start_run(os.path.join(folder, "exposure_log_bench.csv"), folder).result(5)
+        end = time.monotonic() + seconds + 2.0
+        while time.monotonic() < end:
+            time.sleep(0.1)
+            pipe.log.drain()
+            pipe.rx.drain()
+        pipe.stop_run().result(5)
+        peak = tracemalloc.get_traced_memory()[1]
+        stats = pipe.stats()
+    finally:
+        tracemalloc.stop()
+        pipe.close()
+        client.close()
+        sim.close()
+        cam.close()
+        shutil.rmtree(folder, ignore_errors=True)
+    lat = [rows_at[name] - t for _, name, t in cam.written if name in rows_at]
+    out = _result(stats["pairs"], stats["busy_sec"], "rows/cpu-s", lat, peak)
+    out["unpaired"] = len(cam.written) - len(lat)
+    return out
+
+
+def run_suite(quick):
+    plan = SUITE_QUICK if quick else SUITE_FULL
+    results = {}
+
+    def record(name, fn, *args):
+        print(f"  {name} ...", end="", flush=True)
+        results[name] = r = fn(*args)
+        print(f" {r['throughput']} {r['unit']}, p50 {r['p50_us']} us, p99 {r['p99_us']} us,"
+              f" peak {r['peak_kib']} KiB")
+
+    for n in plan["rx"]:
+        record(f"rx/{n}", suite_rx, n)
+    for n in plan["pairing"]:
+        record(f"pairing/{n}", suite_pairing, n)
+    for n in plan["scan"]:
+        record(f"scan/{n}", suite_scan, n)
+    for fps in plan["e2e"]:
+        record(f"e2e/{fps}fps", suite_e2e, fps, plan["e2e_seconds"])
+    return results
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, timeout=10,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def bench_suite(quick, out, baseline, tolerance):
+    commit = _git("rev-parse", "--short", "HEAD") or "unknown"
+    meta = {"commit": commit, "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "when": datetime.datetime.now().isoformat(timespec="seconds"), "quick": quick,
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()}
+    print(f"suite at {commit}{' (dirty)' if meta['dirty'] else ''}, {'quick' if quick else 'full'}")
+    doc = {"meta": meta, "results": run_suite(quick)}
+    out = out or f"bench-{commit}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=2)
+    print(f"wrote {out}")
+    if baseline:
+        return compare_results(baseline, out, tolerance)
+    return 0
+
+
+def compare_results(old_path, new_path, tolerance):
+    """Print old vs new per case; exit status 1 if any hot path got slower by more than `tolerance`."""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['meta']['commit']} -> {new['meta']['commit']} (regression if worse than {tolerance:.0%})")
+    print(f"{'case':>18} {'metric':>11} {'old':>12} {'new':>12} {'change':>8}")
+    bad = 0
+    for name, r in new["results"].items():
+        o = old["results"].get(name)
+        if not o:
+            print(f"{name:>18} {'(new case)':>11}")
+            continue
+        # higher is better for throughput, lower for latency and memory
+        for key, higher_better in (("throughput", True), ("p50_us", False), ("p99_us", False), ("peak_kib", False)):
+            a, b = o.get(key), r.get(key)
+            if not a or b is None:
+                continue
+            change = b / a - 1.0
+            worse = -change if higher_better else change
+            flag = "  REGRESSION" if worse > tolerance else ""
+            bad += bool(flag)
+            print(f"{name:>18} {key:>11} {a:12.2f} {b:12.2f} {change:+8.1%}{flag}")
+    return 1 if bad else 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("which", choices=["pairing", "watcher", "index", "rx", "slider", "timeline", "csv", "pipeline",
+                                      "reconnect", "exif", "repair", "units", "capture", "sequencer", "store", "suite",
+                                      "compare"])
+    ap.add_argument("files", nargs="*", help="old.json new.json (compare)")
+    ap.add_argument("--sizes", default="100,1000,10000,100000,1000000",
+                    help="comma-separated sizes (pairing backlog, index file count)")
+    ap.add_argument("--lines", type=int, default=200000, help="lines to push through the socket (rx)")
+    ap.add_argument("--fps", type=int, default=100, help="simulated camera rate (pipeline)")
+    ap.add_argument("--seconds", type=int, default=10, help="simulated run length (pipeline)")
+    ap.add_argument("--steps", type=int, default=2000, help="steps per sequence (sequencer)")
+    ap.add_argument("--nfiles", dest="nfiles", type=int, default=100000, help="files in the temp folder (watcher, exif)")
+    ap.add_argument("--quick", action="store_true", help="smaller sizes and shorter runs (suite)")
+    ap.add_argument("--out", help="results file (suite, default bench-<commit>.json)")
+    ap.add_argument("--baseline", help="earlier results file to compare against (suite)")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging (suite, compare)")
+    args = ap.parse_args()
+    if args.which == "pairing":
+        bench_pairing([int(x) for x in args.sizes.split(",")])
+    elif args.which == "watcher":
+        bench_watcher(args.nfiles)
+    elif args.which == "index":
+        bench_index([int(x) for x in args.sizes.split(",")])
+    elif args.which == "rx":
+        bench_rx(args.lines)
+    elif args.which == "slider":
+        bench_slider()
+    elif args.which == "timeline":
+        bench_timeline()
+    elif args.which == "csv":
+        bench_csv()
+    elif args.which == "pipeline":
+        bench_pipeline(args.fps, args.seconds)
+    elif args.which == "reconnect":
+        bench_reconnect()
+    elif args.which == "exif":
+        bench_exif(min(args.nfiles, 5000))
+    elif args.which == "repair":
+        sizes = args.sizes if args.sizes != ap.get_default("sizes") else "10000,100000,1000000"
+        bench_repair([int(x) for x in sizes.split(",")])
+    elif args.which == "units":
+        sizes = args.sizes if args.sizes != ap.get_default("sizes") else "1,4,16"
+        bench_units([int(x) for x in sizes.split(",")], args.fps, min(args.seconds, 5))
+    elif args.which == "capture":
+        bench_capture(args.fps if args.fps != ap.get_default("fps") else 20, args.seconds)
+    elif args.which == "sequencer":
+        bench_sequencer(args.steps)
+    elif args.which == "store":
+        sizes = args.sizes if args.sizes != ap.get_default("sizes") else "100000,1000000"
+        bench_store([int(x) for x in sizes.split(",")])
+    elif args.which == "suite":
+        sys.exit(bench_suite(args.quick, args.out, args.baseline, args.tolerance))
+    elif args.which == "compare":
+        if len(args.files) != 2:
+            ap.error("compare needs old.json new.json")
+        sys.exit(compare_results(args.files[0], args.files[1], args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,529 @@
+"""
+Tkinter front end. Imported only when main.py runs in GUI mode, so headless
+runs never load Tk.
+"""
+import os
+import datetime
+import threading
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog
+
+from main import (DEFAULT_HOST, DEFAULT_PORT, DEFAULT_IMAGE_DIR, MANUAL_FILENAME, UI_FPS,
+                  LOG_MAX_LINES, RX_MAX_LINES, LineQueue, TcpClient, CoalescingSender,
+                  ExposurePipeline, MetricsExporter, METRICS_PORT, resource_path, open_file_with_default_app,
+                  SessionManager, ConnectionSupervisor, parse_unit, fanout_report, IMAGE_TIMESTAMPS,
+                  CAPTURE_DIR, TrafficCapture, ReplayClient, TrafficReplay, capture_files,
+                  Sequencer, load_sequence, SessionStore, SESSION_DB)
+
+
+def format_metrics(snap):
+    """One line for the Stats panel."""
+    c, h = snap["counters"], snap["histograms"]
+
+    def q(name, key, scale=1.0, fmt="{:.0f}"):
+        v = h[name][key]
+        return "-" if v is None else fmt.format(v * scale)
+
+    return (f"exposures {c['exposures_total']}  images {c['images_total']}  pairs {c['pairs_total']}  "
+            f"expired {c['expired_exposures_total']}/{c['expired_images_total']}  "
+            f"reconnects {c['reconnects_total']}  timeouts {c['command_timeouts_total']}   |   "
+            f"Δ p50 {q('delta_ms', 'p50')} / p99 {q('delta_ms', 'p99')} ms   "
+            f"poll p99 {q('poll_rtt_seconds', 'p99', 1e3)} ms   "
+            f"scan p99 {q('scan_seconds', 'p99', 1e3, '{:.1f}')} ms   "
+            f"UI queue p99 {q('ui_queue_depth', 'p99')}")
+
+
+class App(tk.Tk):
+    def __init__(self, image_timestamps=IMAGE_TIMESTAMPS, capture_dir=CAPTURE_DIR, replay=None, replay_speed=1.0,
+                 db=SESSION_DB, metrics_port=METRICS_PORT):
+        """With `replay` (a .aqcap path) the window shows that capture played
+        back at replay_speed instead of talking to a controller. With `db`,
+        runs are also recorded in that SQLite file. With `metrics_port`,
+        metrics are served on that localhost port."""
+        super().__init__()
+        self.title("Strobe / Lamp Controller (TCP) Aquorea Mk3" + (f" - replay of {replay}" if replay else ""))
+        self.geometry("940x650")
+
+        root = ttk.Frame(self, padding=10)
+        root.pack(fill="both", expand=True)
+
+        # Header
+        header = ttk.Frame(root)
+        header.pack(fill="x", pady=(0,8))
+        self.logo_img = None
+        try:
+            logo_path = resource_path("cris_logo.png")
+            self.logo_img = tk.PhotoImage(file=logo_path)
+            self.logo_img = self.logo_img.subsample(6, 6)
+            ttk.Label(header, image=self.logo_img).pack(side="left")
+        except Exception:
+            ttk.Label(header, text="CRIS", font=("Segoe UI", 16, "bold")).pack(side="left")
+        ttk.Label(header, text="Strobe & Lamp Controller", font=("Segoe UI", 14)).pack(side="left", padx=10)
+        ttk.Button(header, text="Open Manual (PDF)", command=self.open_manual).pack(side="right")
+
+        # Connection row
+        row = ttk.Frame(root); row.pack(fill="x", pady=4)
+        ttk.Label(row, text="IP:").pack(side="left")
+        self.ip_var = tk.StringVar(value=DEFAULT_HOST)
+        ttk.Entry(row, textvariable=self.ip_var, width=18).pack(side="left", padx=5)
+        ttk.Label(row, text="Port:").pack(side="left")
+        self.port_var = tk.StringVar(value=str(DEFAULT_PORT))
+        ttk.Entry(row, textvariable=self.port_var, width=8).pack(side="left", padx=5)
+        ttk.Button(row, text="Connect", command=self.on_connect).pack(side="left", padx=6)
+        ttk.Button(row, text="Disconnect", command=self.on_disconnect).pack(side="left")
+
+        # Image folder picker
+        img_row = ttk.Frame(root); img_row.pack(fill="x", pady=4)
+        ttk.Label(img_row, text="Image folder:").pack(side="left")
+        self.image_dir_var = tk.StringVar(value=DEFAULT_IMAGE_DIR)
+        ttk.Entry(img_row, textvariable=self.image_dir_var, width=60).pack(side="left", padx=5)
+        ttk.Button(img_row, text="Browse…", command=self.browse_image_dir).pack(side="left")
+
+        # Sliders
+        sliders = ttk.LabelFrame(root, text="Intensities")
+        sliders.pack(fill="x", pady=10)
+
+        srow = ttk.Frame(sliders); srow.pack(fill="x", pady=6)
+        ttk.Label(srow, text="Strobe intensity").pack(side="left")
+        self.strobe_scale = ttk.Scale(srow, from_=0, to=100, orient="horizontal",
+                                      command=lambda v: self.on_slider("STROBE_INTENSITY", self.lbl_strobe, v))
+        self.strobe_scale.pack(side="left", fill="x", expand=True, padx=10)
+        self.lbl_strobe = ttk.Label(srow, width=4, anchor="e", text="0"); self.lbl_strobe.pack(side="left")
+        self.strobe_scale.bind("<ButtonRelease-1>", lambda e: self.on_slider_release("STROBE_INTENSITY", self.strobe_scale))
+
+        lrow = ttk.Frame(sliders); lrow.pack(fill="x", pady=6)
+        ttk.Label(lrow, text="Lamp intensity").pack(side="left")
+        self.lamp_scale = ttk.Scale(lrow, from_=0, to=100, orient="horizontal",
+                                    command=lambda v: self.on_slider("LAMP_INTENSITY", self.lbl_lamp, v))
+        self.lamp_scale.pack(side="left", fill="x", expand=True, padx=10)
+        self.lbl_lamp = ttk.Label(lrow, width=4, anchor="e", text="0"); self.lbl_lamp.pack(side="left")
+        self.lamp_scale.bind("<ButtonRelease-1>", lambda e: self.on_slider_release("LAMP_INTENSITY", self.lamp_scale))
+        self.slider_pump_id = None
+
+        # Lamp controls + Status
+        lamp_ctrl = ttk.Frame(root); lamp_ctrl.pack(fill="x", pady=6)
+        ttk.Button(lamp_ctrl, text="Lamp OFF", command=lambda: self.send_cmd("LAMP OFF")).pack(side="left", padx=5)
+        ttk.Button(lamp_ctrl, text="Status",   command=lambda: self.send_cmd("STATUS")).pack(side="left", padx=10)
+        ttk.Button(lamp_ctrl, text="Stop sequence", command=self.stop_sequence).pack(side="right", padx=5)
+        ttk.Button(lamp_ctrl, text="Run sequence…", command=self.run_sequence).pack(side="right")
+        self.sequencer = None
+
+        # Exposure counter controls
+        exp_ctrl = ttk.LabelFrame(root, text="Exposure Counter")
+        exp_ctrl.pack(fill="x", pady=10)
+        ttk.Button(exp_ctrl, text="Start Count", command=self.start_exposure_count).pack(side="left", padx=5)
+        ttk.Button(exp_ctrl, text="Stop Count", command=self.stop_exposure_count).pack(side="left", padx=5)
+        ttk.Label(exp_ctrl, text="Count:").pack(side="left", padx=(20,5))
+        self.exposure_var = tk.StringVar(value="0")
+        self.exposure_lbl = ttk.Label(exp_ctrl, textvariable=self.exposure_var, width=10)
+        self.exposure_lbl.pack(side="left")
+        ttk.Button(exp_ctrl, text="Open CSV", command=self.open_current_csv).pack(side="left", padx=20)
+        self.rtt_var = tk.StringVar(value="")
+        ttk.Label(exp_ctrl, textvariable=self.rtt_var, foreground="gray").pack(side="right", padx=5)
+
+        # Live stats (refreshed once a second from the metrics registry)
+        stats = ttk.LabelFrame(root, text="Stats")
+        stats.pack(fill="x")
+        self.metrics_var = tk.StringVar(value="-")
+        ttk.Label(stats, textvariable=self.metrics_var, foreground="gray").pack(side="left", padx=5, pady=2)
+
+        # Custom command (RAW — exact text)
+        cust = ttk.Frame(root); cust.pack(fill="x", pady=8)
+        ttk.Label(cust, text="Custom:").pack(side="left")
+        self.cmd_var = tk.StringVar(value="~COMMAND|SUBC24991")
+        e = ttk.Entry(cust, textvariable=self.cmd_var)
+        e.pack(side="left", fill="x", expand=True, padx=6)
+        e.bind("<Return>", lambda _: self.send_raw())
+        ttk.Button(cust, text="Send", command=self.send_raw).pack(side="left")
+
+        # Two text boxes: Log (left) and Received (right)
+        views = ttk.Frame(root); views.pack(fill="both", expand=True, pady=8)
+        # Left: Log
+        log_frame = ttk.LabelFrame(views, text="Log")
+        log_frame.pack(side="left", fill="both", expand=True, padx=(0,6))
+        self.log = tk.Text(log_frame, height=16, state="disabled", wrap="word")
+        self.log.pack(fill="both", expand=True)
+        log_btns = ttk.Frame(log_frame); log_btns.pack(fill="x")
+        ttk.Button(log_btns, text="Clear log", command=self.clear_log).pack(side="right", padx=4, pady=4)
+        self.ui_stats_var = tk.StringVar(value="")
+        ttk.Label(log_btns, textvariable=self.ui_stats_var, foreground="gray").pack(side="left", padx=4)
+
+        # Right: Received data
+        rx_frame = ttk.LabelFrame(views, text="Received data")
+        rx_frame.pack(side="left", fill="both", expand=True, padx=(6,0))
+        self.rx = tk.Text(rx_frame, height=16, state="disabled", wrap="word")
+        self.rx.pack(fill="both", expand=True)
+        rx_btns = ttk.Frame(rx_frame); rx_btns.pack(fill="x")
+        ttk.Button(rx_btns, text="Clear received", command=self.clear_rx).pack(side="right", padx=4, pady=4)
+
+        # lines waiting for the next UI frame (appended from any thread)
+        self.log_pending = LineQueue(LOG_MAX_LINES)
+        self.rx_pending = LineQueue(RX_MAX_LINES)
+        self.trimmed_lines = 0                     # lines scrolled out of the panes
+        self.ui_frames = 0
+
+        client_class = ReplayClient if replay else TcpClient
+        self.client = client_class(self.on_line_received, on_lines=self.on_lines_received)
+        self.slider_stream = CoalescingSender(lambda ch, v: self.send_cmd(f"{ch} {v}"), client=self.client)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        capture = None
+        if capture_dir and not replay:
+            try:
+                capture = TrafficCapture(capture_dir)
+            except OSError as e:
+                self.append_log(f"[CAPTURE] not recording: {e}")
+
+        self.store = None
+        if db:
+            try:
+                self.store = SessionStore(db, log=self.log_pending)
+            except Exception as e:
+                self.append_log(f"[DB] not recording to {db}: {e}")
+
+        # polling, pairing and CSV writing all happen in the backend; we only render
+        self.pipeline = ExposurePipeline(self.client, log=self.log_pending, rx=self.rx_pending,
+                                         image_timestamps=image_timestamps, capture=capture, store=self.store)
+        self.replay = None
+        if replay:
+            self.replay = TrafficReplay(capture_files(replay), self.pipeline, replay_speed)
+            threading.Thread(target=self._run_replay, daemon=True).start()
+        self.supervisor = ConnectionSupervisor()   # reconnects after a dropped link
+        self.exporter = None
+        if metrics_port:
+            try:
+                self.exporter = MetricsExporter(self.pipeline.metrics, port=metrics_port)
+                self.append_log(f"[METRICS] http://127.0.0.1:{self.exporter.port}/metrics")
+            except OSError as e:
+                self.append_log(f"[METRICS] not served on port {metrics_port}: {e}")
+        self.csv_filename = None
+        self.after(int(1000 / UI_FPS), self._ui_tick)
+
+    # ---------- Manual open ----------
+    def open_manual(self):
+        path = resource_path(MANUAL_FILENAME)
+        if not os.path.exists(path):
+            messagebox.showerror("Manual not found", f"Couldn't find:\n{path}")
+            return
+        try:
+            open_file_with_default_app(path)
+        except Exception as e:
+            messagebox.showerror("Error opening manual", str(e))
+
+    # ---------- UI helpers ----------
+    def browse_image_dir(self):
+        d = filedialog.askdirectory(initialdir=self.image_dir_var.get() or os.getcwd(),
+                                    title="Select image folder (Sony SDK output)")
+        if d:
+            self.image_dir_var.set(d)
+
+    def _update_val(self, label, v):
+        try:
+            label.config(text=str(int(float(v))))
+        except:
+            pass
+
+    # ---------- Live slider streaming ----------
+    def on_slider(self, channel, label, v):
+        self._update_val(label, v)
+        # while disconnected only the release sends (and warns), as before
+        if self.client.sock:
+            self.slider_stream.update(channel, int(float(v)))
+            self._schedule_slider_pump()
+
+    def on_slider_release(self, channel, scale):
+        value = int(float(scale.get()))
+        if not self.client.sock:
+            self.send_cmd(f"{channel} {value}")
+            return
+        # the release always goes out, even if the device already confirmed this value
+        self.slider_stream.update(channel, value, force=True)
+        self._schedule_slider_pump()
+
+    def _schedule_slider_pump(self):
+        if self.slider_pump_id is not None:
+            return
+        delay = self.slider_stream.next_due()
+        if delay is not None:
+            self.slider_pump_id = self.after(max(1, int(delay * 1000)), self._slider_pump)
+
+    def _slider_pump(self):
+        self.slider_pump_id = None
+        self.slider_stream.pump()
+        self._schedule_slider_pump()
+
+    def append_log(self, text):
+        """Queue a line for the Log pane (safe from any thread)."""
+        self.log_pending.put(text)
+
+    def clear_log(self):
+        self.log.configure(state="normal")
+        self.log.delete("1.0", "end")
+        self.log.configure(state="disabled")
+
+    def append_rx(self, text):
+        """Queue a line for the Received pane (safe from any thread)."""
+        self.rx_pending.put(text)
+
+    def clear_rx(self):
+        self.rx.configure(state="normal")
+        self.rx.delete("1.0", "end")
+        self.rx.configure(state="disabled")
+
+    def _render(self, widget, lines, max_lines):
+        """Insert a frame's worth of lines at once and trim the pane to max_lines."""
+        if not lines:
+            return
+        widget.configure(state="normal")
+        widget.insert("end", "\n".join(lines) + "\n")
+        total = int(widget.index("end-1c").split(".")[0]) - 1
+        if total > max_lines:
+            widget.delete("1.0", f"{total - max_lines + 1}.0")
+            self.trimmed_lines += total - max_lines
+        widget.see("end")
+        widget.configure(state="disabled")
+
+    def _ui_tick(self):
+        """Fixed-rate frame: redraw both panes once and refresh the counters."""
+        try:
+            self.pipeline.metrics.observe("ui_queue_depth", len(self.log_pending) + len(self.rx_pending))
+            self._render(self.log, self.log_pending.drain(), LOG_MAX_LINES)
+            self._render(self.rx, self.rx_pending.drain(), RX_MAX_LINES)
+            self.exposure_var.set(str(self.pipeline.count))
+            dropped = self.log_pending.dropped + self.rx_pending.dropped
+            self.ui_stats_var.set(f"backend queue {self.pipeline.inbox.qsize()}  "
+                                  f"dropped {dropped}  trimmed {self.trimmed_lines}")
+            self.ui_frames += 1
+            if self.ui_frames % UI_FPS == 0:
+                self.rtt_var.set("RTT " + self.client.rtt.format("GET_EXPOSURE_COUNT"))
+                self.metrics_var.set(format_metrics(self.pipeline.metrics.snapshot()))
+        except Exception as e:
+            self.log_pending.put(f"[UI ERROR] {e}")
+        self.after(int(1000 / UI_FPS), self._ui_tick)
+
+    def _run_replay(self):
+        self.append_log(f"[REPLAY] {self.replay.paths[0]} at {self.replay.speed or 'max'}x")
+        try:
+            self.replay.run()
+            self.append_log(f"[REPLAY] {self.replay.summary()}")
+        except Exception as e:
+            self.append_log(f"[REPLAY ERROR] {e}")
+
+    # ---------- Incoming TCP lines ----------
+    def on_lines_received(self, lines):
+        """RX thread: hand the batch to the backend."""
+        self.pipeline.on_lines(lines)
+
+    def on_line_received(self, line):
+        self.pipeline.on_lines([line])
+
+    # ---------- Connect / Disconnect ----------
+    def on_connect(self):
+        host = self.ip_var.get().strip()
+        try:
+            port = int(self.port_var.get())
+            self.supervisor.forget(self.client)
+            self.client.connect(host, port)
+            self.slider_stream.forget()
+            self.append_log(f"[Connected to {host}:{port}]")
+            self.supervisor.watch(self.client, host, port, self.pipeline, log=self.append_log)
+        except Exception as e:
+            messagebox.showerror("Connect failed", str(e))
+
+    def on_disconnect(self):
+        self.supervisor.forget(self.client)
+        self.client.close()
+        self.slider_stream.forget()
+        self.append_log("[Disconnected]")
+
+    # ---------- Sending ----------
+    def send_cmd(self, s):
+        try:
+            future = self.client.send_line(s)
+            self.append_log(f">> {s}")
+        except Exception as e:
+            messagebox.showwarning("Send failed", str(e))
+            return None
+        future.add_done_callback(lambda f: self._cmd_done(s, f))
+        return future
+
+    def send_raw(self):
+        # a typed command may set an intensity behind the sliders' back
+        self.slider_stream.forget()
+        self.send_cmd(self.cmd_var.get())
+
+    def _cmd_done(self, text, future):
+        """Runs on the writer/RX thread once a command's reply (or failure) is known."""
+        exc = future.exception()
+        if isinstance(exc, TimeoutError):
+            self.append_log(f"[TIMEOUT] {exc}")
+        elif exc is not None:
+            self.append_log(f"[SEND ERROR] {text}: {exc}")
+
+    # ---------- Timed sequences ----------
+    def run_sequence(self):
+        if self.sequencer and not self.sequencer.finished.is_set():
+            messagebox.showinfo("Sequence", "A sequence is already running.")
+            return
+        if not self.client.sock:
+            messagebox.showwarning("Send failed", "Not connected")
+            return
+        path = filedialog.askopenfilename(title="Sequence script",
+                                          filetypes=[("Sequence scripts", "*.txt *.seq"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            steps = load_sequence(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Sequence", str(e))
+            return
+        ts = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self.sequencer = Sequencer(self.client, steps, log=self.log_pending,
+                                   csv_path=f"sequence_log_{ts}.csv").start()
+
+    def stop_sequence(self):
+        if self.sequencer:
+            self.sequencer.stop()
+
+    # ---------- Exposure controls ----------
+    def start_exposure_count(self):
+        if not self.client.sock:
+            messagebox.showwarning("Send failed", "Not connected")
+            return
+        # Prepare CSV (new file each run)
+        ts = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self.csv_filename = f"exposure_log_{ts}.csv"
+        self.pipeline.start_run(self.csv_filename, self.image_dir_var.get())
+
+    def stop_exposure_count(self):
+        self.pipeline.stop_run()
+
+    # ---------- Open CSV ----------
+    def open_current_csv(self):
+        if not self.csv_filename:
+            messagebox.showinfo("CSV", "No CSV for this run yet. Press 'Start Count' first.")
+            return
+        try:
+            path = self.pipeline.flush().result(timeout=2.0) or self.csv_filename
+            open_file_with_default_app(path)
+        except Exception as e:
+            messagebox.showerror("Open CSV failed", str(e))
+
+    # ---------- Close ----------
+    def on_close(self):
+        if self.replay:
+            self.replay.stop.set()
+        self.stop_sequence()
+        self.supervisor.close()
+        if self.exporter:
+            self.exporter.close()
+        self.pipeline.close()
+        self.client.close()
+        if self.store:
+            self.store.close()
+        self.destroy()
+
+
+class Dashboard(tk.Tk):
+    """Combined window for several controllers (python main.py --unit A=... --unit B=...)."""
+
+    COLUMNS = ("unit", "address", "link", "count", "exposures", "images", "pairs", "pending", "expired",
+               "delta_p50_ms", "rtt_p50_ms")
+
+    def __init__(self, args):
+        super().__init__()
+        self.title("Aquorea Mk3 - all units")
+        self.geometry("980x420")
+        self.csv_dir = args.csv_dir
+        self.supervise = not args.no_reconnect
+        self.mgr = SessionManager(poll_ms=args.poll_ms, image_timestamps=args.image_timestamps,
+                                  capture_dir=None if args.no_capture else args.capture_dir, db=args.db or None)
+        for spec in args.unit:
+            name, host, port, folder = parse_unit(spec, args.image_dir)
+            self.mgr.add_unit(name, host, port, folder)
+
+        root = ttk.Frame(self, padding=10)
+        root.pack(fill="both", expand=True)
+
+        ctrl = ttk.Frame(root); ctrl.pack(fill="x", pady=4)
+        ttk.Button(ctrl, text="Connect all", command=self.connect_all).pack(side="left")
+        ttk.Button(ctrl, text="Start all", command=self.start_all).pack(side="left", padx=6)
+        ttk.Button(ctrl, text="Stop all", command=self.stop_all).pack(side="left")
+
+        bc = ttk.LabelFrame(root, text="Broadcast")
+        bc.pack(fill="x", pady=8)
+        ttk.Label(bc, text="Intensity:").pack(side="left", padx=(5, 2))
+        self.level_var = tk.StringVar(value="40")
+        ttk.Entry(bc, textvariable=self.level_var, width=5).pack(side="left")
+        ttk.Button(bc, text="All strobes", command=lambda: self.broadcast("STROBE_INTENSITY")).pack(side="left", padx=4)
+        ttk.Button(bc, text="All lamps", command=lambda: self.broadcast("LAMP_INTENSITY")).pack(side="left")
+        ttk.Button(bc, text="All lamps off", command=lambda: self.broadcast("LAMP OFF", raw=True)).pack(side="left", padx=4)
+        self.fanout_var = tk.StringVar(value="")
+        ttk.Label(bc, textvariable=self.fanout_var, foreground="gray").pack(side="left", padx=10)
+
+        self.table = ttk.Treeview(root, columns=self.COLUMNS, show="headings", height=10)
+        for col in self.COLUMNS:
+            self.table.heading(col, text=col.replace("_ms", " ms").replace("_", " "))
+            self.table.column(col, width=70 if col not in ("unit", "address") else 140, anchor="e")
+        self.table.pack(fill="both", expand=True)
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(100, self.connect_all)
+        self.after(1000, self._refresh)
+
+    def connect_all(self):
+        """Connect the units that are down; the IoLoop does it, _check_connects reports."""
+        futures = self.mgr.connect_all(supervise=self.supervise)
+        if futures:
+            self.after(100, self._check_connects, futures)
+
+    def _check_connects(self, futures):
+        if not all(f.done() for f in futures.values()):
+            self.after(100, self._check_connects, futures)
+            return
+        failed = {n: f.exception() for n, f in futures.items() if f.exception() is not None}
+        if failed:
+            messagebox.showwarning("Connect", "\n".join(f"{n}: {e}" for n, e in failed.items()))
+
+    def start_all(self):
+        self.mgr.start_all(self.csv_dir)
+
+    def stop_all(self):
+        self.mgr.stop_all()
+
+    def broadcast(self, cmd, raw=False):
+        if not raw:
+            try:
+                level = int(self.level_var.get())
+            except ValueError:
+                messagebox.showerror("Broadcast", "Intensity must be a number 0-100")
+                return
+            cmd = f"{cmd} {max(0, min(100, level))}"
+        futures = self.mgr.broadcast(cmd)
+        self.fanout_var.set(f"{cmd}: waiting for {len(futures)} units ...")
+        self.after(50, self._check_broadcast, cmd, futures)
+
+    def _check_broadcast(self, cmd, futures):
+        if not all(f.done() for f in futures.values()):
+            self.after(50, self._check_broadcast, cmd, futures)
+            return
+        rows, spread = fanout_report(futures)
+        ok = sum(1 for r in rows if isinstance(r[3], str))
+        rtts = [r[2] for r in rows if r[2] is not None]
+        worst = f", slowest reply {max(rtts):.1f} ms" if rtts else ""
+        self.fanout_var.set(f"{cmd}: {ok}/{len(rows)} OK, sent within {spread or 0:.2f} ms{worst}")
+
+    def _refresh(self):
+        try:
+            self.table.delete(*self.table.get_children())
+            for r in self.mgr.dashboard():
+                self.table.insert("", "end", values=[
+                    "-" if r[c] is None else (f"{r[c]:.1f}" if isinstance(r[c], float) else r[c])
+                    for c in self.COLUMNS])
+        except Exception:
+            pass
+        self.after(1000, self._refresh)
+
+    def on_close(self):
+        self.mgr.close()
+        self.destroy()
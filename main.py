@@ -2,17 +2,49 @@ import os
 import sys
 import subprocess
 import socket
+import select
+import stat
+import struct
 import threading
-import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+import queue
+import ctypes
+import ctypes.util
 import csv
+import sqlite3
+import json
+import argparse
+import signal
 import datetime
 import time
 import re
+import errno
+import math
+import random
+import itertools
+import selectors
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from bisect import bisect_left, bisect_right
 from pathlib import Path
+from glob import escape as glob_escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROCESS_START = time.monotonic()
 
 DEFAULT_HOST = "192.168.2.70"
 DEFAULT_PORT = 9000
+RECV_SIZE = 16384  # bytes per recv_into; the line buffer starts at twice this
+CMD_QUEUE_MAX = 256      # commands waiting for the writer thread
+CMD_TIMEOUT_SEC = 2.0    # how long a command may wait for its reply
+CONNECT_TIMEOUT_SEC = 3.0
+RTT_WINDOW = 1000        # round-trip samples kept per command kind
+SLIDER_RATE_HZ = 10      # max intensity updates per second per slider while dragging
+RECONNECT_BASE_SEC = 0.25    # first retry delay after a drop; doubles per failed attempt ...
+RECONNECT_MAX_SEC = 10.0     # ... up to this, and each delay is jittered down by up to half
+IDLE_READ_SEC = 3.0          # a command that expects a reply, then no bytes for this long = dead link
+KEEPALIVE_IDLE_SEC = 2       # TCP keepalive: first probe after this much silence,
+KEEPALIVE_INTERVAL_SEC = 1   # then one probe per interval,
+KEEPALIVE_COUNT = 3          # and the kernel gives up after this many go unanswered
 MANUAL_FILENAME = "Aquorea Mk3 Manual.pdf"  # put this PDF next to main.py
 
 # >>> Set your Sony SDK image folder here (or use the Browse button in the UI)
@@ -21,8 +53,77 @@ DEFAULT_IMAGE_DIR = r"C:\Users\Luke Griffin\OneDrive\Desktop\Sony_SDK\build\Rele
 # how long we allow between an exposure and its matching image (seconds)
 MATCH_TOLERANCE_SEC = 2.0
 
+# GET_EXPOSURE_COUNT poll period; exposure times are interpolated between polls,
+# so this can be raised to cut TCP traffic without losing per-frame timestamps
+EXPOSURE_POLL_MS = 500
+EXPOSURE_POLL_DITHER = 0.25  # +/- fraction; keeps polls from locking to the frame rate's phase
+POLL_BATCH_SEC = 0.05    # polls due this close together share one worker wake-up
+TIMELINE_WINDOW = 32     # recent count samples used to fit a steady frame rate
+TIMELINE_SLACK_SEC = 0.002   # frame-to-frame jitter tolerated by the steady-rate fit
+
+# unmatched exposures/images this far behind the newest event can never pair; drop them
+PAIR_EXPIRY_SEC = 10.0
+# entries per bucket of a pairing side; a bucket splits at twice this
+SIDE_BUCKET = 256
+
+CSV_HEADER = ["ExposureTS", "ExposureCount", "ImageTS", "ImageFile", "Delta_ms", "ExposureErr_ms"]
+CSV_FLUSH_ROWS = 64            # flush the session CSV after this many buffered rows ...
+CSV_FLUSH_SEC = 1.0            # ... or once the oldest buffered row is this old
+CSV_FSYNC_SEC = 30.0           # force rows to disk this often (None = only on stop/close)
+CSV_ROTATE_BYTES = 256 * 1024 * 1024   # start a new _partN file past this size
+
 IMAGE_PATTERN = re.compile(r"^DSC\d{1,}\.(jpg)$", re.IGNORECASE)
 
+# Log / Received panes are redrawn at this rate and keep at most this many lines
+UI_FPS = 30
+LOG_MAX_LINES = 5000
+RX_MAX_LINES = 5000
+
+# image folder watcher: "auto" (inotify on Linux, else polling), "inotify" or "scandir"
+IMAGE_WATCHER = "auto"
+IMAGE_SCAN_INTERVAL_SEC = 0.3
+# out-of-order DSC numbers remembered below the highest one seen (older skips count as seen)
+IMAGE_INDEX_MAX_GAPS = 256
+_IMAGE_NUMBER = re.compile(r"\D*(\d+)\.[^.]*$")
+
+# directory mtimes this close to a scan may hide a later change (coarse FS clocks), so rescan
+RACY_MTIME_SEC = 2.0
+
+# image timestamps: "mtime" (when the SDK finished writing the file) or "exif"
+# (DateTimeOriginal + SubSecTimeOriginal from the JPEG header, i.e. the capture time)
+IMAGE_TIMESTAMPS = "mtime"
+EXIF_HEAD_BYTES = 8192          # first read per file; the rest of APP1 only if the tags lie past it
+EXIF_WORKERS = 2
+EXIF_CACHE_MAX = 4096           # (name, size, mtime) -> capture time
+EXIF_WARMUP_FRAMES = 8          # first frames of a run skipped while the exposure timeline settles
+EXIF_CALIBRATION_FRAMES = 8     # frames timed both ways before capture times are used ...
+EXIF_MATCH_PERIODS = 0.4        # ... after which images pair within this fraction of a frame period
+EXIF_FRAME_WINDOW = 256         # recent exposures kept for numbering and the period
+
+# optional SQLite record of every exposure, image and pair (None = off); see SessionStore
+SESSION_DB = None
+DB_BATCH_ROWS = 2000            # the writer commits once this many rows are waiting ...
+DB_BATCH_SEC = 0.5              # ... or this often
+DB_RETRIES = 3                  # failed commits retried on close before the rows are given up
+
+# timed command sequences (Sequencer): sleep until this close to a step, then spin the rest;
+# Windows sleeps in ~15.6 ms ticks, so it needs the wider margin
+SEQUENCE_SPIN_SEC = 0.02 if sys.platform == "win32" else 0.002
+SEQUENCE_MIN_GAP_SEC = 0.002    # never two sequence sends closer than this
+SEQUENCE_LEAD_SEC = 0.05        # step offsets count from this long after start()
+SEQUENCE_CSV_HEADER = ["Step", "Command", "Planned_s", "Sent_s", "Error_ms", "Rtt_ms", "Result"]
+
+# every TCP line sent / received and every image found, appended to
+# CAPTURE_DIR/capture_<start>.aqcap (None = off) for --replay; see TrafficCapture
+CAPTURE_DIR = "captures"
+CAPTURE_ROTATE_BYTES = 16 * 1024 * 1024   # start a new _partN file past this size ...
+CAPTURE_KEEP_FILES = 64                    # ... and delete the oldest .aqcap files beyond this many
+CAPTURE_FLUSH_SEC = 1.0
+
+# Prometheus text on http://127.0.0.1:METRICS_PORT/metrics (None = off, e.g. 9464 to serve it); JSON snapshot period
+METRICS_PORT = None
+METRICS_SNAPSHOT_SEC = 10.0
+
 def resource_path(rel_path: str) -> str:
     """Return absolute path to resource, works for dev and PyInstaller."""
     if hasattr(sys, "_MEIPASS"):
@@ -38,55 +139,2097 @@ def open_file_with_default_app(path: str):
     else:
         subprocess.Popen(["xdg-open", path])
 
+class ExposureTimeline:
+    """Turns timed GET_EXPOSURE_COUNT samples into one timestamp per exposure.
+
+    Each sample is (sent, replied, count) on time.monotonic(); the Nano read
+    its counter somewhere in between, so the sample time is the midpoint give
+    or take half the RTT. Frames up to `count` had happened by then and frame
+    count+1 had not. If the recent samples are consistent with a steady frame
+    rate, each frame is placed on that fitted line (t = a + n * period) and its
+    error bound is how far the line may shift and still fit every sample.
+    Otherwise the frames are spread evenly over the poll interval. Times are
+    never accumulated, so they don't drift however long the run is.
+    """
+
+    def __init__(self, window=TIMELINE_WINDOW, slack=TIMELINE_SLACK_SEC):
+        self.samples = deque(maxlen=window)     # (mid, half_rtt, count)
+        self.slack = slack
+        self.mono0 = time.monotonic()
+        self.wall0 = time.time()
+
+    def reset(self, sent, replied=None, count=0):
+        """Start a new run: the counter was `count` at this moment."""
+        self.samples.clear()
+        self._add(sent, sent if replied is None else replied, count)
+
+    def _add(self, sent, replied, count):
+        self.samples.append(((sent + replied) / 2.0, (replied - sent) / 2.0, count))
+
+    def to_wall(self, t):
+        """Monotonic seconds -> time.time() seconds."""
+        return self.wall0 + (t - self.mono0)
+
+    def observe(self, sent, replied, count):
+        """Add a sample; return [(frame_no, t_monotonic, err_sec)] for frames new since the last one."""
+        if not self.samples:
+            self.reset(sent, replied, count)
+            return []
+        m0, h0, c0 = self.samples[-1]
+        if count < c0:
+            # counter went backwards (Nano restarted the count): start over from here
+            self.reset(sent, replied, count)
+            return []
+        self._add(sent, replied, count)
+        if count == c0:
+            return []
+
+        m1, h1, _ = self.samples[-1]
+        lo_t, hi_t = m0 - h0, m1 + h1
+        fit = self._fit()
+        delta = count - c0
+        slot = (m1 - m0) / delta
+        events = []
+        for n in range(c0 + 1, count + 1):
+            if fit:
+                a, period, phase_err, period_err, c_mid = fit
+                t = a + n * period
+                err = phase_err + period_err * abs(n - c_mid)
+            else:
+                t = m0 + (n - c0 - 0.5) * slot
+                err = slot / 2.0 + max(h0, h1)   # assuming roughly even spacing
+            events.append((n, min(max(t, lo_t), hi_t), err))
+        return events
+
+    def _fit(self):
+        """(a, period, phase_err, period_err, mid_count) of a steady rate that fits
+        every windowed sample, or None."""
+        s = self.samples
+        while len(s) >= 3:
+            (mf, hf, cf), (ml, hl, cl) = s[0], s[-1]
+            if cl - cf >= 2:
+                # the first and last samples bound the period from both sides
+                hf += self.slack
+                hl += self.slack
+                p_lo = (ml - mf - hf - hl) / (cl - cf + 1)
+                p_hi = (ml - mf + hf + hl) / (cl - cf - 1)
+                period = (p_lo + p_hi) / 2.0
+                lo = max(m - h - self.slack - (c + 1) * period for m, h, c in s)
+                # a count of 0 says nothing about when "frame 0" happened
+                hi = min((m + h + self.slack - c * period for m, h, c in s if c), default=lo)
+                if lo <= hi:
+                    c_mid = sum(c for _, _, c in s) / len(s)
+                    return (lo + hi) / 2.0, period, (hi - lo) / 2.0, (p_hi - p_lo) / 2.0, c_mid
+            elif cl == cf:
+                return None
+            # the rate changed somewhere in the window: forget the oldest sample
+            s.popleft()
+        return None
+
+
+class _SortedSide:
+    """One side of the pairing engine: (timestamp, payload) entries in time order.
+
+    Entries live in short sorted buckets with the last timestamp of each bucket
+    kept in `maxes`, so finding a position is two bisects and an insert or
+    removal only shifts one bucket (at most 2 * SIDE_BUCKET entries) instead of
+    everything after it. Expiry drops whole buckets from the front.
+    """
+
+    def __init__(self, load=SIDE_BUCKET):
+        self.load = load
+        self.ts = []        # per bucket: sorted timestamps
+        self.items = []     # per bucket: payloads in the same order
+        self.maxes = []     # per bucket: its last timestamp
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, t, item):
+        """Add after any entries with the same timestamp."""
+        if not self.ts:
+            self.ts.append([t])
+            self.items.append([item])
+            self.maxes.append(t)
+            self.size = 1
+            return
+        k = bisect_right(self.maxes, t)
+        if k == len(self.maxes):
+            k -= 1
+            self.ts[k].append(t)
+            self.items[k].append(item)
+            self.maxes[k] = t
+        else:
+            ts = self.ts[k]
+            i = bisect_right(ts, t)
+            ts.insert(i, t)
+            self.items[k].insert(i, item)
+        self.size += 1
+        if len(self.ts[k]) > 2 * self.load:
+            self._split(k)
+
+    def _split(self, k):
+        ts, items, half = self.ts[k], self.items[k], self.load
+        self.ts[k:k + 1] = [ts[:half], ts[half:]]
+        self.items[k:k + 1] = [items[:half], items[half:]]
+        self.maxes[k:k + 1] = [ts[half - 1], ts[-1]]
+
+    def find(self, t):
+        """Position (bucket, index) of the first entry at or after t, or None."""
+        k = bisect_left(self.maxes, t)
+        if k == len(self.maxes):
+            return None
+        return k, bisect_left(self.ts[k], t)
+
+    def before(self, pos):
+        """Position of the entry just before `pos` (None = before the end), or None."""
+        if pos is None:
+            return (len(self.ts) - 1, len(self.ts[-1]) - 1) if self.ts else None
+        k, i = pos
+        if i:
+            return k, i - 1
+        return (k - 1, len(self.ts[k - 1]) - 1) if k else None
+
+    def at(self, pos):
+        return self.ts[pos[0]][pos[1]]
+
+    def pop(self, pos):
+        """Remove the entry at `pos`; return (timestamp, payload)."""
+        k, i = pos
+        ts, items = self.ts[k], self.items[k]
+        t, item = ts.pop(i), items.pop(i)
+        self.size -= 1
+        if not ts:
+            del self.ts[k], self.items[k], self.maxes[k]
+        elif i == len(ts):
+            self.maxes[k] = ts[-1]
+        return t, item
+
+    def expire_before(self, t):
+        """Drop every entry older than t; return how many were dropped."""
+        k = bisect_left(self.maxes, t)
+        dropped = sum(len(ts) for ts in self.ts[:k])
+        if k:
+            del self.ts[:k], self.items[:k], self.maxes[:k]
+        if self.ts:
+            i = bisect_left(self.ts[0], t)
+            if i:
+                del self.ts[0][:i], self.items[0][:i]
+                dropped += i
+        self.size -= dropped
+        return dropped
+
+    def clear(self):
+        self.ts.clear()
+        self.items.clear()
+        self.maxes.clear()
+        self.size = 0
+
+
+class PairingEngine:
+    """Incremental exposure <-> image matcher.
+
+    Timestamps are float seconds. Both sides stay sorted as events arrive and
+    each new event is matched with a bisect inside the tolerance window. Sides
+    are bucketed (see _SortedSide), so inserting and removing also costs
+    O(log n) plus one bucket's worth of moves, in or out of order, however many
+    unmatched items are waiting.
+
+    The pairing rule is the same greedy one the GUI always used: an exposure
+    takes the closest waiting image within tolerance, and an image goes to the
+    oldest waiting exposure within tolerance. After every call no waiting
+    exposure has a waiting image in range, so only the new event can pair.
+    """
+
+    def __init__(self, tolerance=MATCH_TOLERANCE_SEC, expiry=PAIR_EXPIRY_SEC):
+        self.tolerance = tolerance
+        self.expiry = expiry            # None = keep unmatched items forever
+        self.exposures = _SortedSide()
+        self.images = _SortedSide()
+        self.newest = None
+        self.expired_exposures = 0
+        self.expired_images = 0
+
+    def add_exposure(self, t, item):
+        """Queue an exposure. Returns (exposure_item, image_item) if it paired, else None."""
+        imgs = self.images
+        after = imgs.find(t)
+        before = imgs.before(after)
+        best = None
+        if before is not None and t - imgs.at(before) <= self.tolerance:
+            best = before
+        if after is not None and imgs.at(after) - t <= self.tolerance:
+            if best is None or imgs.at(after) - t < t - imgs.at(best):
+                best = after
+        pair = None
+        if best is None:
+            self.exposures.insert(t, item)
+        else:
+            pair = (item, imgs.pop(best)[1])
+        self._advance(t)
+        return pair
+
+    def add_image(self, t, item):
+        """Queue an image. Returns (exposure_item, image_item) if it paired, else None."""
+        exps = self.exposures
+        first = exps.find(t - self.tolerance)
+        pair = None
+        if first is not None and exps.at(first) <= t + self.tolerance:
+            pair = (exps.pop(first)[1], item)
+        else:
+            self.images.insert(t, item)
+        self._advance(t)
+        return pair
+
+    def _advance(self, t):
+        if self.newest is not None and t <= self.newest:
+            return
+        self.newest = t
+        if self.expiry is not None:
+            horizon = t - self.expiry
+            self.expired_exposures += self.exposures.expire_before(horizon)
+            self.expired_images += self.images.expire_before(horizon)
+
+    def clear(self):
+        self.exposures.clear()
+        self.images.clear()
+        self.newest = None
+        self.expired_exposures = 0
+        self.expired_images = 0
+
+
+class ImageIndex:
+    """Constant-memory record of which image files have been seen.
+
+    Sony SDK names are sequential (DSC00001.jpg, DSC00002.jpg, ...), so instead
+    of remembering every name we keep the highest number seen plus a small set
+    of skipped numbers below it that may still turn up out of order. Anything
+    else at or below the high-water mark counts as seen. Names without a
+    number fall back to a plain set.
+
+    When the camera numbering wraps or is reset (DSC09999 -> DSC00001, new
+    card) the index starts again from the new file: add() does this for a
+    number far below the mark, and the watchers call restart() for a "seen"
+    name whose file is newer than anything reported. Files left over from
+    before the wrap keep counting as seen, except the next max_gaps numbers
+    above the new mark, where the new sequence will write.
+    """
+
+    def __init__(self, max_gaps=IMAGE_INDEX_MAX_GAPS):
+        self.max_gaps = max_gaps
+        self.high = -1
+        self.gaps = set()
+        self.names = set()
+        self.stale_high = -1        # after a wrap: the old mark (numbers up to it are leftovers)
+
+    def __contains__(self, name):
+        m = _IMAGE_NUMBER.match(name)
+        if not m:
+            return name in self.names
+        n = int(m.group(1))
+        if n <= self.high:
+            return n not in self.gaps
+        return self.high + self.max_gaps < n <= self.stale_high
+
+    def add(self, name):
+        """Record a name; return True if it had not been seen before."""
+        m = _IMAGE_NUMBER.match(name)
+        if not m:
+            if name in self.names:
+                return False
+            self.names.add(name)
+            return True
+        n = int(m.group(1))
+        if n > self.high:
+            floor = n - self.max_gaps
+            self.gaps.update(range(max(self.high + 1, floor), n))
+            self.high = n
+            if len(self.gaps) > self.max_gaps:
+                self.gaps = {g for g in self.gaps if g >= floor}
+            if n >= self.stale_high:
+                self.stale_high = -1
+            return True
+        if n in self.gaps:
+            self.gaps.discard(n)
+            return True
+        if n < self.high - self.max_gaps:
+            self.restart(name)
+            return True
+        return False
+
+    def behind(self, name):
+        """True for a numbered name below the high-water mark."""
+        m = _IMAGE_NUMBER.match(name)
+        return bool(m) and int(m.group(1)) < self.high
+
+    def restart(self, name):
+        """Count again from `name` after the numbering went back."""
+        m = _IMAGE_NUMBER.match(name)
+        if m:
+            self.stale_high = max(self.stale_high, self.high)
+            self.high = int(m.group(1))
+            self.gaps.clear()
+
+    def mark_old(self, name):
+        """Snapshot helper: raise the high-water mark without recording gaps."""
+        m = _IMAGE_NUMBER.match(name)
+        if not m:
+            self.names.add(name)
+        elif int(m.group(1)) > self.high:
+            self.high = int(m.group(1))
+
+    def clear(self):
+        self.high = -1
+        self.gaps.clear()
+        self.names.clear()
+        self.stale_high = -1
+
+
+class ScandirWatcher:
+    """Polling image-folder watcher (works everywhere).
+
+    The listing is skipped entirely while the directory mtime is unchanged, and
+    when it does run only names not seen before get a regex match and a stat
+    (which `os.scandir` already has cached on Windows). A change that brings
+    no new name costs one stat per file: it is how a restarted numbering
+    (a "seen" name with a newer file) is noticed.
+    """
+    name = "scandir"
+
+    def __init__(self, folder, pattern=IMAGE_PATTERN):
+        self.folder = str(folder)
+        self.pattern = pattern
+        self.seen = ImageIndex()
+        self.newest = 0.0               # latest mtime reported (or the snapshot time)
+        self.fresh_after = None         # after a restart: older files are leftovers of the last sequence
+        self._dir_mtime_ns = None
+        self._scanned_at = 0.0
+
+    def snapshot(self):
+        """Treat every matching file already in the folder as seen (a max-number scan, no stats)."""
+        self.seen.clear()
+        self.newest = time.time()
+        self.fresh_after = None
+        try:
+            st = os.stat(self.folder)
+            with os.scandir(self.folder) as it:
+                for entry in it:
+                    if self.pattern.match(entry.name):
+                        self.seen.mark_old(entry.name)
+        except OSError:
+            return
+        self._dir_mtime_ns = st.st_mtime_ns
+        self._scanned_at = time.time()
+
+    def poll(self):
+        """Return [(name, mtime)] for matching files that appeared since the last call."""
+        try:
+            st = os.stat(self.folder)
+        except OSError:
+            return []
+        if st.st_mtime_ns == self._dir_mtime_ns and self._scanned_at - st.st_mtime > RACY_MTIME_SEC:
+            return []
+        self._dir_mtime_ns = st.st_mtime_ns
+        self._scanned_at = time.time()
+
+        seen = self.seen
+        match = self.pattern.match
+        with os.scandir(self.folder) as it:
+            new = [entry for entry in it if match(entry.name) and entry.name not in seen]
+
+        # listing order is arbitrary; feed the index in sequence so no gap is forgotten
+        found = []
+        leftovers = 0
+        for entry in sorted(new, key=lambda e: e.name):
+            try:
+                if not entry.is_file():
+                    continue
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            if self.fresh_after is not None and mtime <= self.fresh_after:
+                leftovers += 1
+                continue
+            if seen.add(entry.name):
+                found.append((entry.name, mtime))
+        if not leftovers and self.seen.stale_high < 0:
+            self.fresh_after = None
+        if not found:
+            found = self._restarted()
+        return self._reported(found)
+
+    def _restarted(self):
+        """Files written since the last report under names the index counts as
+        seen: the camera numbering went back, so count again from the oldest."""
+        fresh = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if not (self.pattern.match(entry.name) and self.seen.behind(entry.name)):
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime
+                    if mtime > self.newest and entry.is_file():
+                        fresh.append((entry.name, mtime))
+                except OSError:
+                    continue
+        if not fresh:
+            return []
+        first = min(fresh, key=lambda f: (f[1], f[0]))
+        self._restart(first[0])
+        return [first] + [(name, mtime) for name, mtime in sorted(fresh) if name != first[0] and self.seen.add(name)]
+
+    def _restart(self, name):
+        self.fresh_after = self.newest
+        self.seen.restart(name)
+
+    def _reported(self, found):
+        if found:
+            self.newest = max(self.newest, max(mtime for _, mtime in found))
+        return found
+
+    def wait(self, timeout):
+        """Block until the folder may have changed (here: just the poll interval)."""
+        time.sleep(timeout)
+
+    def close(self):
+        pass
+
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+_IN_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (+ name)
+
+
+class InotifyWatcher(ScandirWatcher):
+    """Linux inotify watcher via ctypes: only files that were closed after
+    writing (or renamed in) are looked at, and `wait` wakes up as soon as
+    one lands instead of sleeping out the poll interval."""
+    name = "inotify"
+
+    def __init__(self, folder, pattern=IMAGE_PATTERN):
+        super().__init__(folder, pattern)
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(fd, os.fsencode(self.folder), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, f"inotify_add_watch failed: {self.folder}")
+        self.fd = fd
+
+    def poll(self):
+        names = []
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            off = 0
+            while off < len(data):
+                _, mask, _, length = _IN_EVENT.unpack_from(data, off)
+                off += _IN_EVENT.size
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                elif length:
+                    names.append(os.fsdecode(data[off:off + length].rstrip(b"\0")))
+                off += length
+
+        if overflow:
+            # kernel queue overflowed: events were lost, fall back to a full listing
+            self._dir_mtime_ns = None
+            return super().poll()
+
+        found = []
+        for name in names:
+            if not self.pattern.match(name):
+                continue
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            if name not in self.seen:
+                if self.seen.add(name):
+                    found.append((name, st.st_mtime))
+            elif st.st_mtime > self.newest and self.seen.behind(name):
+                self._restart(name)     # a "seen" number written just now: the numbering went back
+                found.append((name, st.st_mtime))
+        return self._reported(found)
+
+    def wait(self, timeout):
+        if self.fd is not None:
+            select.select([self.fd], [], [], timeout)
+
+    def close(self):
+        if self.fd is not None:
+            try: os.close(self.fd)
+            except OSError: pass
+            self.fd = None
+
+
+def make_folder_watcher(folder, kind=IMAGE_WATCHER):
+    """Build the best watcher for this platform, falling back to polling."""
+    if kind == "inotify" or (kind == "auto" and sys.platform.startswith("linux")):
+        try:
+            return InotifyWatcher(folder)
+        except (OSError, AttributeError):
+            if kind == "inotify":
+                raise
+    return ScandirWatcher(folder)
+
+
+class WatchHub:
+    """One thread serving many folder watchers (see SessionManager).
+
+    Inotify watchers are waited on together in a single select, so idle folders
+    cost nothing; polling watchers are polled once per IMAGE_SCAN_INTERVAL_SEC
+    and their mtime check makes an unchanged folder one stat.
+    """
+
+    def __init__(self, interval=IMAGE_SCAN_INTERVAL_SEC):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.watchers = {}              # watcher -> (on_found(found, seconds), on_error(exc))
+        self.retired = []               # closed on the hub thread, never mid-select
+        self.busy = 0.0
+        self.closed = False
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, watcher, on_found, on_error=None):
+        with self.lock:
+            self.watchers[watcher] = (on_found, on_error)
+        self._wake()
+
+    def remove(self, watcher):
+        with self.lock:
+            if self.watchers.pop(watcher, None) is not None:
+                self.retired.append(watcher)
+        self._wake()
+
+    def close(self, timeout=2.0):
+        self.closed = True
+        self._wake()
+        self.thread.join(timeout)
+
+    def _wake(self):
+        try:
+            os.write(self.wake_w, b"\0")
+        except OSError:
+            pass
+
+    def _run(self):
+        next_scan = 0.0
+        try:
+            while not self.closed:
+                with self.lock:
+                    retired, self.retired = self.retired, []
+                    watchers = list(self.watchers.items())
+                for w in retired:
+                    w.close()
+                fds = {w.fd: (w, cb) for w, cb in watchers if getattr(w, "fd", None) is not None}
+                ready, _, _ = select.select([self.wake_r, *fds], [], [],
+                                            max(0.0, next_scan - time.monotonic()))
+                start = time.perf_counter()
+                if self.wake_r in ready:
+                    try:
+                        while os.read(self.wake_r, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                due = time.monotonic() >= next_scan
+                if due:
+                    next_scan = time.monotonic() + self.interval
+                for w, cb in watchers:
+                    if (w.fd in ready) if getattr(w, "fd", None) is not None else due:
+                        self._poll(w, cb)
+                self.busy += time.perf_counter() - start
+        finally:
+            with self.lock:
+                for w in list(self.watchers) + self.retired:
+                    w.close()
+                self.watchers.clear()
+            os.close(self.wake_r)
+            os.close(self.wake_w)
+
+    def _poll(self, watcher, callbacks):
+        on_found, on_error = callbacks
+        start = time.perf_counter()
+        try:
+            found = watcher.poll()
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            return
+        on_found(found, time.perf_counter() - start)
+
+
+# ---------- EXIF capture times ----------
+_EXIF_IFD_POINTER = 0x8769
+_EXIF_DATETIME_ORIGINAL = 0x9003
+_EXIF_SUBSEC = 0x9290
+_EXIF_SUBSEC_ORIGINAL = 0x9291
+
+
+def _exif_segment(head):
+    """(start, end) of the TIFF block in a JPEG's Exif APP1 segment, or None.
+    `end` may lie past the bytes we have."""
+    if head[:2] != b"\xff\xd8":
+        return None
+    off = 2
+    while off + 4 <= len(head):
+        if head[off] != 0xFF:
+            return None
+        marker = head[off + 1]
+        if marker == 0xFF:              # fill byte
+            off += 1
+            continue
+        if marker in (0xD9, 0xDA):      # end of image / start of scan: no more metadata
+            return None
+        length = struct.unpack_from(">H", head, off + 2)[0]
+        if marker == 0xE1 and head[off + 4:off + 10] == b"Exif\0\0":
+            return off + 10, off + 2 + length
+        off += 2 + length
+    return None
+
+
+def parse_exif_time(tiff):
+    """Capture time (epoch seconds, camera clock read as local time) from a TIFF
+    block, or None if it has no DateTimeOriginal. Raises IndexError or
+    struct.error if the block is cut short."""
+    order = {b"II": "<", b"MM": ">"}.get(bytes(tiff[:2]))
+    if order is None:
+        return None
+    entry = struct.Struct(order + "HHI")     # tag, type, count (+ 4 bytes value/offset)
+    u16 = struct.Struct(order + "H")
+    u32 = struct.Struct(order + "I")
+
+    def entries(ifd):
+        for k in range(u16.unpack_from(tiff, ifd)[0]):
+            pos = ifd + 2 + 12 * k
+            tag, _, count = entry.unpack_from(tiff, pos)
+            yield tag, count, pos + 8
+
+    def text(count, pos):
+        if count > 4:
+            pos = u32.unpack_from(tiff, pos)[0]
+        raw = bytes(tiff[pos:pos + count])
+        if len(raw) < count:
+            raise IndexError("Exif string cut short")
+        return raw.split(b"\0", 1)[0].decode("ascii", "replace").strip()
+
+    exif_ifd = None
+    for tag, _, pos in entries(u32.unpack_from(tiff, 4)[0]):
+        if tag == _EXIF_IFD_POINTER:
+            exif_ifd = u32.unpack_from(tiff, pos)[0]
+            break
+    if exif_ifd is None:
+        return None
+    when = subsec = subsec_any = None
+    for tag, count, pos in entries(exif_ifd):
+        if tag == _EXIF_DATETIME_ORIGINAL:
+            when = text(count, pos)
+        elif tag == _EXIF_SUBSEC_ORIGINAL:
+            subsec = text(count, pos)
+        elif tag == _EXIF_SUBSEC:
+            subsec_any = text(count, pos)
+    try:
+        t = datetime.datetime.strptime(when or "", "%Y:%m:%d %H:%M:%S").timestamp()
+    except ValueError:
+        return None
+    subsec = subsec or subsec_any
+    if subsec and subsec.isdigit():
+        t += int(subsec) / 10 ** len(subsec)
+    return t
+
+
+def read_exif_time(path, head_bytes=EXIF_HEAD_BYTES):
+    """Capture time of a JPEG from its Exif header, or None if it has none.
+
+    Only `head_bytes` are read; the rest of the APP1 segment is fetched only
+    when the tags turn out to lie past that (never the image data itself).
+    """
+    with open(path, "rb") as f:
+        head = f.read(head_bytes)
+        seg = _exif_segment(head)
+        if seg is None:
+            return None
+        start, end = seg
+        try:
+            return parse_exif_time(memoryview(head)[start:end])
+        except (IndexError, struct.error):
+            if end <= len(head):
+                return None             # malformed, not just cut short
+        f.seek(start)
+        tiff = f.read(end - start)
+    try:
+        return parse_exif_time(tiff)
+    except (IndexError, struct.error):
+        return None
+
+
+class ExifReader:
+    """Reads capture times on a small thread pool, so a folder scan never waits
+    on file I/O. Results are cached by (name, size, mtime): a file seen again
+    (a rescan after an inotify overflow, an offline re-pair) costs one stat."""
+
+    def __init__(self, workers=EXIF_WORKERS, cache_max=EXIF_CACHE_MAX):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exif")
+        self.cache_max = cache_max
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.missing = 0                # files read that had no capture time
+        self.read_sec = 0.0
+
+    def capture_time(self, path):
+        """Capture time of one file (blocking, any thread); None if it has none."""
+        st = os.stat(path)
+        key = (os.path.basename(path), st.st_size, st.st_mtime_ns)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return self.cache[key]
+        start = time.perf_counter()
+        t = read_exif_time(path)
+        with self.lock:
+            self.misses += 1
+            self.missing += t is None
+            self.read_sec += time.perf_counter() - start
+            self.cache[key] = t
+            if len(self.cache) > self.cache_max:
+                self.cache.popitem(last=False)
+        return t
+
+    def submit(self, folder, found, done):
+        """Look up watcher results [(name, mtime)] in the background, then call
+        done([(name, mtime, capture time or None)]) once, in the same order."""
+        futures = [self.pool.submit(self.capture_time, os.path.join(folder, name)) for name, _ in found]
+        left = [len(futures)]
+        lock = threading.Lock()
+
+        def finished(_):
+            with lock:
+                left[0] -= 1
+                if left[0]:
+                    return
+            done([(name, mtime, None if f.cancelled() or f.exception() else f.result())
+                  for (name, mtime), f in zip(found, futures)])
+
+        for f in futures:
+            f.add_done_callback(finished)
+
+    def stats(self):
+        with self.lock:
+            reads = self.misses
+            return {"hits": self.hits, "reads": reads, "missing": self.missing,
+                    "read_ms": self.read_sec * 1000.0 / reads if reads else 0.0}
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class CameraClock:
+    """Maps camera capture times onto the exposure timeline.
+
+    The camera clock is set by hand and drifts, so capture times need an
+    offset. Images are numbered from their capture times alone: the first one
+    of a run is exposure 1, and each later one is as many frames on as its
+    gap from the newest image spans at the exposure period. Once the exposure
+    with that number has been timestamped, (exposure - capture) is a sample of
+    the offset. The offset is the median of the last `frames` samples (frames
+    within `warmup` of the start are skipped while the timeline settles).
+    Until there are enough, images keep an mtime-like time: capture plus the
+    smallest (mtime - capture) seen.
+    """
+
+    def __init__(self, frames=EXIF_CALIBRATION_FRAMES, warmup=EXIF_WARMUP_FRAMES,
+                 match_periods=EXIF_MATCH_PERIODS, window=EXIF_FRAME_WINDOW):
+        self.samples = deque(maxlen=frames)
+        self.warmup = warmup
+        self.match_periods = match_periods
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.samples.clear()
+        self.exposures = {}             # frame number -> exposure time, newest `window`
+        self.pending = {}               # frame number -> capture time, waiting for its exposure
+        self.newest_exposure = None     # (frame number, time)
+        self.newest_image = None        # (frame number, capture time)
+        self.write_offset = None
+        self.offset = None              # median (exposure - capture), once calibrated
+        self.tolerance = None
+
+    @property
+    def calibrated(self):
+        return self.offset is not None
+
+    @property
+    def period(self):
+        """Exposure period over the window, or None before two frames are in."""
+        if not self.exposures:
+            return None
+        n0 = next(iter(self.exposures))
+        n1, t1 = self.newest_exposure
+        return (t1 - self.exposures[n0]) / (n1 - n0) if n1 > n0 else None
+
+    def add_exposure(self, n, t):
+        self.exposures[n] = t
+        self.newest_exposure = (n, t)
+        if len(self.exposures) > self.window:
+            del self.exposures[next(iter(self.exposures))]
+        capture = self.pending.pop(n, None)
+        if capture is not None:
+            self._sample(n, t - capture)
+
+    def to_exposure_time(self, capture, mtime):
+        n = self._number(capture)
+        t = self.exposures.get(n)
+        if t is not None:
+            self._sample(n, t - capture)
+        elif n > self.warmup:
+            self.pending[n] = capture
+            if len(self.pending) > self.window:
+                del self.pending[next(iter(self.pending))]
+        if self.offset is not None:
+            return capture + self.offset
+        if self.write_offset is None or mtime - capture < self.write_offset:
+            self.write_offset = mtime - capture
+        return capture + self.write_offset
+
+    def _number(self, capture):
+        if self.newest_image is None:
+            n = 1
+        else:
+            n0, c0 = self.newest_image
+            period = self.period
+            # before the first poll there is no period yet: take it as the next frame
+            n = n0 + (round((capture - c0) / period) if period else 1)
+        if self.newest_image is None or n > self.newest_image[0]:
+            self.newest_image = (n, capture)
+        return n
+
+    def _sample(self, n, sample):
+        if n <= self.warmup:
+            return
+        self.samples.append(sample)
+        if len(self.samples) == self.samples.maxlen and self.period:
+            self.offset = sorted(self.samples)[len(self.samples) // 2]
+            self.tolerance = min(MATCH_TOLERANCE_SEC, self.period * self.match_periods)
+
+
+class LineFramer:
+    """Splits a TCP byte stream into text lines.
+
+    Data is received straight into a preallocated bytearray and each chunk is
+    searched for newlines exactly once; complete lines are decoded from a
+    memoryview. Only a trailing partial line is ever moved, and only when the
+    buffer runs out of room for the next read.
+    """
+
+    def __init__(self, recv_size=RECV_SIZE):
+        self.recv_size = recv_size
+        self.buf = bytearray(recv_size * 2)
+        self.view = memoryview(self.buf)
+        self.start = 0      # first byte of the unconsumed partial line
+        self.scan = 0       # bytes before this have been searched for b"\n"
+        self.end = 0        # end of received data
+        self.moved = 0      # bytes shifted to the front so far (for benchmarks)
+
+    def _make_room(self):
+        if self.end + self.recv_size <= len(self.buf):
+            return
+        pending = self.end - self.start
+        if pending + self.recv_size > len(self.buf):
+            # a single line longer than the buffer: grow it
+            self.view.release()
+            self.buf.extend(bytes(pending + self.recv_size - len(self.buf)))
+            self.view = memoryview(self.buf)
+        if self.start:
+            self.buf[:pending] = bytes(self.view[self.start:self.end])
+            self.moved += pending
+            self.scan -= self.start
+            self.start, self.end = 0, pending
+
+    def recv_into(self, sock):
+        """Read once from the socket; return the byte count (0 means EOF)."""
+        self._make_room()
+        n = sock.recv_into(self.view[self.end:], self.recv_size)
+        self.end += n
+        return n
+
+    def feed(self, data):
+        """Append bytes that came from somewhere other than a socket."""
+        for i in range(0, len(data), self.recv_size):
+            chunk = data[i:i + self.recv_size]
+            self._make_room()
+            self.buf[self.end:self.end + len(chunk)] = chunk
+            self.end += len(chunk)
+
+    def pop_lines(self):
+        """Return all complete lines received so far, decoded and stripped."""
+        buf, view, end = self.buf, self.view, self.end
+        start = self.start
+        lines = []
+        i = buf.find(b"\n", self.scan, end)
+        while i >= 0:
+            lines.append(str(view[start:i], "utf-8", "ignore").strip())
+            start = i + 1
+            i = buf.find(b"\n", start, end)
+        if start == end:
+            self.start = self.scan = self.end = 0
+        else:
+            self.start, self.scan = start, end
+        return lines
+
+
+class SessionWriter:
+    """Owns the run's CSV: one open handle, buffered rows.
+
+    Rows are flushed after CSV_FLUSH_ROWS rows or CSV_FLUSH_SEC seconds (call
+    tick() regularly for the latter) and fsync'd every CSV_FSYNC_SEC. Past
+    CSV_ROTATE_BYTES the file is closed and logging continues in
+    <name>_part2.csv, _part3.csv, ... each with its own header.
+    """
+
+    def __init__(self, path, header=CSV_HEADER, flush_rows=CSV_FLUSH_ROWS, flush_sec=CSV_FLUSH_SEC,
+                 fsync_sec=CSV_FSYNC_SEC, rotate_bytes=CSV_ROTATE_BYTES, clock=time.monotonic):
+        self.base = Path(path)
+        self.header = header
+        self.flush_rows = flush_rows
+        self.flush_sec = flush_sec
+        self.fsync_sec = fsync_sec
+        self.rotate_bytes = rotate_bytes
+        self.clock = clock
+        self.part = 1
+        self.path = self.base
+        self.f = None
+        self.writer = None
+        self.buffered = 0
+        self.oldest = None          # clock() of the oldest unflushed row
+        self.last_fsync = clock()
+        self.unsynced = False       # flushed to the OS but not fsync'd yet
+        self.rows_written = 0
+        self.flushes = 0
+        self.flush_total = 0.0
+        self.flush_max = 0.0
+        self._open()
+
+    def _open(self):
+        self.f = open(self.path, "w", newline="", buffering=1 << 16)
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(self.header)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.writer.writerow(row)
+            self.rows_written += 1
+            self.buffered += 1
+        if self.buffered and self.oldest is None:
+            self.oldest = self.clock()
+        if self.buffered >= self.flush_rows:
+            self.flush()
+
+    def tick(self):
+        """Time-based flush / fsync; cheap enough to call every UI frame."""
+        now = self.clock()
+        if self.oldest is not None and now - self.oldest >= self.flush_sec:
+            self.flush()
+        elif self.unsynced and self.fsync_sec and now - self.last_fsync >= self.fsync_sec:
+            self.flush(fsync=True)
+
+    def flush(self, fsync=False):
+        if self.f is None:
+            return
+        start = time.perf_counter()
+        self.f.flush()
+        now = self.clock()
+        if fsync or (self.fsync_sec and now - self.last_fsync >= self.fsync_sec):
+            os.fsync(self.f.fileno())
+            self.last_fsync = now
+            self.unsynced = False
+        else:
+            self.unsynced = True
+        took = time.perf_counter() - start
+        self.flushes += 1
+        self.flush_total += took
+        self.flush_max = max(self.flush_max, took)
+        self.buffered = 0
+        self.oldest = None
+        if self.rotate_bytes and self.f.tell() >= self.rotate_bytes:
+            self.f.close()
+            self.part += 1
+            self.path = self.base.with_name(f"{self.base.stem}_part{self.part}{self.base.suffix}")
+            self._open()
+
+    def stats(self):
+        mean = self.flush_total / self.flushes * 1e3 if self.flushes else 0.0
+        return (f"{self.rows_written} rows, {self.flushes} flushes "
+                f"(mean {mean:.2f} ms, max {self.flush_max * 1e3:.2f} ms)")
+
+    def close(self):
+        if self.f is None:
+            return
+        self.flush(fsync=True)
+        self.f.close()
+        self.f = None
+
+
+# ---------- Session store ----------
+_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, unit TEXT NOT NULL, started REAL NOT NULL, stopped REAL,
+    csv_path TEXT, image_dir TEXT);
+CREATE TABLE IF NOT EXISTS exposures (
+    run INTEGER NOT NULL, count INTEGER NOT NULL, ts REAL NOT NULL, err_ms REAL);
+CREATE TABLE IF NOT EXISTS images (
+    run INTEGER NOT NULL, name TEXT NOT NULL, ts REAL NOT NULL, capture REAL);
+CREATE TABLE IF NOT EXISTS pairs (
+    run INTEGER NOT NULL, count INTEGER NOT NULL, image TEXT NOT NULL,
+    exposure_ts REAL NOT NULL, image_ts REAL NOT NULL, delta_ms INTEGER NOT NULL, err_ms REAL);
+CREATE INDEX IF NOT EXISTS exposures_ts ON exposures (ts);
+CREATE INDEX IF NOT EXISTS exposures_run ON exposures (run, count);
+CREATE INDEX IF NOT EXISTS images_ts ON images (ts);
+CREATE INDEX IF NOT EXISTS images_run ON images (run, name);
+CREATE INDEX IF NOT EXISTS pairs_ts ON pairs (exposure_ts);
+CREATE INDEX IF NOT EXISTS pairs_run ON pairs (run, count);
+CREATE INDEX IF NOT EXISTS pairs_image ON pairs (run, image);
+CREATE INDEX IF NOT EXISTS pairs_delta ON pairs (delta_ms);
+"""
+_DB_RUN = "INSERT INTO runs (unit, started, csv_path, image_dir) VALUES (?, ?, ?, ?)"
+_DB_STOP = "UPDATE runs SET stopped = ? WHERE id = ?"
+_DB_EXPOSURE = "INSERT INTO exposures VALUES (?, ?, ?, ?)"
+_DB_IMAGE = "INSERT INTO images VALUES (?, ?, ?, ?)"
+_DB_PAIR = "INSERT INTO pairs VALUES (?, ?, ?, ?, ?, ?, ?)"
+
+
+def open_session_db(path):
+    """A connection to a session database in WAL mode, with the tables created."""
+    db = sqlite3.connect(str(path), timeout=10.0)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")     # WAL: a crash can lose the last commits, never corrupt
+    db.executescript(_DB_SCHEMA)
+    return db
+
+
+class SessionStore:
+    """Optional SQLite record of every run: all exposures and images, matched
+    or not, and the pairs, indexed by time, count and Delta so questions like
+    "every pair over 500 ms apart last week" don't mean parsing CSVs.
+
+    Only the writer thread touches the database. add_*() append to a pending
+    list and return; the writer inserts everything pending in one transaction
+    once DB_BATCH_ROWS rows wait or every DB_BATCH_SEC, so the pipeline never
+    waits on the disk. In WAL mode readers (query_pairs(), export_run_csv(),
+    sessions.py) use their own connections and don't block it, and several
+    processes can write one file: begin_run() returns a handle that the
+    writer swaps for the row id SQLite gives the run.
+
+    A batch that fails because the file is busy or full is rolled back and
+    retried; one that fails on its data is retried entry by entry and only
+    the failing entries are dropped. Both are logged and shown in stats().
+    """
+
+    def __init__(self, path, batch_rows=DB_BATCH_ROWS, batch_sec=DB_BATCH_SEC, log=None):
+        self.path = str(path)
+        self.batch_rows = batch_rows
+        self.batch_sec = batch_sec
+        self.log = log
+        open_session_db(self.path).close()
+        self.cond = threading.Condition()
+        self.handles = itertools.count(1)
+        self.run_ids = {}               # begin_run() handle -> runs.id (writer thread)
+        self.pending = []               # (sql, rows) in arrival order
+        self.pending_rows = 0
+        self.added = 0                  # (sql, rows) entries handed over / committed, for flush()
+        self.done = 0
+        self.flushing = False
+        self.closed = False
+        self.rows_written = 0
+        self.commits = 0
+        self.commit_total = 0.0
+        self.commit_max = 0.0
+        self.rows_dropped = 0
+        self.failures = 0               # failed commits in a row (retried)
+        self.error = None               # last failure
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # ---------- API (any thread) ----------
+    def begin_run(self, unit, csv_path, image_dir, started):
+        """Register a run; returns at once with the handle to file its rows under."""
+        run = next(self.handles)
+        self._add(_DB_RUN, [(run, unit, started, csv_path, image_dir)])
+        return run
+
+    def end_run(self, run, stopped):
+        self._add(_DB_STOP, [(stopped, run)])
+
+    def add_exposures(self, rows):
+        """rows: (run, count, ts, err_ms)."""
+        self._add(_DB_EXPOSURE, rows)
+
+    def add_images(self, rows):
+        """rows: (run, name, ts, capture time or None)."""
+        self._add(_DB_IMAGE, rows)
+
+    def add_pairs(self, rows):
+        """rows: (run, count, image name, exposure ts, image ts, delta_ms, err_ms)."""
+        self._add(_DB_PAIR, rows)
+
+    def _add(self, sql, rows):
+        if not rows:
+            return
+        with self.cond:
+            if self.closed:
+                return
+            self.pending.append((sql, rows))
+            self.pending_rows += len(rows)
+            self.added += 1
+            if self.pending_rows >= self.batch_rows:
+                self.cond.notify()
+
+    def flush(self, timeout=None):
+        """Wait until everything added so far is committed; False on timeout."""
+        with self.cond:
+            target = self.added
+            self.flushing = True
+            self.cond.notify()
+            return self.cond.wait_for(lambda: self.done >= target, timeout)
+
+    def stats(self):
+        mean = self.commit_total / self.commits * 1e3 if self.commits else 0.0
+        state = f", {self.rows_dropped} dropped, last error: {self.error}" if self.error else ""
+        return (f"{self.rows_written} rows in {self.commits} commits "
+                f"(mean {mean:.2f} ms, max {self.commit_max * 1e3:.2f} ms) -> {self.path}{state}")
+
+    def close(self, timeout=10.0):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout)
+
+    # ---------- writer thread ----------
+    def _run(self):
+        db = open_session_db(self.path)
+        try:
+            while True:
+                with self.cond:
+                    ready = self.closed or self.flushing or self.pending_rows >= self.batch_rows
+                    if not ready or self.failures:
+                        self.cond.wait(self.batch_sec)
+                    batch, self.pending, self.pending_rows = self.pending, [], 0
+                    self.flushing = False
+                    closing = self.closed
+                if batch:
+                    self._commit(db, batch, retry=not (closing and self.failures >= DB_RETRIES))
+                if closing and not self.pending:
+                    break
+            db.execute("PRAGMA optimize")
+        finally:
+            db.close()
+
+    def _commit(self, db, batch, retry=True):
+        start = time.perf_counter()
+        size = sum(len(rows) for _, rows in batch)
+        try:
+            rows = self._insert(db, batch)
+        except sqlite3.OperationalError as e:
+            # busy, locked, full: nothing went in, the same rows can go in later
+            self._failed(e)
+            if retry:
+                with self.cond:
+                    self.pending[:0] = batch
+                    self.pending_rows += size
+                return
+            rows = 0
+        except sqlite3.Error as e:
+            # a bad row: keep everything else
+            self._failed(e)
+            rows = 0
+            for entry in batch:
+                try:
+                    rows += self._insert(db, [entry])
+                except sqlite3.Error:
+                    pass
+            self.failures = 0
+        else:
+            if self.failures:
+                self._say(f"[DB] writing again after {self.failures} failed commits")
+            self.failures = 0
+        took = time.perf_counter() - start
+        with self.cond:
+            self.rows_written += rows
+            self.rows_dropped += size - rows
+            self.commits += 1
+            self.commit_total += took
+            self.commit_max = max(self.commit_max, took)
+            self.done += len(batch)
+            self.cond.notify_all()
+
+    def _insert(self, db, batch):
+        """One transaction; run handles become runs.id as the runs go in."""
+        ids = dict(self.run_ids)
+        rows = 0
+        try:
+            with db:
+                for sql, group in itertools.groupby(batch, key=lambda entry: entry[0]):
+                    chunk = [row for _, entry_rows in group for row in entry_rows]
+                    if sql is _DB_RUN:
+                        for run, *values in chunk:
+                            ids[run] = db.execute(sql, values).lastrowid
+                    elif sql is _DB_STOP:
+                        db.executemany(sql, [(stopped, ids[run]) for stopped, run in chunk])
+                    else:
+                        db.executemany(sql, [(ids[row[0]],) + row[1:] for row in chunk])
+                    rows += len(chunk)
+        except KeyError as e:
+            raise sqlite3.IntegrityError(f"rows for run handle {e} whose run was not stored")
+        self.run_ids = ids
+        return rows
+
+    def _failed(self, e):
+        self.error = e
+        self.failures += 1
+        if self.failures == 1:
+            self._say(f"[DB ERROR] {self.path}: {e}")
+
+    def _say(self, text):
+        if self.log is not None:
+            self.log.put(text)
+        else:
+            print(text, file=sys.stderr, flush=True)
+
+
+def query_pairs(db, since=None, until=None, min_abs_delta_ms=None, unit=None, limit=None):
+    """Stored pairs as (unit, run, count, image, exposure_ts, image_ts, delta_ms, err_ms),
+    oldest first, optionally limited to an exposure time range, |Delta| and unit.
+    `db` is a path or an open connection.
+
+    A |Delta| limit is meant for outliers, so it drives the search (pairs_delta)
+    and the time range only filters; without one the time index is used."""
+    where, args = [], []
+    ts = "+p.exposure_ts" if min_abs_delta_ms is not None else "p.exposure_ts"   # '+' keeps SQLite off pairs_ts
+    if since is not None:
+        where.append(f"{ts} >= ?")
+        args.append(since)
+    if until is not None:
+        where.append(f"{ts} < ?")
+        args.append(until)
+    if min_abs_delta_ms is not None:
+        where.append("(p.delta_ms > ? OR p.delta_ms < ?)")
+        args += [min_abs_delta_ms, -min_abs_delta_ms]
+    if unit is not None:
+        where.append("r.unit = ?")
+        args.append(unit)
+    sql = ("SELECT r.unit, p.run, p.count, p.image, p.exposure_ts, p.image_ts, p.delta_ms, p.err_ms "
+           "FROM pairs p JOIN runs r ON r.id = p.run"
+           + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {ts}"
+           + (f" LIMIT {int(limit)}" if limit else ""))
+    return _read(db, sql, args)
+
+
+def unmatched(db, run):
+    """(exposures, images) of a run that never paired: [(count, ts)], [(name, ts)]."""
+    # '+' sorts the few leftovers instead of walking the time index of every run
+    exposures = _read(db, "SELECT e.count, e.ts FROM exposures e WHERE e.run = ? AND NOT EXISTS "
+                          "(SELECT 1 FROM pairs p WHERE p.run = e.run AND p.count = e.count) ORDER BY +e.ts", (run,))
+    images = _read(db, "SELECT i.name, i.ts FROM images i WHERE i.run = ? AND NOT EXISTS "
+                       "(SELECT 1 FROM pairs p WHERE p.run = i.run AND p.image = i.name) ORDER BY +i.ts", (run,))
+    return exposures, images
+
+
+def export_run_csv(db, run, path):
+    """Write a run's pairs in the usual exposure_log CSV layout; returns the row count."""
+    rows = _read(db, "SELECT exposure_ts, count, image_ts, image, delta_ms, err_ms FROM pairs "
+                     "WHERE run = ? ORDER BY count", (run,))
+    fmt = lambda ts: datetime.datetime.fromtimestamp(ts).isoformat(" ", "milliseconds")   # = strftime(...%f)[:-3]
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(CSV_HEADER)
+        w.writerows([fmt(ets), count, fmt(its), image, delta, "" if err is None else int(round(err))]
+                    for ets, count, its, image, delta, err in rows)
+    return len(rows)
+
+
+def _read(db, sql, args=()):
+    if isinstance(db, sqlite3.Connection):
+        return db.execute(sql, args).fetchall()
+    conn = sqlite3.connect(str(db), timeout=10.0)
+    try:
+        return conn.execute(sql, args).fetchall()
+    finally:
+        conn.close()
+
+
+# ---------- Traffic capture ----------
+CAP_SYNC, CAP_TX, CAP_RX, CAP_IMAGES, CAP_RUN, CAP_STOP, CAP_NOTE = range(7)
+CAPTURE_MAGIC = b"AQCAP1\n\0"
+_CAP_FILE = struct.Struct("<dd")        # time.time(), time.monotonic() when the file was opened
+_CAP_RECORD = struct.Struct("<BIH")     # kind, microseconds since the previous record, payload bytes
+_CAP_IMAGE = struct.Struct("<ddH")      # mtime, capture time (NaN = none), name bytes
+_CAP_MAX_PAYLOAD = 0xFFFF
+_CAP_MAX_DELTA_US = 0xFFFFFFFF
+
+
+class TrafficCapture:
+    """Always-on, append-only binary record of one controller's traffic:
+    every line sent and received, every batch of images found and the run
+    starts / stops, each on time.monotonic().
+
+    A file is the 8-byte magic, then (wall, monotonic) at open, then records
+    of a 7-byte header (kind, microseconds since the previous record, payload
+    length) plus the payload: UTF-8 text for lines (a received batch is joined
+    with newlines), packed (mtime, capture, name) for images. A gap too long
+    for the header gets a CAP_SYNC record with the absolute time. Writes are
+    buffered and flushed every CAPTURE_FLUSH_SEC; past CAPTURE_ROTATE_BYTES
+    the file continues in <name>_part2.aqcap, ... and the oldest .aqcap files
+    in the folder beyond CAPTURE_KEEP_FILES are deleted. Safe to call from any
+    thread; a write error turns the capture off instead of failing the caller.
+    """
+
+    def __init__(self, folder=CAPTURE_DIR, name="capture", rotate_bytes=CAPTURE_ROTATE_BYTES,
+                 keep_files=CAPTURE_KEEP_FILES, flush_sec=CAPTURE_FLUSH_SEC):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        ts = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        self.base = self.folder / f"{name}_{ts}.aqcap"
+        self.rotate_bytes = rotate_bytes
+        self.keep_files = keep_files
+        self.flush_sec = flush_sec
+        self.lock = threading.Lock()
+        self.part = 1
+        self.path = self.base
+        self.f = None
+        self.last = None                # monotonic time of the previous record
+        self.last_flush = 0.0
+        self.events = 0
+        self.bytes = 0
+        self.error = None
+        self._open()
+
+    def _open(self):
+        self.f = open(self.path, "ab", buffering=1 << 16)
+        wall, mono = time.time(), time.monotonic()
+        self.f.write(CAPTURE_MAGIC + _CAP_FILE.pack(wall, mono))
+        self.last = mono
+        self._prune()
+
+    def _prune(self):
+        if not self.keep_files:
+            return
+        try:
+            files = sorted(self.folder.glob("*.aqcap"), key=lambda p: p.stat().st_mtime)
+            for p in files[:-self.keep_files]:
+                if p != self.path:
+                    p.unlink()
+        except OSError:
+            pass
+
+    # ---------- events (any thread) ----------
+    def sent(self, text, now=None):
+        self._write(CAP_TX, text.rstrip("\n").encode("utf-8", "replace")[:_CAP_MAX_PAYLOAD], now)
+
+    def received(self, lines, now=None):
+        chunk, size = [], 0
+        for line in lines:
+            data = line.encode("utf-8", "replace")[:_CAP_MAX_PAYLOAD]
+            if chunk and size + 1 + len(data) > _CAP_MAX_PAYLOAD:
+                self._write(CAP_RX, b"\n".join(chunk), now)
+                chunk, size = [], 0
+            chunk.append(data)
+            size += len(data) + 1
+        if chunk:
+            self._write(CAP_RX, b"\n".join(chunk), now)
+
+    def images(self, found, now=None):
+        """found: [(name, mtime)] or [(name, mtime, capture time or None)]."""
+        out = bytearray()
+        for name, mtime, *capture in found:
+            data = name.encode("utf-8", "replace")[:255]
+            capture = capture[0] if capture and capture[0] is not None else math.nan
+            if len(out) + _CAP_IMAGE.size + len(data) > _CAP_MAX_PAYLOAD:
+                self._write(CAP_IMAGES, bytes(out), now)
+                out.clear()
+            out += _CAP_IMAGE.pack(mtime, capture, len(data)) + data
+        if out:
+            self._write(CAP_IMAGES, bytes(out), now)
+
+    def mark(self, kind, text="", now=None):
+        """CAP_RUN (text = image folder), CAP_STOP or CAP_NOTE."""
+        self._write(kind, text.encode("utf-8", "replace")[:_CAP_MAX_PAYLOAD], now)
+
+    def _write(self, kind, payload, now=None):
+        if self.f is None:
+            return
+        with self.lock:
+            if self.f is None:
+                return
+            now = time.monotonic() if now is None else now
+            try:
+                # a record may be timed just before the previous one (another thread); keep order
+                delta = max(0, int(round((now - self.last) * 1e6)))
+                if delta > _CAP_MAX_DELTA_US:
+                    self.f.write(_CAP_RECORD.pack(CAP_SYNC, 0, 8) + struct.pack("<d", now))
+                    self.last, delta = now, 0
+                self.f.write(_CAP_RECORD.pack(kind, delta, len(payload)))
+                self.f.write(payload)
+                # the time a reader will add up to, so rounding never accumulates
+                self.last += delta / 1e6
+                self.events += 1
+                self.bytes += _CAP_RECORD.size + len(payload)
+                if now - self.last_flush >= self.flush_sec:
+                    self.last_flush = now
+                    self.f.flush()
+                    if self.rotate_bytes and self.f.tell() >= self.rotate_bytes:
+                        self.f.close()
+                        self.part += 1
+                        self.path = self.base.with_name(f"{self.base.stem}_part{self.part}{self.base.suffix}")
+                        self._open()
+            except (OSError, ValueError) as e:
+                self.error = e
+                try: self.f.close()
+                except Exception: pass
+                self.f = None
+
+    def stats(self):
+        per = self.bytes / self.events if self.events else 0.0
+        state = f", stopped: {self.error}" if self.error else ""
+        return f"{self.events} events, {self.bytes / 1e6:.1f} MB ({per:.0f} B/event) -> {self.path}{state}"
+
+    def close(self):
+        with self.lock:
+            if self.f is not None:
+                try:
+                    self.f.close()
+                except OSError as e:
+                    self.error = e
+                self.f = None
+
+
+def capture_files(path):
+    """A capture and its rotated _partN files that still exist, in order."""
+    path = Path(path)
+    parts = []
+    for p in path.parent.glob(f"{glob_escape(path.stem)}_part*{path.suffix}"):
+        m = re.search(r"_part(\d+)$", p.stem)
+        if m and p.stem[:m.start()] == path.stem:
+            parts.append((int(m.group(1)), p))
+    # the first files may have been pruned; replay what is left
+    files = ([path] if path.exists() else []) + [p for _, p in sorted(parts)]
+    return files or [path]
+
+
+def read_capture(paths):
+    """Yield (t_monotonic, kind, value, wall_offset) from capture files in order.
+    value is a str for CAP_TX / CAP_RUN / CAP_NOTE, a list of lines for CAP_RX
+    and [(name, mtime, capture or None)] for CAP_IMAGES; wall_offset is
+    time.time() - time.monotonic() on the recording machine. A record cut off
+    by a crash ends its file."""
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(CAPTURE_MAGIC):
+            raise ValueError(f"{path}: not a capture file")
+        pos = len(CAPTURE_MAGIC)
+        wall, t = _CAP_FILE.unpack_from(data, pos)
+        offset = wall - t
+        pos += _CAP_FILE.size
+        end = len(data)
+        while pos + _CAP_RECORD.size <= end:
+            kind, delta, size = _CAP_RECORD.unpack_from(data, pos)
+            pos += _CAP_RECORD.size
+            if pos + size > end:
+                break
+            payload = data[pos:pos + size]
+            pos += size
+            t += delta / 1e6
+            if kind == CAP_SYNC:
+                t = struct.unpack("<d", payload)[0]
+            elif kind == CAP_RX:
+                yield t, kind, payload.decode("utf-8", "replace").split("\n"), offset
+            elif kind == CAP_IMAGES:
+                found, i = [], 0
+                while i < size:
+                    mtime, capture, n = _CAP_IMAGE.unpack_from(payload, i)
+                    i += _CAP_IMAGE.size
+                    name = payload[i:i + n].decode("utf-8", "replace")
+                    i += n
+                    found.append((name, mtime, None if math.isnan(capture) else capture))
+                yield t, kind, found, offset
+            else:
+                yield t, kind, payload.decode("utf-8", "replace"), offset
+
+
+class LineQueue:
+    """Thread-safe FIFO of text lines, drained in batches by the Tk thread.
+
+    With a maxlen the oldest lines are dropped (and counted) once it is full.
+    """
+
+    def __init__(self, maxlen=None):
+        self.lock = threading.Lock()
+        self.lines = deque(maxlen=maxlen)
+        self.dropped = 0
+        self.peak = 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def put(self, line):
+        self.put_many((line,))
+
+    def put_many(self, lines):
+        with self.lock:
+            q = self.lines
+            for line in lines:
+                if len(q) == q.maxlen:
+                    self.dropped += 1
+                q.append(line)
+            if len(q) > self.peak:
+                self.peak = len(q)
+
+    def drain(self):
+        with self.lock:
+            out = list(self.lines)
+            self.lines.clear()
+        return out
+
+
+def classify_command(cmd):
+    """Return (kind, reply_prefixes) for a command, following handleCommand()
+    in CurrentArduinoCode.ino. No prefixes means the Nano sends no reply."""
+    c = cmd.strip()
+    if not c:
+        return "", ()
+    if c[0] in "~$":
+        return "FORWARD", ("OK FORWARDED",)
+    u = c.upper()
+    if u == "START_EXPOSURE_COUNT":
+        return u, ("OK EXPOSURE COUNT STARTED",)
+    if u == "STOP_EXPOSURE_COUNT":
+        return u, ("OK EXPOSURE COUNT STOPPED",)
+    if u == "GET_EXPOSURE_COUNT":
+        return u, ("EXPOSURE_COUNT ",)
+    if u == "LAMP OFF":
+        return u, ("OK LAMP OFF",)
+    for kind in ("STROBE_INTENSITY", "LAMP_INTENSITY"):
+        if c.startswith(kind):
+            # the firmware silently ignores the command without a value
+            return kind, ((f"OK {kind}", f"ERR {kind}") if " " in c else ())
+    if u == "STATUS":
+        return u, ("OK STATUS",)
+    return "UNKNOWN", ("UNKNOWN CMD",)
+
+
+class RttStats:
+    """Rolling round-trip times (seconds) per command kind."""
+
+    def __init__(self, window=RTT_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, kind, rtt):
+        with self.lock:
+            q = self.samples.get(kind)
+            if q is None:
+                q = self.samples[kind] = deque(maxlen=self.window)
+            q.append(rtt)
+
+    def summary(self, kind):
+        """(min, p50, p99, n) over the window, or None if nothing recorded yet."""
+        with self.lock:
+            xs = sorted(self.samples.get(kind, ()))
+        if not xs:
+            return None
+        return xs[0], xs[len(xs) // 2], xs[min(len(xs) - 1, int(len(xs) * 0.99))], len(xs)
+
+    def format(self, kind):
+        s = self.summary(kind)
+        if not s:
+            return f"{kind}: -"
+        lo, p50, p99, n = s
+        return f"{kind}: min {lo * 1e3:.0f} / p50 {p50 * 1e3:.0f} / p99 {p99 * 1e3:.0f} ms (n={n})"
+
+
+# ---------- Metrics ----------
+class Histogram:
+    """Fixed-bucket histogram (Prometheus style: counts per upper bound, plus sum)."""
+
+    def __init__(self, bounds, help=""):
+        self.bounds = list(bounds)
+        self.help = help
+        self.counts = [0] * (len(self.bounds) + 1)    # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate from the buckets (linear within one); None if empty."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lo = self.bounds[i - 1] if i else min(0.0, self.bounds[0])
+                return lo + (self.bounds[i] - lo) * (rank - seen) / c
+            seen += c
+        return self.bounds[-1]
+
+
+class Metrics:
+    """Counters, gauges and histograms for one process, cheap enough to leave on.
+
+    Updates are a dict lookup and an add under one uncontended lock. Collectors
+    registered with add_collector() run only when something reads the metrics,
+    so values that already live elsewhere (queue sizes, client counters) cost
+    nothing in between.
+    """
+
+    PREFIX = "aquorea_"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.help = {}
+        self.collectors = []
+
+    def counter(self, name, help=""):
+        self.counters.setdefault(name, 0)
+        self.help[name] = help
+
+    def gauge(self, name, help=""):
+        self.gauges.setdefault(name, 0)
+        self.help[name] = help
+
+    def histogram(self, name, bounds, help=""):
+        self.histograms[name] = Histogram(bounds, help)
+
+    def inc(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms[name].observe(value)
+
+    def add_collector(self, fn):
+        """fn(metrics) is called before every export to refresh derived values."""
+        self.collectors.append(fn)
+
+    def collect(self):
+        for fn in self.collectors:
+            try:
+                fn(self)
+            except Exception:
+                pass
+
+    def snapshot(self):
+        """Plain dict of everything, for the JSON file and the GUI panel."""
+        self.collect()
+        with self.lock:
+            hists = {}
+            for name, h in self.histograms.items():
+                hists[name] = {"count": h.count, "sum": h.sum,
+                               "p50": h.quantile(0.5), "p99": h.quantile(0.99),
+                               "buckets": dict(zip([str(b) for b in h.bounds] + ["+Inf"], h.counts))}
+            return {"time": time.time(), "counters": dict(self.counters),
+                    "gauges": dict(self.gauges), "histograms": hists}
+
+    def prometheus(self):
+        """Prometheus text exposition format (0.0.4)."""
+        self.collect()
+        out = []
+        with self.lock:
+            for name, v in self.counters.items():
+                n = self.PREFIX + name
+                out += [f"# HELP {n} {self.help.get(name, '')}", f"# TYPE {n} counter", f"{n} {v}"]
+            for name, v in self.gauges.items():
+                n = self.PREFIX + name
+                out += [f"# HELP {n} {self.help.get(name, '')}", f"# TYPE {n} gauge", f"{n} {v}"]
+            for name, h in self.histograms.items():
+                n = self.PREFIX + name
+                out += [f"# HELP {n} {h.help}", f"# TYPE {n} histogram"]
+                running = 0
+                for bound, c in zip(h.bounds + ["+Inf"], h.counts):
+                    running += c
+                    out.append(f'{n}_bucket{{le="{bound}"}} {running}')
+                out += [f"{n}_sum {h.sum}", f"{n}_count {h.count}"]
+        return "\n".join(out) + "\n"
+
+
+class MetricsExporter:
+    """Serves Metrics on localhost (/metrics, /metrics.json) and/or rewrites a
+    JSON snapshot file every `interval` seconds. Either part can be left off."""
+
+    def __init__(self, metrics, port=None, path=None, interval=METRICS_SNAPSHOT_SEC):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.server = None
+        self.stop = threading.Event()
+        if port is not None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+            self.server.daemon_threads = True
+            self.port = self.server.server_address[1]
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.thread = None
+        if path:
+            self.thread = threading.Thread(target=self._snapshot_loop, daemon=True)
+            self.thread.start()
+
+    def _handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, ctype = metrics.prometheus().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, ctype = json.dumps(metrics.snapshot()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def write_snapshot(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.metrics.snapshot(), f, indent=1)
+        os.replace(tmp, self.path)
+
+    def _snapshot_loop(self):
+        while not self.stop.wait(self.interval):
+            try:
+                self.write_snapshot()
+            except OSError:
+                pass
+
+    def close(self):
+        self.stop.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.path:
+            try:
+                self.write_snapshot()
+            except OSError:
+                pass
+
+
+def pipeline_metrics():
+    """A Metrics registry with everything ExposurePipeline records declared up front."""
+    m = Metrics()
+    m.counter("exposures_total", "Exposures timestamped from GET_EXPOSURE_COUNT")
+    m.counter("images_total", "New DSC images seen in the watched folder")
+    m.counter("pairs_total", "Exposure/image pairs written to the CSV")
+    m.counter("expired_exposures_total", "Exposures dropped unmatched after PAIR_EXPIRY_SEC")
+    m.counter("expired_images_total", "Images dropped unmatched after PAIR_EXPIRY_SEC")
+    m.counter("reconnects_total", "TCP connections to the Nano after the first")
+    m.counter("command_timeouts_total", "Commands that got no reply within CMD_TIMEOUT_SEC")
+    m.gauge("pending_exposures", "Exposures waiting for an image")
+    m.gauge("pending_images", "Images waiting for an exposure")
+    m.gauge("backend_queue", "Calls waiting for the pipeline worker")
+    m.gauge("log_dropped", "Log/RX lines dropped because the UI fell behind")
+    m.gauge("exif_read_ms", "Mean Exif header read per image (ms, exif timestamps only)")
+    m.gauge("db_pending_rows", "Rows waiting for the session store writer (--db only)")
+    m.histogram("delta_ms", (-2000, -1000, -500, -250, -100, -50, -25, 0, 25, 50, 100, 250, 500, 1000, 2000),
+                "Image minus exposure time of written pairs (ms)")
+    m.histogram("poll_rtt_seconds", (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0),
+                "GET_EXPOSURE_COUNT round trip")
+    m.histogram("scan_seconds", (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0),
+                "One image-folder poll")
+    m.histogram("recover_seconds", (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0),
+                "Link drop noticed -> reconnected")
+    m.histogram("ui_queue_depth", (0, 1, 5, 10, 50, 100, 500, 1000, 5000),
+                "Lines waiting for the front end per frame")
+    return m
+
+
+class _InFlight:
+    __slots__ = ("text", "kind", "replies", "sent", "deadline", "future")
+
+    def __init__(self, text, kind, replies, sent, timeout, future):
+        self.text = text
+        self.kind = kind
+        self.replies = replies
+        self.sent = sent
+        self.deadline = sent + timeout
+        self.future = future
+
+
+class CoalescingSender:
+    """Streams slider values to the Nano while they are being dragged.
+
+    Per channel only the newest value is kept (an unsent older one is simply
+    overwritten), at most one command is outstanding, sends are spaced at
+    least 1/rate apart, and a value the device already acknowledged with
+    "OK ..." is not sent again. `send(channel, value)` returns a Future for
+    the reply, or None if it could not be sent.
+
+    With a `client` (TcpClient), an acknowledged value is only trusted while
+    the same link is up and the slider's command is still the last one sent
+    for that channel, so a reconnect or a typed command makes the next
+    slider value go out again. `forget()` drops everything acknowledged.
+    """
+
+    def __init__(self, send, rate=SLIDER_RATE_HZ, clock=time.monotonic, client=None):
+        self.send = send
+        self.interval = 1.0 / rate
+        self.clock = clock
+        self.client = client
+        self.lock = threading.Lock()
+        self.latest = {}        # channel -> newest value not yet sent
+        self.in_flight = {}     # channel -> value sent, reply pending
+        self.acked = {}         # channel -> value the device confirmed
+        self.acked_link = {}    # channel -> client.connects when it was sent
+        self.last_sent = {}     # channel -> clock() of the last send
+        self.updates = 0
+        self.sent = 0
+
+    def update(self, channel, value, force=False):
+        """Queue `value`; with force it is sent even if the device already has it."""
+        with self.lock:
+            self.latest[channel] = value
+            self.updates += 1
+            if force:
+                self.acked.pop(channel, None)
+        self.pump()
+
+    def forget(self):
+        """Stop trusting acknowledged values (link (re)connected or dropped, other commands sent)."""
+        with self.lock:
+            self.acked.clear()
+            self.acked_link.clear()
+
+    def _has(self, channel, value):
+        if self.acked.get(channel) != value:
+            return False
+        client = self.client
+        if client is None:
+            return True
+        return (self.acked_link.get(channel) == client.connects and client.sock is not None
+                and client.settings.get(channel.split("_")[0]) == f"{channel} {value}")
+
+    def pending(self):
+        return bool(self.latest)
+
+    def next_due(self):
+        """Seconds until pump() may have something to send, or None if idle."""
+        now = self.clock()
+        with self.lock:
+            waits = [self.interval if ch in self.in_flight
+                     else max(0.0, self.last_sent.get(ch, now - self.interval) + self.interval - now)
+                     for ch in self.latest]
+        return min(waits) if waits else None
+
+    def pump(self):
+        """Send whatever is due now."""
+        now = self.clock()
+        due = []
+        with self.lock:
+            for ch, value in list(self.latest.items()):
+                if ch in self.in_flight:
+                    continue
+                if self._has(ch, value):
+                    del self.latest[ch]
+                    continue
+                if now - self.last_sent.get(ch, now - self.interval) < self.interval:
+                    continue
+                del self.latest[ch]
+                self.in_flight[ch] = value
+                self.last_sent[ch] = now
+                due.append((ch, value))
+        for ch, value in due:
+            self.sent += 1
+            link = self.client.connects if self.client else None
+            future = self.send(ch, value)
+            if future is None:
+                self._done(ch, value, link, None)
+            else:
+                future.add_done_callback(lambda f, ch=ch, value=value, link=link: self._done(ch, value, link, f))
+
+    def _done(self, channel, value, link, future):
+        ok = (future is not None and future.exception() is None
+              and (future.result() or "").startswith("OK"))
+        with self.lock:
+            if self.in_flight.get(channel) == value:
+                del self.in_flight[channel]
+            if ok:
+                self.acked[channel] = value
+                self.acked_link[channel] = link
+
+
+def tune_keepalive(sock, idle=KEEPALIVE_IDLE_SEC, interval=KEEPALIVE_INTERVAL_SEC, count=KEEPALIVE_COUNT):
+    """Make the kernel notice a dead peer in seconds rather than hours (best effort per OS)."""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    except OSError:
+        return
+    try:
+        if hasattr(socket, "TCP_KEEPIDLE"):              # Linux
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+        elif hasattr(socket, "TCP_KEEPALIVE"):           # macOS
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+        if hasattr(socket, "TCP_USER_TIMEOUT"):          # Linux: also bound unacknowledged sends
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(IDLE_READ_SEC * 1000))
+        if hasattr(socket, "SIO_KEEPALIVE_VALS"):        # Windows
+            sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, interval * 1000))
+    except OSError:
+        pass
+
+
 class TcpClient:
-    def __init__(self, on_line):
+    def __init__(self, on_line, on_lines=None, recv_size=RECV_SIZE,
+                 queue_size=CMD_QUEUE_MAX, timeout=CMD_TIMEOUT_SEC):
+        """on_line(str) gets one line at a time; if on_lines(list) is given,
+        everything framed from one read is handed over in a single call.
+
+        Outgoing lines go through a bounded queue drained by a writer thread,
+        so send_line never blocks the caller on the socket."""
         self.sock = None
         self.alive = False
         self.rx_thread = None
+        self.tx_thread = None
+        self.tx_queue = None
         self.on_line = on_line
-
-    def connect(self, host, port):
+        self.on_lines = on_lines
+        self.recv_size = recv_size
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.framer = None
+        self.inflight = deque()          # _InFlight, oldest first
+        self.inflight_lock = threading.Lock()
+        self.rtt = RttStats()
+        self.timeouts = 0
+        self.connects = 0
+        self.last_rx = None              # time.monotonic() bytes last arrived
+        self.waiting_since = None        # first reply-expecting send since then (idle-read deadline)
+        self.settings = {}               # last strobe / lamp command, replayed after a reconnect
+        self.capture = None              # TrafficCapture recording this link, if any
+
+    def connect(self, host, port, timeout=3):
         self.close()
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(3)
-        s.connect((host, port))
-        s.settimeout(None)  # blocking recv
+        s.settimeout(timeout)
         try:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            s.connect((host, port))
         except Exception:
-            pass
-        self.sock = s
+            s.close()
+            raise
+        s.settimeout(None)  # blocking recv
+        tune_keepalive(s)
+        self.attach(s)
+
+    def attach(self, sock):
+        """Start receiving on an already-connected socket."""
+        self.waiting_since = None
+        self.sock = sock
         self.alive = True
-        self.rx_thread = threading.Thread(target=self._rx_loop, daemon=True)
+        self.connects += 1
+        self.tx_queue = queue.Queue(self.queue_size)
+        self.rx_thread = threading.Thread(target=self._rx_loop, args=(sock,), daemon=True)
         self.rx_thread.start()
+        self.tx_thread = threading.Thread(target=self._tx_loop, args=(self.tx_queue,), daemon=True)
+        self.tx_thread.start()
+
+    def _deliver(self, lines):
+        try:
+            if self.on_lines:
+                self.on_lines(lines)
+            else:
+                for line in lines:
+                    self.on_line(line)
+        except Exception:
+            pass
 
-    def _rx_loop(self):
-        buf = b""
+    def _rx_loop(self, sock):
+        # each link's thread only tears down shared state while it is still the current link;
+        # after a reconnect the old thread just closes its own socket
+        framer = self.framer = LineFramer(self.recv_size)
+        mine = lambda: self.sock is sock or self.sock is None
         try:
-            while self.alive:
-                data = self.sock.recv(1024)
-                if not data:
+            while self.alive and self.sock is sock:
+                if not framer.recv_into(sock):
                     break
-                buf += data
-                while b"\n" in buf:
-                    line, buf = buf.split(b"\n", 1)
-                    try:
-                        self.on_line(line.decode(errors="ignore").strip())
-                    except Exception:
-                        pass
+                lines = framer.pop_lines()
+                if lines:
+                    self._received(lines)
         except Exception as e:
-            self.on_line(f"[RX ERROR] {e}")
+            if mine():
+                self._disconnected(f"[RX ERROR] {e}")
         finally:
-            self.alive = False
-            try: self.sock.close()
+            try: sock.close()
             except: pass
-            self.sock = None
-            self.on_line("[Disconnected]")
-
-    def send_line(self, text: str):
+            if mine():
+                self.alive = False
+                self.sock = None
+                self._fail_inflight(ConnectionError("Disconnected"))
+                self._disconnected("[Disconnected]")
+
+    def _disconnected(self, note):
+        if self.capture:
+            self.capture.mark(CAP_NOTE, note)
+        self._deliver([note])
+
+    def _received(self, lines, now=None):
+        now = time.monotonic() if now is None else now
+        if self.capture:
+            self.capture.received(lines, now)
+        self.last_rx = now
+        self.waiting_since = None
+        if self.inflight:
+            for line in lines:
+                self._match_reply(line, now)
+        self._deliver(lines)
+
+    def send_line(self, text: str, timeout=None):
         """
         Send EXACT text as typed. We do NOT strip or uppercase it.
         We only ensure a single trailing newline if one isn't present.
+
+        The line is queued for the writer thread. Returns a Future that
+        resolves to the Nano's reply line (None for commands it doesn't answer),
+        or fails with TimeoutError / ConnectionError. Sent futures carry
+        `sent_at`, answered ones also `replied_at` (time.monotonic()).
         """
         if not self.sock:
             raise RuntimeError("Not connected")
@@ -94,10 +2237,122 @@ class TcpClient:
             data = text.encode()
         else:
             data = (text + "\n").encode()
-        self.sock.sendall(data)
+        self._remember(text)
+        future = Future()
+        try:
+            self.tx_queue.put_nowait((text, data, future, timeout or self.timeout))
+        except queue.Full:
+            raise RuntimeError(f"Send queue full ({self.queue_size} commands waiting)")
+        return future
+
+    def _remember(self, text):
+        """Keep the latest strobe / lamp command so a reconnect can put the light back."""
+        kind, replies = classify_command(text)
+        if kind == "STROBE_INTENSITY" and replies:
+            self.settings["STROBE"] = text
+        elif kind in ("LAMP_INTENSITY", "LAMP OFF") and replies:
+            self.settings["LAMP"] = text
+
+    def _tx_loop(self, q):
+        while True:
+            try:
+                item = q.get(timeout=0.05)
+            except queue.Empty:
+                item = False
+            self._expire_inflight()
+            if item is None:
+                break
+            if item is False:
+                if not self.alive:
+                    break
+                continue
+
+            text, data, future, timeout = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            kind, replies = classify_command(text)
+            sock = self.sock
+            if sock is None:
+                future.set_exception(ConnectionError("Not connected"))
+                continue
+            entry = None
+            now = future.sent_at = time.monotonic()
+            if replies:
+                # registered before sending so a fast reply can't beat us to it
+                entry = _InFlight(text, kind, replies, now, timeout, future)
+                with self.inflight_lock:
+                    self.inflight.append(entry)
+            if self.capture:
+                # recorded before sending, so the reply can't come first in the capture either
+                self.capture.sent(text, now)
+            try:
+                sock.sendall(data)
+            except Exception as e:
+                if entry is None or self._take(entry):
+                    future.set_exception(e)
+                continue
+            if entry is None:
+                future.set_result(None)
+            elif self.waiting_since is None:
+                self.waiting_since = entry.sent
+
+        # anything still queued will never be sent
+        while True:
+            try:
+                item = q.get_nowait()
+            except queue.Empty:
+                break
+            if item and item[2].set_running_or_notify_cancel():
+                item[2].set_exception(ConnectionError("Disconnected"))
+
+    def _take(self, entry):
+        """Remove an in-flight entry; True if we got it (and so must resolve it)."""
+        with self.inflight_lock:
+            try:
+                self.inflight.remove(entry)
+            except ValueError:
+                return False
+        return True
+
+    def _match_reply(self, line, now=None):
+        """Resolve the oldest in-flight command this line is a reply to."""
+        with self.inflight_lock:
+            for i, entry in enumerate(self.inflight):
+                if line.startswith(entry.replies):
+                    del self.inflight[i]
+                    break
+            else:
+                return
+        now = time.monotonic() if now is None else now
+        self.rtt.add(entry.kind, now - entry.sent)
+        entry.future.sent_at = entry.sent
+        entry.future.replied_at = now
+        entry.future.set_result(line)
+
+    def _expire_inflight(self, now=None):
+        if not self.inflight:
+            return
+        now = time.monotonic() if now is None else now
+        with self.inflight_lock:
+            expired = [e for e in self.inflight if e.deadline <= now]
+            for e in expired:
+                self.inflight.remove(e)
+        for e in expired:
+            self.timeouts += 1
+            e.future.set_exception(TimeoutError(f"No reply to {e.text!r} within {e.deadline - e.sent:.1f} s"))
+
+    def _fail_inflight(self, exc):
+        with self.inflight_lock:
+            pending = list(self.inflight)
+            self.inflight.clear()
+        for e in pending:
+            e.future.set_exception(exc)
 
     def close(self):
         self.alive = False
+        if self.tx_queue is not None:
+            try: self.tx_queue.put_nowait(None)
+            except queue.Full: pass
         if self.sock:
             try: self.sock.shutdown(socket.SHUT_RDWR)
             except: pass
@@ -106,435 +2361,1709 @@ class TcpClient:
         self.sock = None
 
 
-class App(tk.Tk):
-    def __init__(self):
-        super().__init__()
-        self.title("Strobe / Lamp Controller (TCP) Aquorea Mk3")
-        self.geometry("940x650")
-
-        root = ttk.Frame(self, padding=10)
-        root.pack(fill="both", expand=True)
-
-        # Header
-        header = ttk.Frame(root)
-        header.pack(fill="x", pady=(0,8))
-        self.logo_img = None
-        try:
-            logo_path = resource_path("cris_logo.png")
-            self.logo_img = tk.PhotoImage(file=logo_path)
-            self.logo_img = self.logo_img.subsample(6, 6)
-            ttk.Label(header, image=self.logo_img).pack(side="left")
-        except Exception:
-            ttk.Label(header, text="CRIS", font=("Segoe UI", 16, "bold")).pack(side="left")
-        ttk.Label(header, text="Strobe & Lamp Controller", font=("Segoe UI", 14)).pack(side="left", padx=10)
-        ttk.Button(header, text="Open Manual (PDF)", command=self.open_manual).pack(side="right")
-
-        # Connection row
-        row = ttk.Frame(root); row.pack(fill="x", pady=4)
-        ttk.Label(row, text="IP:").pack(side="left")
-        self.ip_var = tk.StringVar(value=DEFAULT_HOST)
-        ttk.Entry(row, textvariable=self.ip_var, width=18).pack(side="left", padx=5)
-        ttk.Label(row, text="Port:").pack(side="left")
-        self.port_var = tk.StringVar(value=str(DEFAULT_PORT))
-        ttk.Entry(row, textvariable=self.port_var, width=8).pack(side="left", padx=5)
-        ttk.Button(row, text="Connect", command=self.on_connect).pack(side="left", padx=6)
-        ttk.Button(row, text="Disconnect", command=self.on_disconnect).pack(side="left")
-
-        # Image folder picker
-        img_row = ttk.Frame(root); img_row.pack(fill="x", pady=4)
-        ttk.Label(img_row, text="Image folder:").pack(side="left")
-        self.image_dir_var = tk.StringVar(value=DEFAULT_IMAGE_DIR)
-        ttk.Entry(img_row, textvariable=self.image_dir_var, width=60).pack(side="left", padx=5)
-        ttk.Button(img_row, text="Browse…", command=self.browse_image_dir).pack(side="left")
-
-        # Sliders
-        sliders = ttk.LabelFrame(root, text="Intensities")
-        sliders.pack(fill="x", pady=10)
-
-        srow = ttk.Frame(sliders); srow.pack(fill="x", pady=6)
-        ttk.Label(srow, text="Strobe intensity").pack(side="left")
-        self.strobe_scale = ttk.Scale(srow, from_=0, to=100, orient="horizontal",
-                                      command=lambda v: self._update_val(self.lbl_strobe, v))
-        self.strobe_scale.pack(side="left", fill="x", expand=True, padx=10)
-        self.lbl_strobe = ttk.Label(srow, width=4, anchor="e", text="0"); self.lbl_strobe.pack(side="left")
-        self.strobe_scale.bind("<ButtonRelease-1>", lambda e: self.send_cmd(f"STROBE_INTENSITY {int(float(self.strobe_scale.get()))}"))
-
-        lrow = ttk.Frame(sliders); lrow.pack(fill="x", pady=6)
-        ttk.Label(lrow, text="Lamp intensity").pack(side="left")
-        self.lamp_scale = ttk.Scale(lrow, from_=0, to=100, orient="horizontal",
-                                    command=lambda v: self._update_val(self.lbl_lamp, v))
-        self.lamp_scale.pack(side="left", fill="x", expand=True, padx=10)
-        self.lbl_lamp = ttk.Label(lrow, width=4, anchor="e", text="0"); self.lbl_lamp.pack(side="left")
-        self.lamp_scale.bind("<ButtonRelease-1>", lambda e: self.send_cmd(f"LAMP_INTENSITY {int(float(self.lamp_scale.get()))}"))
-
-        # Lamp controls + Status
-        lamp_ctrl = ttk.Frame(root); lamp_ctrl.pack(fill="x", pady=6)
-        ttk.Button(lamp_ctrl, text="Lamp OFF", command=lambda: self.send_cmd("LAMP OFF")).pack(side="left", padx=5)
-        ttk.Button(lamp_ctrl, text="Status",   command=lambda: self.send_cmd("STATUS")).pack(side="left", padx=10)
-
-        # Exposure counter controls
-        exp_ctrl = ttk.LabelFrame(root, text="Exposure Counter")
-        exp_ctrl.pack(fill="x", pady=10)
-        ttk.Button(exp_ctrl, text="Start Count", command=self.start_exposure_count).pack(side="left", padx=5)
-        ttk.Button(exp_ctrl, text="Stop Count", command=self.stop_exposure_count).pack(side="left", padx=5)
-        ttk.Label(exp_ctrl, text="Count:").pack(side="left", padx=(20,5))
-        self.exposure_var = tk.StringVar(value="0")
-        self.exposure_lbl = ttk.Label(exp_ctrl, textvariable=self.exposure_var, width=10)
-        self.exposure_lbl.pack(side="left")
-        ttk.Button(exp_ctrl, text="Open CSV", command=self.open_current_csv).pack(side="left", padx=20)
-
-        # Custom command (RAW — exact text)
-        cust = ttk.Frame(root); cust.pack(fill="x", pady=8)
-        ttk.Label(cust, text="Custom:").pack(side="left")
-        self.cmd_var = tk.StringVar(value="~COMMAND|SUBC24991")
-        e = ttk.Entry(cust, textvariable=self.cmd_var)
-        e.pack(side="left", fill="x", expand=True, padx=6)
-        e.bind("<Return>", lambda _: self.send_raw())
-        ttk.Button(cust, text="Send", command=self.send_raw).pack(side="left")
-
-        # Two text boxes: Log (left) and Received (right)
-        views = ttk.Frame(root); views.pack(fill="both", expand=True, pady=8)
-        # Left: Log
-        log_frame = ttk.LabelFrame(views, text="Log")
-        log_frame.pack(side="left", fill="both", expand=True, padx=(0,6))
-        self.log = tk.Text(log_frame, height=16, state="disabled", wrap="word")
-        self.log.pack(fill="both", expand=True)
-        log_btns = ttk.Frame(log_frame); log_btns.pack(fill="x")
-        ttk.Button(log_btns, text="Clear log", command=self.clear_log).pack(side="right", padx=4, pady=4)
-
-        # Right: Received data
-        rx_frame = ttk.LabelFrame(views, text="Received data")
-        rx_frame.pack(side="left", fill="both", expand=True, padx=(6,0))
-        self.rx = tk.Text(rx_frame, height=16, state="disabled", wrap="word")
-        self.rx.pack(fill="both", expand=True)
-        rx_btns = ttk.Frame(rx_frame); rx_btns.pack(fill="x")
-        ttk.Button(rx_btns, text="Clear received", command=self.clear_rx).pack(side="right", padx=4, pady=4)
-
-        self.client = TcpClient(self.on_line_received)
-        self.protocol("WM_DELETE_WINDOW", self.on_close)
-
-        # exposure / CSV state
-        self.polling_active = False
-        self.csv_filename = None
-        self.last_logged_count = None
-
-        # image pairing state
-        self.image_scan_running = False
-        self.seen_images = set()          # filenames seen this run
-        self.pending_exposures = []       # [(ts_datetime, count)]
-        self.pending_images = []          # [(ts_datetime, filename)]
-        self.run_start_time = None        # ignore images older than this
-
-    # ---------- Manual open ----------
-    def open_manual(self):
-        path = resource_path(MANUAL_FILENAME)
-        if not os.path.exists(path):
-            messagebox.showerror("Manual not found", f"Couldn't find:\n{path}")
+class IoLoop:
+    """One thread doing the socket I/O for many SharedTcpClients.
+
+    Reads, writes and reply timeouts for every connection are handled from a
+    single selector, so N controllers cost one thread instead of 2N. Work from
+    other threads is handed over with call_soon().
+    """
+
+    def __init__(self, tick=0.05):
+        self.tick = tick                # reply-timeout check period
+        self.sel = selectors.DefaultSelector()
+        self.wake_r, self.wake_w = socket.socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.sel.register(self.wake_r, selectors.EVENT_READ, None)
+        self.calls = deque()
+        self.woken = False
+        self.clients = set()
+        self.busy = 0.0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def call_soon(self, fn, *args):
+        """Run fn(*args) on the loop thread."""
+        self.calls.append((fn, args))
+        if not self.woken:
+            self.woken = True
+            try:
+                self.wake_w.send(b"\0")
+            except OSError:
+                pass
+
+    def close(self, timeout=2.0):
+        self.closed = True
+        self.call_soon(lambda: None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        next_expire = time.monotonic() + self.tick
+        while not self.closed:
+            events = self.sel.select(max(0.0, next_expire - time.monotonic()))
+            start = time.perf_counter()
+            for key, mask in events:
+                if key.data is None:
+                    # clear the flag before draining, so a call queued meanwhile still gets run below
+                    self.woken = False
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except OSError:
+                        pass
+                else:
+                    key.data(mask)
+            while self.calls:
+                fn, args = self.calls.popleft()
+                try:
+                    fn(*args)
+                except Exception:
+                    pass
+            now = time.monotonic()
+            if now >= next_expire:
+                for c in list(self.clients):
+                    c._expire_inflight()
+                next_expire = now + self.tick
+            self.busy += time.perf_counter() - start
+        for c in list(self.clients):
+            c._cancel_connect()
+            c._drop(c.sock, None)
+        self.sel.close()
+        self.wake_r.close()
+        self.wake_w.close()
+
+
+class SharedTcpClient(TcpClient):
+    """TcpClient whose socket is serviced by a shared IoLoop instead of its own
+    rx/tx threads. Same API: send_line() returns a Future, replies are matched
+    the same way, lines arrive through on_line / on_lines (on the loop thread).
+    """
+
+    def __init__(self, loop, on_line, on_lines=None, **kwargs):
+        super().__init__(on_line, on_lines, **kwargs)
+        self.loop = loop
+        self.out = bytearray()          # bytes the socket hasn't taken yet
+        self.writing = False            # registered for EVENT_WRITE
+        self.queued = 0                 # send_line calls not yet on the loop thread
+        self.connecting = None          # (sock, future, deadline) while connect_async is under way
+        self.connect_future = None
+
+    def connect_async(self, host, port, timeout=CONNECT_TIMEOUT_SEC):
+        """Connect without blocking anyone: the loop thread starts a non-blocking
+        connect and attaches the socket once it turns writable. Returns a Future
+        (None, or the error); asking again while one is under way returns it."""
+        if self.connect_future is not None and not self.connect_future.done():
+            return self.connect_future
+        future = self.connect_future = Future()
+        self.loop.call_soon(self._start_connect, host, port, timeout, future)
+        return future
+
+    def _start_connect(self, host, port, timeout, future):
+        if not future.set_running_or_notify_cancel():
             return
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(False)
         try:
-            open_file_with_default_app(path)
-        except Exception as e:
-            messagebox.showerror("Error opening manual", str(e))
-
-    # ---------- UI helpers ----------
-    def browse_image_dir(self):
-        d = filedialog.askdirectory(initialdir=self.image_dir_var.get() or os.getcwd(),
-                                    title="Select image folder (Sony SDK output)")
-        if d:
-            self.image_dir_var.set(d)
+            err = s.connect_ex((host, port))
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, getattr(errno, "WSAEWOULDBLOCK", 0)):
+                raise OSError(err, os.strerror(err))
+        except OSError as e:
+            s.close()
+            future.set_exception(e)
+            return
+        self.connecting = (s, future, time.monotonic() + timeout)
+        self.loop.sel.register(s, selectors.EVENT_WRITE, lambda mask: self._connected(s))
+        self.loop.clients.add(self)
 
-    def _update_val(self, label, v):
+    def _connected(self, s):
+        """Loop thread: the pending connect finished one way or the other."""
+        if not self.connecting or self.connecting[0] is not s:
+            return
+        s, future = self._end_connect()
+        err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            s.close()
+            future.set_exception(OSError(err, os.strerror(err)))
+            return
+        try:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        except Exception:
+            pass
+        old = self.sock
+        if old is not None:
+            self._drop(old, None)
+        self.attach(s)
+        future.set_result(None)
+
+    def _end_connect(self):
+        s, future, _ = self.connecting
+        self.connecting = None
         try:
-            label.config(text=str(int(float(v))))
-        except:
+            self.loop.sel.unregister(s)
+        except (KeyError, ValueError):
             pass
+        if self.sock is None:
+            self.loop.clients.discard(self)
+        return s, future
+
+    def _abort_connect(self, exc):
+        s, future = self._end_connect()
+        s.close()
+        future.set_exception(exc)
+
+    def _expire_inflight(self):
+        if self.connecting and time.monotonic() >= self.connecting[2]:
+            self._abort_connect(TimeoutError("Connect timed out"))
+        super()._expire_inflight()
+
+    def attach(self, sock):
+        sock.setblocking(False)
+        self.waiting_since = None
+        self.sock = sock
+        self.alive = True
+        self.connects += 1
+        self.framer = LineFramer(self.recv_size)
+        self.loop.call_soon(self._register, sock)
 
-    def append_log(self, text):
-        self.log.configure(state="normal")
-        self.log.insert("end", text + "\n")
-        self.log.see("end")
-        self.log.configure(state="disabled")
-
-    def clear_log(self):
-        self.log.configure(state="normal")
-        self.log.delete("1.0", "end")
-        self.log.configure(state="disabled")
-
-    def append_rx(self, text):
-        self.rx.configure(state="normal")
-        self.rx.insert("end", text + "\n")
-        self.rx.see("end")
-        self.rx.configure(state="disabled")
-
-    def clear_rx(self):
-        self.rx.configure(state="normal")
-        self.rx.delete("1.0", "end")
-        self.rx.configure(state="disabled")
-
-    def _extract_rx_payload(self, line: str):
-        if line.startswith("RS485: "):
-            return line[7:]
-        tag = "[RS485<-] "
-        if line.startswith(tag):
-            return line[len(tag):]
-        return None
+    def _register(self, sock):
+        if sock is not self.sock:
+            return
+        self.out.clear()
+        self.writing = False
+        self.loop.sel.register(sock, selectors.EVENT_READ, self._on_event)
+        self.loop.clients.add(self)
 
-    # ---------- Incoming TCP lines ----------
-    def on_line_received(self, line):
-        def ui():
-            self.append_log(f"<< {line}")
-            payload = self._extract_rx_payload(line)
-            if payload:
-                self.append_rx(payload)
+    def _prepare(self, text, timeout):
+        if not self.sock:
+            raise RuntimeError("Not connected")
+        data = text.encode() if text.endswith("\n") else (text + "\n").encode()
+        self._remember(text)
+        with self.inflight_lock:
+            if self.queued >= self.queue_size:
+                raise RuntimeError(f"Send queue full ({self.queue_size} commands waiting)")
+            self.queued += 1
+        return (self.sock, text, data, Future(), timeout or self.timeout)
+
+    def send_line(self, text: str, timeout=None):
+        item = self._prepare(text, timeout)
+        self.loop.call_soon(self._write, *item)
+        return item[3]
+
+    def _write(self, sock, text, data, future, timeout):
+        """Loop thread: register the reply we expect, then send (or buffer) the bytes."""
+        with self.inflight_lock:
+            self.queued -= 1
+        if not future.set_running_or_notify_cancel():
+            return
+        if sock is not self.sock:
+            future.set_exception(ConnectionError("Not connected"))
+            return
+        kind, replies = classify_command(text)
+        now = time.monotonic()
+        future.sent_at = now
+        if replies:
+            with self.inflight_lock:
+                self.inflight.append(_InFlight(text, kind, replies, now, timeout, future))
+            if self.waiting_since is None:
+                self.waiting_since = now
+        self.out += data
+        if self.capture:
+            self.capture.sent(text, now)
+        self._flush_out(sock)
+        if not replies and self.sock is sock:
+            future.set_result(None)
+
+    def _flush_out(self, sock):
+        try:
+            if self.out:
+                del self.out[:sock.send(self.out)]
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            self._drop(sock, e)
+            return
+        if bool(self.out) != self.writing:
+            self.writing = bool(self.out)
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if self.writing else 0)
+            self.loop.sel.modify(sock, events, self._on_event)
+
+    def _on_event(self, mask):
+        sock = self.sock
+        if sock is None:
+            return
+        if mask & selectors.EVENT_WRITE:
+            self._flush_out(sock)
+        if mask & selectors.EVENT_READ and self.sock is sock:
+            try:
+                n = self.framer.recv_into(sock)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                self._drop(sock, e)
+                return
+            if not n:
+                self._drop(sock, None)
+                return
+            lines = self.framer.pop_lines()
+            if lines:
+                self._received(lines)
+
+    def _drop(self, sock, exc):
+        """Loop thread: forget a dead or closed socket and fail what was waiting on it."""
+        if sock is None:
+            return
+        try:
+            self.loop.sel.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        try: sock.close()
+        except: pass
+        if self.sock is sock:
+            self.sock = None
+            self.alive = False
+        self.loop.clients.discard(self)
+        self.out.clear()
+        self._fail_inflight(ConnectionError("Disconnected"))
+        if exc is not None:
+            self._disconnected(f"[RX ERROR] {exc}")
+        self._disconnected("[Disconnected]")
 
-            # Exposure count handling
-            if line.startswith("EXPOSURE_COUNT "):
+    def close(self):
+        sock, self.sock = self.sock, None
+        self.alive = False
+        if sock:
+            self.loop.call_soon(self._drop, sock, None)
+        self.loop.call_soon(self._cancel_connect)
+
+    def _cancel_connect(self):
+        if self.connecting:
+            self._abort_connect(ConnectionError("Closed while connecting"))
+
+
+class _Link:
+    __slots__ = ("client", "host", "port", "pipeline", "log", "down_since", "connected_at",
+                 "attempt", "next_try", "busy")
+
+    def __init__(self, client, host, port, pipeline, log):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.pipeline = pipeline
+        self.log = log
+        self.down_since = None      # drop noticed; cleared once the new link answers
+        self.connected_at = None    # last successful connect while down
+        self.attempt = 0
+        self.next_try = 0.0
+        self.busy = False           # a connect attempt is running
+
+
+def backoff_delay(attempt, base=RECONNECT_BASE_SEC, cap=RECONNECT_MAX_SEC, rnd=random.random):
+    """Exponential backoff with jitter: somewhere in [d/2, d] for d = base * 2**attempt, capped."""
+    d = min(cap, base * (2 ** attempt))
+    return d * (0.5 + 0.5 * rnd())
+
+
+class ConnectionSupervisor:
+    """Keeps TcpClients connected, one thread for any number of them.
+
+    A link counts as dropped when its socket closes or when a command that
+    expects a reply has had no bytes back for IDLE_READ_SEC (kernel keepalive,
+    see tune_keepalive, covers the idle case). Reconnects back off
+    exponentially with jitter. Once connected again, the last strobe / lamp
+    commands are replayed and the pipeline resyncs its count, without sending
+    START_EXPOSURE_COUNT unless the controller itself restarted. The link is
+    only counted as recovered when the new connection actually answers.
+    """
+
+    def __init__(self, tick=0.1):
+        self.tick = tick
+        self.lock = threading.Lock()
+        self.links = {}
+        self.recoveries = []        # seconds from drop noticed to the new link answering
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def watch(self, client, host, port, pipeline=None, log=None):
+        """Start supervising an (already connected or not) client."""
+        if log is None and pipeline is not None:
+            log = pipeline.log.put
+        with self.lock:
+            self.links[client] = _Link(client, host, port, pipeline, log or (lambda s: None))
+
+    def forget(self, client):
+        """Stop supervising (call before a deliberate close)."""
+        with self.lock:
+            self.links.pop(client, None)
+
+    def close(self, timeout=2.0):
+        with self.lock:
+            self.links.clear()
+        self.stop.set()
+        self.thread.join(timeout)
+
+    def _run(self):
+        while not self.stop.wait(self.tick):
+            with self.lock:
+                links = list(self.links.values())
+            for link in links:
                 try:
-                    val = int(line.split()[1])
-                    # Only act on increases
-                    if self.last_logged_count is None or val != self.last_logged_count:
-                        self.last_logged_count = val
-                        self.exposure_var.set(str(val))
-                        exp_ts = datetime.datetime.now()
-
-                        # record as pending exposure for pairing
-                        self.pending_exposures.append((exp_ts, val))
-
-                        # If CSV exists but header not yet written (should be), ensure header
-                        if self.csv_filename and not Path(self.csv_filename).exists():
-                            with open(self.csv_filename, "w", newline="") as f:
-                                csv.writer(f).writerow(["ExposureTS","ExposureCount","ImageTS","ImageFile","Delta_ms"])
-
-                        # Try to match right away with any pending images
-                        self.try_match_pairs()
+                    self._check(link, time.monotonic())
                 except Exception as e:
-                    self.append_log(f"[CSV/Pair ERROR] {e}")
-        self.after(0, ui)
+                    link.log(f"[LINK ERROR] {e}")
 
-    # ---------- Connect / Disconnect ----------
-    def on_connect(self):
-        host = self.ip_var.get().strip()
+    def _check(self, link, now):
+        c = link.client
+        if link.busy:
+            return
+        if c.sock is not None:
+            if link.down_since is not None and link.connected_at is not None \
+                    and (c.last_rx or 0.0) >= link.connected_at:
+                took = now - link.down_since
+                link.down_since = link.connected_at = None
+                link.attempt = 0
+                self.recoveries.append(took)
+                link.log(f"[LINK] {link.host}:{link.port} answering again after {took:.2f} s")
+                if link.pipeline is not None:
+                    link.pipeline.metrics.observe("recover_seconds", took)
+            waiting = c.waiting_since
+            if waiting is not None and now - waiting > IDLE_READ_SEC:
+                link.log(f"[LINK] no reply for {now - waiting:.1f} s, dropping the connection")
+                c.close()
+            return
+        if link.down_since is None:
+            link.down_since = now
+            link.attempt = 0
+            link.next_try = now + backoff_delay(0)
+            link.log(f"[LINK] lost {link.host}:{link.port}, reconnecting")
+        elif link.connected_at is not None:
+            # reconnected but it died again before answering: back off further
+            link.connected_at = None
+            link.attempt += 1
+            link.next_try = now + backoff_delay(link.attempt)
+        if now >= link.next_try:
+            link.busy = True
+            threading.Thread(target=self._attempt, args=(link,), daemon=True).start()
+
+    def _attempt(self, link):
+        c = link.client
         try:
-            port = int(self.port_var.get())
-            self.client.connect(host, port)
-            self.append_log(f"[Connected to {host}:{port}]")
+            c.connect(link.host, link.port, timeout=min(3.0, RECONNECT_MAX_SEC))
         except Exception as e:
-            messagebox.showerror("Connect failed", str(e))
+            link.attempt += 1
+            delay = backoff_delay(link.attempt)
+            link.next_try = time.monotonic() + delay
+            link.log(f"[LINK] reconnect {link.attempt} failed ({e}), next try in {delay:.1f} s")
+            return
+        finally:
+            link.busy = False
+        if link.client not in self.links:
+            c.close()               # forgotten (user disconnected) while we were connecting
+            return
+        link.connected_at = time.monotonic()
+        link.log(f"[LINK] connected to {link.host}:{link.port}, restoring state")
+        for text in list(c.settings.values()):
+            try:
+                c.send_line(text)
+                link.log(f"[LINK] replayed {text}")
+            except Exception as e:
+                link.log(f"[LINK] replay of {text} failed: {e}")
+        pipeline = link.pipeline
+        if pipeline is not None and pipeline.polling:
+            pipeline.resync()
+        else:
+            try:
+                c.send_line("GET_EXPOSURE_COUNT")       # something to answer, to prove the link
+            except Exception:
+                pass
 
-    def on_disconnect(self):
-        self.client.close()
-        self.append_log("[Disconnected]")
 
-    # ---------- Sending ----------
-    def send_cmd(self, s):
-        try:
-            self.client.send_line(s)
-            self.append_log(f">> {s}")
-        except Exception as e:
-            messagebox.showwarning("Send failed", str(e))
+class PipelineWorker:
+    """The thread ExposurePipeline work runs on.
+
+    Each pipeline gets its own by default; a SessionManager shares one between
+    all its units. Polls due within POLL_BATCH_SEC of each other go out on the
+    same wake-up, so N units cost about one wake-up per poll period, not N.
+    """
 
-    def send_raw(self):
+    def __init__(self):
+        self.inbox = queue.Queue()
+        self.pipelines = ()             # replaced, never mutated, so _run can iterate it unlocked
+        self.lock = threading.Lock()
+        self.busy = 0.0                 # seconds spent working on the worker thread
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def add(self, pipeline):
+        with self.lock:
+            self.pipelines = self.pipelines + (pipeline,)
+
+    def remove(self, pipeline):
+        with self.lock:
+            self.pipelines = tuple(p for p in self.pipelines if p is not pipeline)
+
+    def close(self, timeout=2.0):
+        self.inbox.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            timeout = 0.1
+            now = time.monotonic()
+            for p in self.pipelines:
+                if p.polling and p.next_poll is not None:
+                    timeout = min(timeout, p.next_poll - now)
+            try:
+                item = self.inbox.get(timeout=max(0.0, timeout))
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            start = time.perf_counter()
+            if item:
+                p, fn, args, future = item
+                try:
+                    future.set_result(fn(*args))
+                except Exception as e:
+                    future.set_exception(e)
+                    p.log.put(f"[PIPELINE ERROR] {e}")
+            now = time.monotonic()
+            for p in self.pipelines:
+                try:
+                    p._timers(now)
+                except Exception as e:
+                    p.log.put(f"[PIPELINE ERROR] {e}")
+            self.busy += time.perf_counter() - start
+        for p in self.pipelines:
+            p._shutdown()
+
+
+class ExposurePipeline:
+    """Backend for exposure runs, usable with or without Tk.
+
+    Count polling, timeline interpolation, pairing and CSV writing all run on
+    one worker thread; the folder watcher has a thread of its own. TCP lines,
+    count replies and new images come in as calls queued on `inbox`. What the
+    user sees goes out through bounded LineQueues (`log`, `rx`) and plain
+    attributes (`count`, `stats()`), so however busy the backend is, a front
+    end draining them does a bounded amount of work per frame.
+
+    With a TrafficCapture, the client's traffic, the images found and the run
+    starts / stops are recorded for TrafficReplay; it is closed with the pipeline.
+    With a SessionStore, every exposure, image and pair also goes there, under
+    `unit`; whoever made the store closes it.
+    """
+
+    def __init__(self, client, log=None, rx=None, poll_ms=EXPOSURE_POLL_MS, metrics=None,
+                 worker=None, watch_hub=None, image_timestamps=IMAGE_TIMESTAMPS, exif=None, capture=None,
+                 store=None, unit=""):
+        self.client = client
+        self.store = store
+        self.unit = unit
+        self.run_id = None              # this run's SessionStore handle
+        self.capture = capture
+        if capture is not None:
+            client.capture = capture
+        self.log = log if log is not None else LineQueue(LOG_MAX_LINES)
+        self.rx = rx if rx is not None else LineQueue(RX_MAX_LINES)
+        self.metrics = metrics if metrics is not None else pipeline_metrics()
+        self.metrics.add_collector(self._collect_metrics)
+        self.poll_ms = poll_ms
+        self.count = 0
+        self.raw_count = 0              # last value the controller reported
+        self.count_offset = 0           # added to raw counts after a controller restart
+        self.exposures = 0
+        self.images = 0
+        self.pairs = 0
+        self.timeline = ExposureTimeline()
+        self.pairer = PairingEngine()
+        self.own_exif = image_timestamps == "exif" and exif is None
+        self.exif = ExifReader() if self.own_exif else exif if image_timestamps == "exif" else None
+        self.camera_clock = CameraClock()
+        self.expired_before = (0, 0)    # expiries from earlier runs (pairer.clear() resets its own)
+        self.session = None
+        self.watcher = None
+        self.run_start_time = None
+        self.polling = False
+        self.poll_future = None
+        self.next_poll = None
+        self.first_poll_at = None       # time.monotonic() of the first GET_EXPOSURE_COUNT
+        self.closed = False
+        self.watch_hub = watch_hub
+        self.own_worker = worker is None
+        self.worker = worker if worker is not None else PipelineWorker()
+        self.inbox = self.worker.inbox
+        self.worker.add(self)
+
+    # ---------- API (any thread) ----------
+    def call(self, fn, *args):
+        """Run fn(*args) on the worker thread; returns a Future for the result."""
+        future = Future()
+        self.inbox.put((self, fn, args, future))
+        return future
+
+    def on_lines(self, lines):
+        self.call(self._handle_lines, lines)
+
+    def start_run(self, csv_path, folder, at=None):
+        """Start logging to csv_path, watching folder for images (None = images
+        come from elsewhere, i.e. a replay). `at` backdates the run start to
+        that time.monotonic() value."""
+        return self.call(self._start_run, csv_path, folder, at)
+
+    def stop_run(self):
+        return self.call(self._stop_run)
+
+    def resync(self):
+        """After a reconnect: poll the count now, carrying on from where it was."""
+        return self.call(self._resync)
+
+    def flush(self):
+        """Flush the CSV; the Future resolves to the current file path (or None)."""
+        return self.call(self._flush)
+
+    def close(self, timeout=2.0):
+        if self.closed:
+            return
+        self.closed = True
+        if self.own_exif:
+            self.exif.close()
+        if self.own_worker:
+            self.worker.close(timeout)
+        else:
+            try:
+                self.call(self._shutdown).result(timeout)
+            except Exception:
+                pass
+            self.worker.remove(self)
+        if self.capture is not None:
+            self.capture.close()
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "exposures": self.exposures,
+            "images": self.images,
+            "pairs": self.pairs,
+            "backlog": self.inbox.qsize(),
+            "pending_exposures": len(self.pairer.exposures),
+            "pending_images": len(self.pairer.images),
+            "busy_sec": self.worker.busy,
+        }
+
+    def _collect_metrics(self, m):
+        """Refresh the metrics that are cheaper to read than to track (runs on export)."""
+        m.counters["expired_exposures_total"] = self.expired_before[0] + self.pairer.expired_exposures
+        m.counters["expired_images_total"] = self.expired_before[1] + self.pairer.expired_images
+        m.counters["reconnects_total"] = max(0, self.client.connects - 1)
+        m.counters["command_timeouts_total"] = self.client.timeouts
+        m.set("pending_exposures", len(self.pairer.exposures))
+        m.set("pending_images", len(self.pairer.images))
+        m.set("backend_queue", self.inbox.qsize())
+        m.set("log_dropped", self.log.dropped + self.rx.dropped)
+        if self.exif is not None:
+            m.set("exif_read_ms", self.exif.stats()["read_ms"])
+        if self.store is not None:
+            m.set("db_pending_rows", self.store.pending_rows)
+
+    # ---------- worker thread ----------
+    def _timers(self, now):
+        if self.polling and now + POLL_BATCH_SEC >= self.next_poll:
+            self._poll()
+        if self.session:
+            self.session.tick()
+
+    def _shutdown(self):
+        self._stop_watch()
+        self._close_session()
+
+    def _send(self, text):
+        """Send a command, log it like the GUI does and log any failure."""
         try:
-            text = self.cmd_var.get()
-            self.client.send_line(text)
-            self.append_log(f">> {text}")
+            future = self.client.send_line(text)
         except Exception as e:
-            messagebox.showwarning("Send failed", str(e))
+            self.log.put(f"[SEND ERROR] {text}: {e}")
+            return None
+        self.log.put(f">> {text}")
+        future.add_done_callback(lambda f: self._cmd_done(text, f))
+        return future
+
+    def _cmd_done(self, text, future):
+        exc = future.exception()
+        if isinstance(exc, TimeoutError):
+            self.log.put(f"[TIMEOUT] {exc}")
+        elif exc is not None:
+            self.log.put(f"[SEND ERROR] {text}: {exc}")
+
+    # ---------- TCP lines ----------
+    def _handle_lines(self, lines):
+        for line in lines:
+            self.log.put(f"<< {line}")
+            payload = extract_rx_payload(line)
+            if payload:
+                self.rx.put(payload)
 
-    # ---------- Exposure controls ----------
-    def start_exposure_count(self):
-        # Prepare CSV (new file each run)
-        ts = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        self.csv_filename = f"exposure_log_{ts}.csv"
+    # ---------- Exposure run ----------
+    def _start_run(self, csv_path, folder, at=None):
+        self._close_session()
         try:
-            with open(self.csv_filename, "w", newline="") as f:
-                csv.writer(f).writerow(["ExposureTS","ExposureCount","ImageTS","ImageFile","Delta_ms"])
-            self.append_log(f"[CSV] Logging exposures to {self.csv_filename}")
+            self.session = SessionWriter(csv_path)
+            self.log.put(f"[CSV] Logging exposures to {csv_path}")
         except Exception as e:
-            self.append_log(f"[CSV ERROR] {e}")
+            self.log.put(f"[CSV ERROR] {e}")
 
         # Reset pairing state
-        self.pending_exposures.clear()
-        self.pending_images.clear()
-        self.seen_images.clear()
-        self.run_start_time = datetime.datetime.now()
-
-        # Snapshot existing files so we only pick up new ones
-        self.snapshot_existing_images()
-
-        # Start polling exposure count + image folder scan
-        self.polling_active = True
-        self.last_logged_count = None
-        self.send_cmd("START_EXPOSURE_COUNT")
-        self.poll_exposure_count()
-        if not self.image_scan_running:
-            self.image_scan_running = True
-            self.after(300, self.scan_image_folder)
-
-    def stop_exposure_count(self):
-        self.send_cmd("STOP_EXPOSURE_COUNT")
-        self.polling_active = False
-        self.append_log("[CSV] Exposure logging stopped")
-
-    def poll_exposure_count(self):
-        if not self.polling_active:
+        self.expired_before = (self.expired_before[0] + self.pairer.expired_exposures,
+                               self.expired_before[1] + self.pairer.expired_images)
+        self.pairer.clear()
+        self.pairer.tolerance = MATCH_TOLERANCE_SEC
+        self.camera_clock.reset()
+        if at is None:
+            self.run_start_time = datetime.datetime.now()
+        else:
+            self.run_start_time = datetime.datetime.fromtimestamp(self.timeline.to_wall(at))
+        if self.store:
+            self.run_id = self.store.begin_run(self.unit, str(csv_path), None if folder is None else str(folder),
+                                               self.run_start_time.timestamp())
+
+        # Snapshot existing files so we only pick up new ones, then watch for more
+        if folder is not None:
+            self._start_image_watch(folder)
+        else:
+            self._stop_watch()
+
+        # Start polling exposure count
+        self.raw_count = 0
+        self.count_offset = 0
+        started = time.monotonic() if at is None else at
+        if self.capture:
+            self.capture.mark(CAP_RUN, "" if folder is None else str(folder), started)
+        self.timeline.reset(started)
+        future = self._send("START_EXPOSURE_COUNT")
+        if future:
+            future.add_done_callback(self._on_count_reply)
+        self.polling = True
+        self.poll_future = None
+        self.next_poll = time.monotonic()
+
+    def _stop_run(self):
+        if self.capture:
+            self.capture.mark(CAP_STOP)
+        self._send("STOP_EXPOSURE_COUNT")
+        self.polling = False
+        if self.store and self.run_id is not None:
+            self.store.end_run(self.run_id, time.time())
+        if self.session:
+            try:
+                self.session.flush(fsync=True)
+                self.log.put(f"[CSV] {self.session.stats()}")
+            except Exception as e:
+                self.log.put(f"[CSV ERROR] {e}")
+        self.log.put("[CSV] Exposure logging stopped")
+
+    def _flush(self):
+        if not self.session:
+            return None
+        self.session.flush()
+        return str(self.session.path)
+
+    def _close_session(self):
+        if not self.session:
             return
         try:
-            self.client.send_line("GET_EXPOSURE_COUNT")
+            self.session.close()
+        except Exception as e:
+            self.log.put(f"[CSV ERROR] {e}")
+        self.session = None
+
+    def _resync(self):
+        if self.polling:
+            self.log.put(f"[RESYNC] polling the count again (last {self.count})")
+            self.poll_future = None
+            self.next_poll = time.monotonic()
+
+    def _poll(self):
+        # don't stack polls behind a slow reply
+        if self.poll_future is None or self.poll_future.done():
+            try:
+                self.poll_future = self.client.send_line("GET_EXPOSURE_COUNT")
+            except Exception:
+                # link down: the run carries on and resync() restarts polling once it is back
+                self.poll_future = None
+                self.next_poll = time.monotonic() + self.poll_ms / 1000.0
+                return
+            if self.first_poll_at is None:
+                self.first_poll_at = time.monotonic()
+            self.poll_future.add_done_callback(self._on_count_reply)
+        dither = random.uniform(-EXPOSURE_POLL_DITHER, EXPOSURE_POLL_DITHER)
+        self.next_poll = time.monotonic() + self.poll_ms * (1.0 + dither) / 1000.0
+
+    def _on_count_reply(self, future):
+        """RX thread: hand a timed START/GET_EXPOSURE_COUNT reply to the worker."""
+        try:
+            line = future.result()
+            val = int(line.split()[1]) if line.startswith("EXPOSURE_COUNT ") else 0
         except Exception:
             return
-        self.after(500, self.poll_exposure_count)
+        self.call(self._handle_count, future.sent_at, future.replied_at, val)
+
+    def _handle_count(self, sent, replied, val):
+        """Turn a counter sample into one timestamped pending exposure per frame."""
+        if val < self.raw_count:
+            # the controller restarted (its counter is back at 0 and stopped): keep our
+            # numbering continuous and start it counting again
+            self.count_offset += self.raw_count
+            self.log.put(f"[RESYNC] controller count went {self.raw_count} -> {val}; "
+                         f"restarting it, numbering continues from {self.count_offset}")
+            future = self._send("START_EXPOSURE_COUNT")
+            if future:
+                future.add_done_callback(self._on_count_reply)
+        self.raw_count = val
+        self.count = val + self.count_offset
+        self.metrics.observe("poll_rtt_seconds", replied - sent)
+        pairs, stored = [], []
+        for n, t, err in self.timeline.observe(sent, replied, val):
+            n += self.count_offset
+            self.exposures += 1
+            self.metrics.inc("exposures_total")
+            exp_ts = datetime.datetime.fromtimestamp(self.timeline.to_wall(t))
+            if self.exif is not None:
+                self.camera_clock.add_exposure(n, exp_ts.timestamp())
+            if self.store:
+                stored.append((self.run_id, n, exp_ts.timestamp(), err * 1000.0))
+            pair = self.pairer.add_exposure(exp_ts.timestamp(), (exp_ts, n, err))
+            if pair:
+                pairs.append(pair)
+        if stored:
+            self.store.add_exposures(stored)
+        self._check_camera_clock()
+        self._write_pairs(pairs)
 
     # ---------- Image monitoring & pairing ----------
-    def snapshot_existing_images(self):
-        folder = Path(self.image_dir_var.get())
+    def _start_image_watch(self, folder):
+        folder = Path(folder)
+        if not folder.exists():
+            self.log.put(f"[IMG] Folder not found: {folder}")
         try:
-            if not folder.exists():
-                self.append_log(f"[IMG] Folder not found: {folder}")
-                return
-            for p in folder.iterdir():
-                if p.is_file() and IMAGE_PATTERN.match(p.name):
-                    self.seen_images.add(p.name)
+            watcher = make_folder_watcher(folder)
+            watcher.snapshot()
         except Exception as e:
-            self.append_log(f"[IMG SNAPSHOT ERROR] {e}")
+            self.log.put(f"[IMG SNAPSHOT ERROR] {e}")
+            watcher = ScandirWatcher(folder)
+        self.log.put(f"[IMG] Watching {folder} ({watcher.name})")
+
+        self._stop_watch()
+        self.watcher = watcher
+        if self.watch_hub:
+            self.watch_hub.add(watcher, self._on_found,
+                               lambda e: self.log.put(f"[IMG SCAN ERROR] {e}"))
+        else:
+            threading.Thread(target=self._image_watch_loop, args=(watcher,), daemon=True).start()
+
+    def _stop_watch(self):
+        """Let go of the current watcher; whoever runs it closes it."""
+        watcher, self.watcher = self.watcher, None
+        if watcher and self.watch_hub:
+            self.watch_hub.remove(watcher)
 
-    def scan_image_folder(self):
-        """Poll the folder for new DSC* files; enqueue with mtime; try matching."""
-        folder = Path(self.image_dir_var.get())
-        if not self.image_scan_running:
+    def _image_watch_loop(self, watcher):
+        """Watcher thread: wait for folder changes, hand new files to the worker.
+        Exits (and closes the watcher) once a newer run has replaced it."""
+        try:
+            while not self.closed and self.watcher is watcher:
+                watcher.wait(IMAGE_SCAN_INTERVAL_SEC)
+                try:
+                    start = time.perf_counter()
+                    found = watcher.poll()
+                except Exception as e:
+                    self.log.put(f"[IMG SCAN ERROR] {e}")
+                    time.sleep(IMAGE_SCAN_INTERVAL_SEC)
+                    continue
+                self._on_found(found, time.perf_counter() - start)
+        finally:
+            watcher.close()
+
+    def _on_found(self, found, seconds):
+        """Watcher thread (or WatchHub): record the scan and queue any new files."""
+        self.metrics.observe("scan_seconds", seconds)
+        if not found:
+            return
+        watcher = self.watcher
+        if self.exif is not None and watcher is not None:
+            try:
+                self.exif.submit(watcher.folder, found, lambda found: self.call(self._handle_images, found))
+                return
+            except RuntimeError:
+                pass                    # reader shut down: fall back to mtimes
+        self.call(self._handle_images, found)
+
+    def _handle_images(self, found):
+        """Enqueue newly seen DSC* files and try matching. Entries are (name, mtime)
+        from the watcher, or (name, mtime, capture time) via the ExifReader."""
+        if self.capture:
+            self.capture.images(found)
+        pairs = []
+        # Only consider files newer than run start (avoid old backlog)
+        since = self.run_start_time.timestamp() - 1.0 if self.run_start_time else None
+        images = []
+        for name, mtime, *capture in found:
+            if since is not None and mtime < since:
+                continue
+            capture = capture[0] if capture else None
+            t = mtime if capture is None else self.camera_clock.to_exposure_time(capture, mtime)
+            images.append((t, name, capture))
+        images.sort(key=lambda x: x[0])
+        if self.store and images:
+            self.store.add_images([(self.run_id, name, t, capture) for t, name, capture in images])
+        for t, name, capture in images:
+            its = datetime.datetime.fromtimestamp(t)
+            self.images += 1
+            self.metrics.inc("images_total")
+            self.log.put(f"[IMG] New file: {name} @ {its.strftime('%H:%M:%S.%f')[:-3]}")
+            pair = self.pairer.add_image(t, (its, name))
+            if pair:
+                pairs.append(pair)
+        self._check_camera_clock()
+        self._write_pairs(pairs)
+
+    def _check_camera_clock(self):
+        """Tighten pairing once capture times are on the exposure timeline."""
+        clock = self.camera_clock
+        if clock.calibrated and self.pairer.tolerance != clock.tolerance:
+            if self.pairer.tolerance == MATCH_TOLERANCE_SEC:
+                self.log.put(f"[EXIF] Camera clock is {-clock.offset:+.3f} s off the exposure times; "
+                             f"pairing within {clock.tolerance * 1000:.0f} ms")
+            self.pairer.tolerance = clock.tolerance
+
+    def _write_pairs(self, pairs):
+        """Append matched ((exp_ts, count, err), (img_ts, filename)) pairs to the CSV
+        (and the store) and log them."""
+        if not pairs or not (self.session or self.store):
             return
+        rows, stored = [], []
+        for (ets, ecount, err), (its, fname) in pairs:
+            delta_ms = int(round((its - ets).total_seconds() * 1000.0))
+            self.metrics.observe("delta_ms", delta_ms)
+            if self.store:
+                stored.append((self.run_id, ecount, fname, ets.timestamp(), its.timestamp(), delta_ms, err * 1000.0))
+            rows.append([
+                ets.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+                ecount,
+                its.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
+                fname,
+                delta_ms,
+                int(round(err * 1000.0))
+            ])
+            self.log.put(f"[PAIR] Exposure #{ecount} @ {ets.strftime('%H:%M:%S.%f')[:-3]}  <->  {fname} @ {its.strftime('%H:%M:%S.%f')[:-3]}  (Δ {delta_ms} ms)")
+        self.pairs += len(rows)
+        self.metrics.inc("pairs_total", len(rows))
+        if self.session:
+            self.session.write_rows(rows)
+        if stored:
+            self.store.add_pairs(stored)
+
+
+# ---------- Replay ----------
+class ReplayClient(TcpClient):
+    """TcpClient stand-in for TrafficReplay. Recorded lines arrive through
+    on_line / on_lines as if read from the socket, and recorded commands go in
+    flight the same way, so replies are matched and count polls timed as they
+    were live. Nothing goes on a wire: send_line() futures resolve to None."""
+
+    def __init__(self, on_line, on_lines=None, **kwargs):
+        super().__init__(on_line, on_lines, **kwargs)
+        self.connects = 1
+
+    def connect(self, host, port, timeout=3):
+        raise RuntimeError("Replaying a capture, not connected")
+
+    def send_line(self, text: str, timeout=None):
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def replay_sent(self, text, t):
+        """A command recorded at t; returns the Future its recorded reply resolves (None if it expects none)."""
+        kind, replies = classify_command(text)
+        if not replies:
+            return None
+        future = Future()
+        with self.inflight_lock:
+            self.inflight.append(_InFlight(text, kind, replies, t, self.timeout, future))
+        return future
+
+
+class TrafficReplay:
+    """Feeds a capture back through an ExposurePipeline whose client is a
+    ReplayClient: recorded lines go to the client, images straight to the
+    pairing, and each recorded run is started / stopped where it was, logging
+    to <csv_dir>/<capture>_runN.csv.
+
+    speed 1 replays in real time, 10 ten times faster, 0 as fast as the
+    pipeline takes it. Recorded times are moved to now but keep their spacing,
+    so timelines and pairing see the same gaps at any speed.
+    """
+
+    def __init__(self, paths, pipeline, speed=1.0, csv_dir=".", stop=None):
+        self.paths = list(paths)
+        self.pipeline = pipeline
+        self.client = pipeline.client
+        self.speed = speed
+        self.csv_dir = csv_dir
+        self.stop = stop if stop is not None else threading.Event()
+        self.csv_paths = []
+        self.events = 0
+        self.span = 0.0                 # recorded seconds replayed
+        self.seconds = 0.0              # how long it took
+
+    def run(self):
+        p, client = self.pipeline, self.client
+        stem = Path(self.paths[0]).stem
+        start = time.monotonic()
+        t0 = shift = None
+        for t, kind, value, offset in read_capture(self.paths):
+            if t0 is None:
+                t0, shift = t, start - t
+            if self.speed:
+                delay = start + (t - t0) / self.speed - time.monotonic()
+                if delay > 0 and self.stop.wait(delay):
+                    break
+            if self.stop.is_set():
+                break
+            now = t + shift
+            client._expire_inflight(now)
+            if kind == CAP_TX:
+                future = client.replay_sent(value, now)
+                if future is not None and classify_command(value)[0] in ("START_EXPOSURE_COUNT",
+                                                                          "GET_EXPOSURE_COUNT"):
+                    future.add_done_callback(p._on_count_reply)
+            elif kind == CAP_RX:
+                client._received(value, now)
+            elif kind == CAP_NOTE:
+                client._deliver([value])
+            elif kind == CAP_IMAGES:
+                # recorded mtimes -> the wall clock of the shifted timeline
+                shift_wall = shift + (p.timeline.wall0 - p.timeline.mono0) - offset
+                p.call(p._handle_images, [(name, mtime + shift_wall) if capture is None
+                                          else (name, mtime + shift_wall, capture)
+                                          for name, mtime, capture in value])
+            elif kind == CAP_RUN:
+                self.csv_paths.append(os.path.join(self.csv_dir, f"{stem}_run{len(self.csv_paths) + 1}.csv"))
+                p.start_run(self.csv_paths[-1], None, now)
+            elif kind == CAP_STOP:
+                p.stop_run()
+            self.events += 1
+            self.span = t - t0
+        p.flush().result()              # everything queued so far has been handled
+        self.seconds = time.monotonic() - start
+        return self
+
+    def summary(self):
+        rate = self.span / self.seconds if self.seconds else 0.0
+        return (f"{self.events} events, {self.span:.1f} s recorded, replayed in {self.seconds:.2f} s "
+                f"({rate:.1f}x)")
+
+
+# ---------- Sequencer ----------
+def parse_sequence(text):
+    """Timed steps [(offset_sec, command)], sorted by time, from a script like
+
+        # comment
+        0      STROBE_INTENSITY 0
+        +0.5   LAMP_INTENSITY 40                    0.5 s after the previous step
+        1      ramp STROBE_INTENSITY 0 100 over 5 every 0.1
+        +1     table LAMP_INTENSITY every 0.5 10 20 40 80
+        +1     repeat 10 every 2                    the block below, 10 times, 2 s apart
+        0        STROBE_INTENSITY 100
+        0.5      STROBE_INTENSITY 0
+               end
+
+    Times are seconds from the start (of the block, inside a repeat). Raises
+    ValueError naming the line at fault."""
+    lines = []
+    for no, line in enumerate(text.splitlines(), 1):
+        tokens = line.split()
+        for k, tok in enumerate(tokens):
+            if tok.startswith("#"):
+                del tokens[k:]
+                break
+        if tokens:
+            lines.append((no, tokens))
+    steps, i = _parse_block(lines, 0, opened=None)
+    steps.sort(key=lambda step: step[0])
+    return steps
+
+
+def load_sequence(path):
+    with open(path, encoding="utf-8") as f:
+        return parse_sequence(f.read())
+
+
+def _keyword(tokens, k, word):
+    if tokens[k].lower() != word:
+        raise ValueError(f"expected '{word}', got {tokens[k]!r}")
+    return float(tokens[k + 1])
+
+
+def _parse_block(lines, i, opened):
+    """Steps of lines[i:] up to the 'end' of the repeat on line `opened` (None:
+    to the end of the script); returns (steps, index after it)."""
+    steps, last = [], 0.0
+    while i < len(lines):
+        no, tok = lines[i]
+        i += 1
+        if tok[0].lower() == "end":
+            if opened is None:
+                raise ValueError(f"line {no}: 'end' without 'repeat'")
+            return steps, i
         try:
-            if folder.exists():
-                for p in folder.iterdir():
-                    if not p.is_file():
-                        continue
-                    name = p.name
-                    if name in self.seen_images:
-                        continue
-                    if not IMAGE_PATTERN.match(name):
-                        continue
-
-                    # Only consider files newer than run start (avoid old backlog)
+            at = last + float(tok[0][1:]) if tok[0].startswith("+") else float(tok[0])
+            if at < 0:
+                raise ValueError("negative time")
+            verb = tok[1].lower() if len(tok) > 1 else ""
+            if len(tok) < 2:
+                raise ValueError("no command")
+            if verb == "repeat":
+                count, period = int(tok[2]), _keyword(tok, 3, "every")
+                if count < 1 or period <= 0:
+                    raise ValueError("repeat needs a count >= 1 and a period > 0")
+            elif verb == "ramp":
+                cmd, lo, hi = tok[2], float(tok[3]), float(tok[4])
+                over, every = _keyword(tok, 5, "over"), _keyword(tok, 7, "every")
+                if over < 0 or every <= 0:
+                    raise ValueError("ramp needs 'over' >= 0 and 'every' > 0")
+                n = int(round(over / every)) + 1
+                new = [(at + k * every, f"{cmd} {round(lo + (hi - lo) * k / max(1, n - 1))}") for k in range(n)]
+            elif verb == "table":
+                cmd, every, values = tok[2], _keyword(tok, 3, "every"), tok[5:]
+                if every <= 0 or not values:
+                    raise ValueError("table needs 'every' > 0 and at least one value")
+                new = [(at + k * every, f"{cmd} {v}") for k, v in enumerate(values)]
+            else:
+                new = [(at, " ".join(tok[1:]))]
+        except IndexError:
+            raise ValueError(f"line {no}: {' '.join(tok)}: missing value") from None
+        except ValueError as e:
+            raise ValueError(f"line {no}: {' '.join(tok)}: {e}") from None
+        if verb == "repeat":
+            body, i = _parse_block(lines, i, opened=no)
+            new = [(at + k * period + t, cmd) for k in range(count) for t, cmd in body]
+        if new:
+            steps += new
+            last = new[-1][0]
+    if opened is not None:
+        raise ValueError(f"line {opened}: 'repeat' without 'end'")
+    return steps, i
+
+
+class Sequencer:
+    """Sends timed steps [(offset_sec, command)] from a thread of its own.
+
+    Step k is due at start + offset_k on time.monotonic(), so a late step
+    never pushes the later ones back however long the sequence runs. The
+    thread sleeps until SEQUENCE_SPIN_SEC before a step and spins the rest of
+    the way. Like the Nano's handleCommand() loop it has one line in hand at
+    a time: a step first waits for the previous command's reply, and sends
+    are at least SEQUENCE_MIN_GAP_SEC apart. An intensity step whose
+    successor for the same channel is already due is skipped; only the newest
+    value matters, as with the sliders.
+
+    Every step's planned and actual send time, error, round trip and reply
+    go to `results` and the log, and to `csv_path` once the sequence ends.
+    """
+
+    def __init__(self, client, steps, log=None, csv_path=None, spin=SEQUENCE_SPIN_SEC,
+                 min_gap=SEQUENCE_MIN_GAP_SEC, lead=SEQUENCE_LEAD_SEC, on_done=None):
+        self.client = client
+        self.steps = list(steps)
+        self.log = log if log is not None else LineQueue(LOG_MAX_LINES)
+        self.csv_path = csv_path
+        self.spin = spin
+        self.min_gap = min_gap
+        self.lead = lead
+        self.on_done = on_done
+        self.results = [None] * len(self.steps)   # (planned, sent, error, rtt, result) per step
+        self.start_at = None
+        self.stopping = threading.Event()
+        self.finished = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def _sleep_until(self, t):
+        """False if stopped first."""
+        left = t - time.monotonic()
+        if left > self.spin and self.stopping.wait(left - self.spin):
+            return False
+        while time.monotonic() < t:
+            time.sleep(0)           # spin, but let the other threads have the GIL
+        return not self.stopping.is_set()
+
+    def _run(self):
+        steps, n = self.steps, len(self.steps)
+        start = self.start_at = time.monotonic() + self.lead
+        kinds = [classify_command(cmd) for _, cmd in steps]
+        self.log.put(f"[SEQ] {n} steps over {steps[-1][0] if steps else 0:.1f} s")
+        waiting = last = None
+        last_send = 0.0
+        try:
+            for i, (offset, cmd) in enumerate(steps):
+                due = start + offset
+                if waiting is not None:
                     try:
-                        mtime = datetime.datetime.fromtimestamp(p.stat().st_mtime)
+                        waiting.result(self.client.timeout + 1.0)
                     except Exception:
-                        continue
-                    if self.run_start_time and mtime < self.run_start_time - datetime.timedelta(seconds=1):
-                        # mark seen but ignore (old)
-                        self.seen_images.add(name)
-                        continue
-
-                    # New image discovered
-                    self.seen_images.add(name)
-                    self.pending_images.append((mtime, name))
-                    self.append_log(f"[IMG] New file: {name} @ {mtime.strftime('%H:%M:%S.%f')[:-3]}")
-
-                # attempt matches whenever we add images
-                self.try_match_pairs()
-
+                        pass
+                    waiting = None
+                if not self._sleep_until(max(due, last_send + self.min_gap)):
+                    break
+                kind, replies = kinds[i]
+                if (kind in ("STROBE_INTENSITY", "LAMP_INTENSITY") and i + 1 < n and kinds[i + 1][0] == kind
+                        and start + steps[i + 1][0] <= time.monotonic()):
+                    self.results[i] = (offset, None, None, None, "skipped")
+                    continue
+                try:
+                    future = self.client.send_line(cmd)
+                except Exception as e:
+                    self.results[i] = (offset, None, None, None, f"failed: {e}")
+                    self.log.put(f"[SEQ] {i + 1}/{n} {cmd}: send failed: {e}")
+                    continue
+                last_send = time.monotonic()
+                future.add_done_callback(lambda f, i=i, due=due: self._done(i, due, f))
+                last = future
+                waiting = future if replies else None
+            # the last step's outcome, so the CSV and summary are complete
+            if last is not None:
+                try:
+                    last.result(self.client.timeout + 1.0)
+                except Exception:
+                    pass
+        finally:
+            self._finish()
+
+    def _done(self, i, due, future):
+        """Writer / RX thread: record how one step went."""
+        offset, cmd = self.steps[i]
+        sent = getattr(future, "sent_at", None)
+        replied = getattr(future, "replied_at", None)
+        exc = future.exception()
+        result = (f"failed: {type(exc).__name__}: {exc}" if exc is not None else
+                  future.result() if future.result() is not None else "sent")
+        error = None if sent is None else sent - due
+        rtt = None if sent is None or replied is None else replied - sent
+        self.results[i] = (offset, None if sent is None else sent - self.start_at, error, rtt, result)
+        self.log.put(f"[SEQ] {i + 1}/{len(self.steps)} {cmd} @ {offset:.3f} s: "
+                     f"{'-' if error is None else f'{error * 1e3:+.2f}'} ms"
+                     f"{'' if rtt is None else f', rtt {rtt * 1e3:.1f} ms'} -> {result}")
+
+    def _finish(self):
+        if self.csv_path:
+            try:
+                w = SessionWriter(self.csv_path, header=SEQUENCE_CSV_HEADER, rotate_bytes=0)
+                w.write_rows([[i + 1, cmd] + self._row(r) for i, ((_, cmd), r) in enumerate(zip(self.steps, self.results))])
+                w.close()
+            except OSError as e:
+                self.log.put(f"[SEQ] CSV not written: {e}")
+        self.log.put(f"[SEQ] {'stopped' if self.stopping.is_set() else 'done'}: {self.summary()}")
+        self.finished.set()
+        if self.on_done:
+            self.on_done(self)
+
+    @staticmethod
+    def _row(r):
+        if r is None:
+            return ["", "", "", "", "not run"]
+        planned, sent, error, rtt, result = r
+        return [f"{planned:.6f}", "" if sent is None else f"{sent:.6f}",
+                "" if error is None else f"{error * 1e3:.3f}", "" if rtt is None else f"{rtt * 1e3:.3f}", result]
+
+    def errors_ms(self):
+        return [r[2] * 1e3 for r in self.results if r is not None and r[2] is not None]
+
+    def summary(self):
+        errs = sorted(abs(e) for e in self.errors_ms())
+        skipped = sum(1 for r in self.results if r is not None and r[4] == "skipped")
+        failed = sum(1 for r in self.results if r is not None and r[4].startswith("failed"))
+        text = f"{len(errs)}/{len(self.steps)} steps sent, {skipped} skipped, {failed} failed"
+        if errs:
+            text += (f"; |error| p50 {errs[len(errs) // 2]:.2f} / p99 {errs[min(len(errs) - 1, int(len(errs) * 0.99))]:.2f}"
+                     f" / max {errs[-1]:.2f} ms")
+        return text
+
+
+# ---------- Several controllers ----------
+class ControllerUnit:
+    """One controller in a SessionManager: its connection, pipeline and output files."""
+
+    def __init__(self, name, host, port, image_dir, client, pipeline):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.image_dir = image_dir
+        self.client = client
+        self.pipeline = pipeline
+        self.csv_path = None
+
+
+class SessionManager:
+    """Drives several controllers at once, each with its own image folder,
+    pairing state and CSV, on three shared threads whatever the unit count:
+    an IoLoop for the sockets, a PipelineWorker for polling / pairing / CSV
+    and a WatchHub for the image folders. With a capture_dir each unit's
+    traffic is recorded to capture_<name>_<start>.aqcap there; with a db all
+    units share one SessionStore."""
+
+    def __init__(self, poll_ms=EXPOSURE_POLL_MS, image_timestamps=IMAGE_TIMESTAMPS, capture_dir=None, db=None):
+        self.poll_ms = poll_ms
+        self.image_timestamps = image_timestamps
+        self.capture_dir = capture_dir
+        self.store = SessionStore(db) if db else None
+        self.loop = IoLoop()
+        self.worker = PipelineWorker()
+        self.hub = WatchHub()
+        self.exif = ExifReader() if image_timestamps == "exif" else None
+        self.supervisor = ConnectionSupervisor()
+        self.units = {}
+
+    def add_unit(self, name, host, port=DEFAULT_PORT, image_dir=DEFAULT_IMAGE_DIR, log=None):
+        if name in self.units:
+            raise ValueError(f"Duplicate unit name: {name}")
+        pipeline = None
+        client = SharedTcpClient(self.loop, None, on_lines=lambda lines: pipeline.on_lines(lines))
+        capture = TrafficCapture(self.capture_dir, f"capture_{name}") if self.capture_dir else None
+        pipeline = ExposurePipeline(client, log=log, poll_ms=self.poll_ms, worker=self.worker, watch_hub=self.hub,
+                                    image_timestamps=self.image_timestamps, exif=self.exif, capture=capture,
+                                    store=self.store, unit=name)
+        unit = self.units[name] = ControllerUnit(name, host, port, image_dir, client, pipeline)
+        return unit
+
+    def connect_all(self, timeout=CONNECT_TIMEOUT_SEC, supervise=True):
+        """Connect every unit that is down, all at once on the IoLoop.
+        Returns {name: Future} (None once connected, or the error) without waiting.
+        With `supervise`, each unit is kept connected once its first try is over;
+        units the supervisor already watches are left to it."""
+        futures = {}
+        for name, unit in self.units.items():
+            if unit.client.sock is not None or unit.client in self.supervisor.links:
+                continue
+            futures[name] = f = unit.client.connect_async(unit.host, unit.port, timeout)
+            if supervise:
+                f.add_done_callback(lambda _, u=unit: self._supervise(u))
+        if supervise:
+            for unit in self.units.values():
+                if unit.client.sock is not None:
+                    self._supervise(unit)
+        return futures
+
+    def _supervise(self, unit):
+        if unit.client not in self.supervisor.links:
+            self.supervisor.watch(unit.client, unit.host, unit.port, unit.pipeline)
+
+    def start_all(self, csv_dir="."):
+        """START_EXPOSURE_COUNT on every connected unit, each logging to its own CSV."""
+        ts = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        futures = {}
+        for unit in self.units.values():
+            if unit.client.sock is None:
+                continue
+            unit.csv_path = os.path.join(csv_dir, f"exposure_log_{unit.name}_{ts}.csv")
+            futures[unit.name] = unit.pipeline.start_run(unit.csv_path, unit.image_dir)
+        return futures
+
+    def stop_all(self):
+        return {name: unit.pipeline.stop_run() for name, unit in self.units.items()}
+
+    def broadcast(self, text, timeout=None):
+        """Send one command to every connected unit in a single loop pass.
+        Returns {name: Future}; see fanout_report()."""
+        futures, batch = {}, []
+        for name, unit in self.units.items():
+            try:
+                item = unit.client._prepare(text, timeout)
+            except Exception as e:
+                futures[name] = Future()
+                futures[name].set_exception(e)
+                continue
+            futures[name] = item[3]
+            batch.append((unit.client, item))
+        self.loop.call_soon(self._write_all, batch)
+        return futures
+
+    @staticmethod
+    def _write_all(batch):
+        for client, item in batch:
+            client._write(*item)
+
+    def dashboard(self):
+        """One dict per unit plus a totals row, for format_dashboard() or a GUI table."""
+        rows = []
+        for name, unit in self.units.items():
+            st = unit.pipeline.stats()
+            snap = unit.pipeline.metrics.snapshot()
+            c, h = snap["counters"], snap["histograms"]
+            rows.append({
+                "unit": name, "address": f"{unit.host}:{unit.port}",
+                "link": "up" if unit.client.sock is not None else "down",
+                "count": st["count"], "exposures": st["exposures"], "images": st["images"],
+                "pairs": st["pairs"],
+                "pending": f"{st['pending_exposures']}/{st['pending_images']}",
+                "expired": f"{c['expired_exposures_total']}/{c['expired_images_total']}",
+                "delta_p50_ms": h["delta_ms"]["p50"],
+                "rtt_p50_ms": None if h["poll_rtt_seconds"]["p50"] is None else h["poll_rtt_seconds"]["p50"] * 1e3,
+            })
+        rows.append({"unit": "TOTAL", "address": f"{len(rows)} units",
+                     "link": f"{sum(r['link'] == 'up' for r in rows)} up",
+                     **{k: sum(r[k] for r in rows) for k in ("count", "exposures", "images", "pairs")},
+                     "pending": "", "expired": "", "delta_p50_ms": None, "rtt_p50_ms": None})
+        return rows
+
+    def close(self, timeout=2.0):
+        self.supervisor.close(timeout)
+        for unit in self.units.values():
+            unit.pipeline.close(timeout)
+            unit.client.close()
+        self.worker.close(timeout)
+        self.hub.close(timeout)
+        self.loop.close(timeout)
+        if self.exif is not None:
+            self.exif.close()
+        if self.store is not None:
+            self.store.close()
+
+
+def fanout_report(futures, timeout=CMD_TIMEOUT_SEC + 1.0):
+    """Wait for a broadcast; returns ([(name, sent offset ms, rtt ms, reply or error)], send spread ms).
+    Offsets are from the first unit's send, so the spread is how far apart "at once" really was."""
+    results = []
+    for name, f in futures.items():
+        try:
+            reply = f.result(timeout)
         except Exception as e:
-            self.append_log(f"[IMG SCAN ERROR] {e}")
-
-        # reschedule scan
-        self.after(300, self.scan_image_folder)
-
-    def try_match_pairs(self):
-        """Greedy match: for each exposure (oldest first), pick the closest-time unmatched image within tolerance."""
-        if not self.csv_filename:
-            return
-        if not self.pending_exposures or not self.pending_images:
-            return
+            reply = e
+        sent = getattr(f, "sent_at", None)
+        replied = getattr(f, "replied_at", None)
+        results.append((name, sent, replied, reply))
+    sends = [r[1] for r in results if r[1] is not None]
+    first = min(sends) if sends else 0.0
+    rows = [(name, None if sent is None else (sent - first) * 1e3,
+             None if replied is None else (replied - sent) * 1e3, reply)
+            for name, sent, replied, reply in results]
+    return rows, ((max(sends) - first) * 1e3 if sends else None)
+
+
+def format_dashboard(rows):
+    def num(v, fmt="{:.0f}"):
+        return "-" if v is None else fmt.format(v)
+
+    out = [f"{'unit':<10} {'address':<22} {'link':<6} {'count':>7} {'exp':>7} {'img':>7} {'pairs':>7}"
+           f" {'pending':>9} {'expired':>9} {'Δ p50':>7} {'rtt p50':>8}"]
+    for r in rows:
+        out.append(f"{r['unit']:<10} {r['address']:<22} {r['link']:<6} {r['count']:>7} {r['exposures']:>7}"
+                   f" {r['images']:>7} {r['pairs']:>7} {r['pending']:>9} {r['expired']:>9}"
+                   f" {num(r['delta_p50_ms']):>7} {num(r['rtt_p50_ms'], '{:.1f}'):>8}")
+    return "\n".join(out)
+
+
+def extract_rx_payload(line: str):
+    """Text the RS-485 bus sent, if this line carries any."""
+    if line.startswith("RS485: "):
+        return line[7:]
+    tag = "[RS485<-] "
+    if line.startswith(tag):
+        return line[len(tag):]
+    return None
+
+
+# ---------- Headless ----------
+def _stop_on_signals():
+    """An Event set by SIGTERM / Ctrl+C."""
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            signal.signal(sig, lambda *_: stop.set())
+        except (ValueError, OSError):
+            pass
+    return stop
 
-        # sort by time
-        self.pending_exposures.sort(key=lambda x: x[0])
-        self.pending_images.sort(key=lambda x: x[0])
 
-        matched_exposures = []
-        matched_images_idx = set()
+def parse_unit(spec, image_dir=DEFAULT_IMAGE_DIR):
+    """--unit NAME=HOST[:PORT][@IMAGE_DIR] -> (name, host, port, image_dir)."""
+    name, sep, rest = spec.partition("=")
+    if not sep or not name or not rest:
+        raise argparse.ArgumentTypeError(f"expected NAME=HOST[:PORT][@IMAGE_DIR], got {spec!r}")
+    addr, _, folder = rest.partition("@")
+    host, _, port = addr.partition(":")
+    return name, host, int(port) if port else DEFAULT_PORT, folder or image_dir
 
-        for ei, (ets, ecount) in enumerate(self.pending_exposures):
-            # find image with minimal |t_img - t_exp|
-            best_idx = None
-            best_dt = None
-            for ii, (its, fname) in enumerate(self.pending_images):
-                if ii in matched_images_idx:
-                    continue
-                dt = abs((its - ets).total_seconds())
-                if best_dt is None or dt < best_dt:
-                    best_dt = dt
-                    best_idx = ii
-            if best_idx is not None and best_dt is not None and best_dt <= MATCH_TOLERANCE_SEC:
-                matched_exposures.append(ei)
-                matched_images_idx.add(best_idx)
-
-        # write matches to CSV
-        if matched_exposures:
-            with open(self.csv_filename, "a", newline="") as f:
-                writer = csv.writer(f)
-                for ei in sorted(matched_exposures, reverse=True):
-                    ets, ecount = self.pending_exposures[ei]
-                    # find its paired image again (closest within tolerance)
-                    best_idx = None
-                    best_dt = None
-                    for ii, (its, fname) in enumerate(self.pending_images):
-                        if ii in matched_images_idx:
-                            # may include many; pick the one closest
-                            pass
-                    # Recompute for certainty (closest)
-                    best_idx2 = None
-                    best_dt2 = None
-                    for ii, (its, fname) in enumerate(self.pending_images):
-                        if ii not in matched_images_idx:
-                            continue
-                        dt = abs((its - ets).total_seconds())
-                        if best_dt2 is None or dt < best_dt2:
-                            best_dt2 = dt
-                            best_idx2 = ii
-                    # Fallback: if not found above (shouldn't happen), pick closest overall within tol
-                    if best_idx2 is None:
-                        for ii, (its, fname) in enumerate(self.pending_images):
-                            dt = abs((its - ets).total_seconds())
-                            if best_dt2 is None or dt < best_dt2:
-                                best_dt2 = dt
-                                best_idx2 = ii
-
-                    if best_idx2 is not None and best_dt2 is not None and best_dt2 <= MATCH_TOLERANCE_SEC:
-                        its, fname = self.pending_images[best_idx2]
-                        delta_ms = int(round((its - ets).total_seconds() * 1000.0))
-                        writer.writerow([
-                            ets.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
-                            ecount,
-                            its.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3],
-                            fname,
-                            delta_ms
-                        ])
-                        self.append_log(f"[PAIR] Exposure #{ecount} @ {ets.strftime('%H:%M:%S.%f')[:-3]}  <->  {fname} @ {its.strftime('%H:%M:%S.%f')[:-3]}  (Δ {delta_ms} ms)")
-
-                        # remove matched image & exposure
-                        try:
-                            self.pending_images.pop(best_idx2)
-                        except Exception:
-                            pass
-                        self.pending_exposures.pop(ei)
 
-        # Keep unmatched items for later scans/updates
+def run_units(args):
+    """Headless run of several controllers: print a combined dashboard until stopped."""
+    mgr = SessionManager(poll_ms=args.poll_ms, image_timestamps=args.image_timestamps,
+                         capture_dir=None if args.no_capture else args.capture_dir, db=args.db or None)
+    for spec in args.unit:
+        name, host, port, folder = parse_unit(spec, args.image_dir)
+        mgr.add_unit(name, host, port, folder)
+    stop = _stop_on_signals()
 
-    # ---------- Open CSV ----------
-    def open_current_csv(self):
-        if not self.csv_filename:
-            messagebox.showinfo("CSV", "No CSV for this run yet. Press 'Start Count' first.")
-            return
+    for name, f in mgr.connect_all(supervise=not args.no_reconnect).items():
         try:
-            open_file_with_default_app(self.csv_filename)
+            f.result(CONNECT_TIMEOUT_SEC + 1.0)
+            print(f"[{name}] connected", flush=True)
+        except FutureTimeout:
+            print(f"[{name}] connect timed out", flush=True)
         except Exception as e:
-            messagebox.showerror("Open CSV failed", str(e))
-
-    # ---------- Close ----------
-    def on_close(self):
-        self.image_scan_running = False
-        self.client.close()
-        self.destroy()
+            print(f"[{name}] connect failed: {e}", flush=True)
+    for name, f in mgr.start_all(args.csv_dir).items():
+        # one stuck unit must not keep the others from running
+        try:
+            f.result(5.0)
+        except FutureTimeout:
+            print(f"[{name}] start timed out, not logging", flush=True)
+            continue
+        except Exception as e:
+            print(f"[{name}] start failed: {e}", flush=True)
+            continue
+        print(f"[{name}] logging to {mgr.units[name].csv_path}", flush=True)
+    if args.broadcast:
+        rows, spread = fanout_report(mgr.broadcast(args.broadcast))
+        for name, offset, rtt, reply in rows:
+            print(f"[{name}] {args.broadcast}: sent +{offset or 0:.2f} ms, rtt "
+                  f"{'-' if rtt is None else f'{rtt:.1f}'} ms -> {reply}")
+        print(f"[broadcast] fan-out spread {spread or 0:.2f} ms", flush=True)
+
+    deadline = time.monotonic() + args.duration if args.duration else None
+    next_table = time.monotonic()
+    while not stop.wait(0.2):
+        for name, unit in mgr.units.items():
+            for line in unit.pipeline.log.drain():
+                if "ERROR" in line or "TIMEOUT" in line or "Disconnected" in line:
+                    print(f"[{name}] {line}", flush=True)
+        if not args.quiet and time.monotonic() >= next_table:
+            print(format_dashboard(mgr.dashboard()) + "\n", flush=True)
+            next_table = time.monotonic() + 2.0
+        if deadline and time.monotonic() >= deadline:
+            break
+
+    for name, f in mgr.stop_all().items():
+        try:
+            f.result(timeout=5.0)
+        except FutureTimeout:
+            print(f"[{name}] stop timed out", flush=True)
+        except Exception as e:
+            print(f"[{name}] stop failed: {e}", flush=True)
+    time.sleep(0.2)
+    rows = mgr.dashboard()
+    mgr.close()
+    print(format_dashboard(rows), flush=True)
+    if mgr.store is not None:
+        print(f"[DB] {mgr.store.stats()}", flush=True)
+    return 0
+
+
+def run_headless(args):
+    """Connect, start counting, poll / scan / pair until SIGTERM, Ctrl+C or --duration."""
+    log = LineQueue()
+    pipeline = None
+    client = TcpClient(None, on_lines=lambda lines: pipeline.on_lines(lines))
+    capture = None
+    if args.capture_dir and not args.no_capture:
+        try:
+            capture = TrafficCapture(args.capture_dir)
+            log.put(f"[CAPTURE] Recording traffic to {capture.path}")
+        except OSError as e:
+            log.put(f"[CAPTURE] not recording: {e}")
+    store = SessionStore(args.db, log=log) if args.db else None
+    pipeline = ExposurePipeline(client, log=log, rx=LineQueue(), poll_ms=args.poll_ms,
+                                image_timestamps=args.image_timestamps, capture=capture, store=store)
+
+    stop = _stop_on_signals()
+
+    def print_log():
+        for line in log.drain():
+            print(f"{datetime.datetime.now().strftime('%H:%M:%S.%f')[:-3]} {line}", flush=True)
+
+    try:
+        client.connect(args.host, args.port)
+    except Exception as e:
+        print(f"Connect to {args.host}:{args.port} failed: {e}", file=sys.stderr)
+        pipeline.close()
+        if store:
+            store.close()
+        return 1
+    log.put(f"[Connected to {args.host}:{args.port}]")
+    supervisor = None
+    if not args.no_reconnect:
+        supervisor = ConnectionSupervisor()
+        supervisor.watch(client, args.host, args.port, pipeline)
+
+    ts = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    csv_path = os.path.join(args.csv_dir, f"exposure_log_{ts}.csv")
+    pipeline.start_run(csv_path, args.image_dir)
+    sequencer = None
+    if args.sequence:
+        sequencer = Sequencer(client, args.sequence_steps, log=log,
+                              csv_path=os.path.join(args.csv_dir, f"sequence_log_{ts}.csv")).start()
+
+    exporter = None
+    if args.metrics_port or args.metrics_json:
+        try:
+            exporter = MetricsExporter(pipeline.metrics, port=args.metrics_port or None, path=args.metrics_json)
+            if exporter.server:
+                log.put(f"[METRICS] http://127.0.0.1:{exporter.port}/metrics")
+        except OSError as e:
+            log.put(f"[METRICS] not exported: {e}")
+
+    deadline = time.monotonic() + args.duration if args.duration else None
+    reported = False
+    while not stop.wait(0.2):
+        if not reported and pipeline.first_poll_at is not None:
+            log.put(f"[Startup] first GET_EXPOSURE_COUNT sent "
+                    f"{(pipeline.first_poll_at - PROCESS_START) * 1e3:.0f} ms after start")
+            reported = True
+        pipeline.metrics.observe("ui_queue_depth", len(log))
+        if args.quiet:
+            log.drain()
+        else:
+            print_log()
+        if deadline and time.monotonic() >= deadline:
+            break
+        if sequencer and not deadline and sequencer.finished.is_set():
+            break
+
+    # clean shutdown: STOP_EXPOSURE_COUNT, flush + fsync the CSV, close the socket
+    if sequencer:
+        sequencer.stop()
+        sequencer.wait(CMD_TIMEOUT_SEC + 2.0)
+    if supervisor:
+        supervisor.close()
+    try:
+        pipeline.stop_run().result(timeout=5.0)
+    except Exception as e:
+        log.put(f"[STOP ERROR] {e}")
+    time.sleep(0.2)      # let the STOP reply come back before the socket closes
+    pipeline.close()
+    client.close()
+    if exporter:
+        exporter.close()
+    if args.quiet:
+        log.drain()
+    stats = pipeline.stats()
+    log.put(f"[Done] {stats['exposures']} exposures, {stats['images']} images, "
+            f"{stats['pairs']} pairs -> {csv_path}")
+    if capture:
+        log.put(f"[CAPTURE] {capture.stats()}")
+    if store:
+        store.close()
+        log.put(f"[DB] {store.stats()}")
+    print_log()
+    return 0
+
+
+def run_replay(args):
+    """Feed a capture through the pipeline without a window and print the outcome."""
+    log = LineQueue()
+    pipeline = None
+    client = ReplayClient(None, on_lines=lambda lines: pipeline.on_lines(lines))
+    pipeline = ExposurePipeline(client, log=log, rx=LineQueue(), image_timestamps=args.image_timestamps)
+    replay = TrafficReplay(capture_files(args.replay), pipeline, args.replay_speed, args.csv_dir,
+                           stop=_stop_on_signals())
+    thread = threading.Thread(target=replay.run, daemon=True)
+    thread.start()
+    while thread.is_alive():
+        thread.join(0.2)
+        for line in log.drain():
+            if not args.quiet:
+                print(line, flush=True)
+    pipeline.close()
+    stats = pipeline.stats()
+    for line in log.drain():
+        if not args.quiet:
+            print(line, flush=True)
+    print(f"[REPLAY] {replay.summary()}")
+    print(f"[REPLAY] {stats['exposures']} exposures, {stats['images']} images, {stats['pairs']} pairs"
+          + (f" -> {', '.join(replay.csv_paths)}" if replay.csv_paths else ""), flush=True)
+    return 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Strobe / Lamp Controller (TCP) Aquorea Mk3")
+    ap.add_argument("--headless", action="store_true",
+                    help="run the exposure logger without a window")
+    ap.add_argument("--host", default=DEFAULT_HOST)
+    ap.add_argument("--port", type=int, default=DEFAULT_PORT)
+    ap.add_argument("--image-dir", default=DEFAULT_IMAGE_DIR, help="Sony SDK image output folder")
+    ap.add_argument("--csv-dir", default=".", help="where exposure_log_*.csv goes")
+    ap.add_argument("--poll-ms", type=int, default=EXPOSURE_POLL_MS, help="GET_EXPOSURE_COUNT period")
+    ap.add_argument("--image-timestamps", choices=["mtime", "exif"], default=IMAGE_TIMESTAMPS,
+                    help="time images by file mtime or by the Exif capture time")
+    ap.add_argument("--duration", type=float, default=0, help="stop after this many seconds (0 = run until stopped)")
+    ap.add_argument("--quiet", action="store_true", help="only print the summary")
+    ap.add_argument("--metrics-port", type=int, default=METRICS_PORT or 0,
+                    help="serve Prometheus metrics on 127.0.0.1:PORT, e.g. 9464 (default off)")
+    ap.add_argument("--metrics-json", help="rewrite a JSON metrics snapshot here every few seconds")
+    ap.add_argument("--no-reconnect", action="store_true", help="don't reconnect after the link drops")
+    ap.add_argument("--unit", action="append", metavar="NAME=HOST[:PORT][@IMAGE_DIR]",
+                    help="drive several controllers at once (repeat per unit)")
+    ap.add_argument("--broadcast", metavar="CMD", help="with --unit: send CMD to every unit after connecting")
+    ap.add_argument("--sequence", metavar="SCRIPT",
+                    help="headless: run a timed command script (see parse_sequence) alongside the count; "
+                         "without --duration the run ends with it")
+    ap.add_argument("--db", default=SESSION_DB or "",
+                    help="also record every exposure, image and pair in this SQLite file (see sessions.py)")
+    ap.add_argument("--capture-dir", default=CAPTURE_DIR or "", help="where the traffic captures (*.aqcap) go")
+    ap.add_argument("--no-capture", action="store_true", help="don't record the traffic")
+    ap.add_argument("--replay", metavar="CAPTURE",
+                    help="feed a recorded .aqcap through the pipeline (and window) instead of connecting")
+    ap.add_argument("--replay-speed", type=float, default=1.0,
+                    help="1 = real time, 10 = ten times faster, 0 = as fast as possible")
+    args = ap.parse_args(argv)
+
+    if args.unit:
+        for spec in args.unit:
+            try:
+                parse_unit(spec)
+            except (argparse.ArgumentTypeError, ValueError) as e:
+                ap.error(str(e))
+        # each unit keeps its own metrics; there is no combined registry to serve
+        if args.metrics_port or args.metrics_json:
+            ap.error("--metrics-port and --metrics-json are for a single controller, not --unit")
+        if args.replay:
+            ap.error("--replay plays back one controller's capture, not --unit")
+        if args.sequence:
+            ap.error("--sequence runs against a single controller, not --unit")
+    if args.sequence:
+        try:
+            args.sequence_steps = load_sequence(args.sequence)
+        except (OSError, ValueError) as e:
+            ap.error(f"--sequence {args.sequence}: {e}")
+    if args.headless:
+        if args.replay:
+            return run_replay(args)
+        return run_units(args) if args.unit else run_headless(args)
+
+    # gui.py imports from "main"; make that this already-loaded module, not a second copy
+    sys.modules.setdefault("main", sys.modules[__name__])
+    if args.unit:
+        from gui import Dashboard
+        Dashboard(args).mainloop()
+        return 0
+    from gui import App
+    App(image_timestamps=args.image_timestamps, capture_dir=None if args.no_capture else args.capture_dir,
+        replay=args.replay, replay_speed=args.replay_speed, db=args.db or None,
+        metrics_port=args.metrics_port or None).mainloop()
+    return 0
 
 
 if __name__ == "__main__":
-    App().mainloop()
+    sys.exit(main())
@@ -0,0 +1,456 @@
+"""
+Offline re-pairing of recorded sessions, without the GUI. Exposures come from
+exposure_log_*.csv (or any CSV with ExposureTS and ExposureCount columns) or
+from a session database written with main.py --db, which also holds the
+exposures and images that never paired live; images from the session itself
+or a camera folder.
+
+    python repair.py exposure_log_2024-05-01_10-00-00.csv --image-dir D:\\cams\\port
+    python repair.py logs/*.csv@D:\\cams\\port --out fixed/ --json summary.json
+    python repair.py exposure_log_x.csv                   # re-pair the CSV's own images
+    python repair.py exposure_log_x.csv --image-dir cam --image-timestamps exif
+    python repair.py sessions.db --out fixed/             # every run in the database
+    python repair.py sessions.db#12                       # run 12 (see sessions.py runs)
+
+Each session is written to <out>/<name>_repaired.csv with the usual columns,
+and a match-quality line per session is printed. Sessions run in parallel on
+a process pool. NumPy is used when installed; without it the same matching
+runs on bisect.
+"""
+import argparse
+import bisect
+import contextlib
+import csv
+import datetime
+import gc
+import glob
+import itertools
+import json
+import math
+import operator
+import os
+import re
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from main import CSV_HEADER, IMAGE_PATTERN, MATCH_TOLERANCE_SEC, ExifReader
+
+MATCH_PERIODS = 0.45    # pair within this fraction of the exposure period (unique below 0.5)
+ANCHOR_FRAMES = 8       # first exposures/images that fix the image lag, as in a live run
+LOAD_CHUNK = 65536      # CSV rows turned into columns at a time
+ROUNDS = 3              # mutual-nearest passes; later ones only pick up leftovers
+TS_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+_PART = re.compile(r"_part(\d+)\.csv$", re.IGNORECASE)
+_NEEDS_QUOTES = re.compile(r'[",\r\n]')
+_MS_TEXT = [f".{ms:03d}" for ms in range(1000)]
+
+
+# ---------- Loading ----------
+def session_files(path):
+    """The CSV plus the _part2, _part3, ... files SessionWriter rotated into."""
+    stem, ext = os.path.splitext(path)
+    parts = [p for p in glob.glob(glob.escape(stem) + "_part*" + ext) if _PART.search(p)]
+    return [path] + sorted(parts, key=lambda p: int(_PART.search(p).group(1)))
+
+
+def _epochs(texts):
+    """ISO times -> epoch seconds, as datetime.fromisoformat(t).timestamp() without a Python call per row."""
+    return map(datetime.datetime.timestamp, map(datetime.datetime.fromisoformat, texts))
+
+
+def _plain(*columns):
+    """True if no value in these columns needs CSV quoting (times and deltas never do)."""
+    return not any(_NEEDS_QUOTES.search("".join(map(str, col))) for col in columns)
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Millions of short rows set off full garbage collections that find nothing."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _format_times(ts):
+    """Epoch seconds -> the CSV's "%Y-%m-%d %H:%M:%S.mmm" text, as
+    datetime.fromtimestamp(t).strftime(TS_FORMAT)[:-3] gives it, with each
+    second formatted once and no Python call per value."""
+    ts = list(ts)
+    secs = list(map(math.floor, ts))
+    # fromtimestamp rounds to the microsecond, half to even, as round() does
+    us = list(map(round, map(operator.mul, map(operator.sub, ts, secs), itertools.repeat(1e6))))
+    for k in [k for k, u in enumerate(us) if u >= 1000000]:
+        secs[k] += 1
+        us[k] -= 1000000
+    heads = {s: datetime.datetime.fromtimestamp(s).isoformat(" ") for s in set(secs)}
+    return list(map(operator.add, map(heads.__getitem__, secs),
+                    map(_MS_TEXT.__getitem__, map(operator.floordiv, us, itertools.repeat(1000)))))
+
+
+def is_session_db(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(16) == b"SQLite format 3\0"
+    except OSError:
+        return False
+
+
+def db_runs(path):
+    db = sqlite3.connect(path)
+    try:
+        return [run for run, in db.execute("SELECT id FROM runs ORDER BY id")]
+    finally:
+        db.close()
+
+
+def load_db_session(path, run, timestamps="mtime"):
+    """One run of a session database, shaped like load_session(): every exposure
+    and image the run saw, paired or not. Texts are None (formatted on output);
+    with exif timestamps images keep their camera-clock capture time."""
+    db = sqlite3.connect(path)
+    try:
+        exposures = db.execute("SELECT CAST(count AS TEXT), ts, err_ms FROM exposures WHERE run = ? ORDER BY ts",
+                               (run,)).fetchall()
+        images = db.execute("SELECT name, ts, capture FROM images WHERE run = ? ORDER BY ts", (run,)).fetchall()
+        was = dict(db.execute("SELECT image, CAST(count AS TEXT) FROM pairs WHERE run = ?", (run,)))
+    finally:
+        db.close()
+    if timestamps == "exif":
+        # no capture time: can't be placed on the camera clock, as in load_folder()
+        images = [(name, capture, capture) for name, _, capture in images if capture is not None]
+    counts, exp_t, errs = map(list, zip(*exposures)) if exposures else ([], [], [])
+    errs = ["" if err is None else int(round(err)) for err in errs]
+    names, img_t, _ = map(list, zip(*images)) if images else ([], [], [])
+    return exp_t, None, counts, errs, img_t, None, names, was
+
+
+def load_session(path):
+    """Rows of a session CSV as parallel lists: exposure times/text/counts/errors,
+    the images it paired (time, text, name) in file order, and {image: count}."""
+    exp_t, exp_text, counts, errs, img_t, img_text, img_names = [], [], [], [], [], [], []
+    was = {}
+    for part in session_files(path):
+        with open(part, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None) or []
+            col = {name: k for k, name in enumerate(header)}
+            if "ExposureTS" not in col or "ExposureCount" not in col:
+                raise ValueError(f"{part}: needs ExposureTS and ExposureCount columns")
+            e, c = col["ExposureTS"], col["ExposureCount"]
+            i, n, r = col.get("ImageTS"), col.get("ImageFile"), col.get("ExposureErr_ms")
+            # a chunk of rows at a time, turned into columns by zip_longest
+            while True:
+                rows = [row for row in itertools.islice(reader, LOAD_CHUNK) if row]
+                if not rows:
+                    break
+                cols = list(itertools.zip_longest(*rows, fillvalue=""))
+                exp_text.extend(cols[e])
+                exp_t.extend(_epochs(cols[e]))
+                counts.extend(cols[c])
+                errs.extend(cols[r] if r is not None else [""] * len(rows))
+                if i is not None and n is not None:
+                    has = cols[i]
+                    texts = list(itertools.compress(has, has))
+                    names = list(itertools.compress(cols[n], has))
+                    img_text.extend(texts)
+                    img_t.extend(_epochs(texts))
+                    img_names.extend(names)
+                    was.update(zip(names, itertools.compress(cols[c], has)))
+    return exp_t, exp_text, counts, errs, img_t, img_text, img_names, was
+
+
+def load_folder(folder, start, end, timestamps="mtime"):
+    """Images in `folder` written between start and end (epoch seconds), as
+    (times, names) sorted by time; times are mtimes or Exif capture times."""
+    found = []
+    with os.scandir(folder) as it:
+        for entry in it:
+            if not IMAGE_PATTERN.match(entry.name):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            if start <= mtime <= end:
+                found.append((mtime, entry.name))
+    if timestamps == "exif":
+        reader = ExifReader()
+        try:
+            captures = list(reader.pool.map(reader.capture_time, [os.path.join(folder, n) for _, n in found]))
+        finally:
+            reader.close()
+        # a file without a capture time can't be placed on the camera clock: leave it out
+        found = [(c, n) for (_, n), c in zip(found, captures) if c is not None]
+    found.sort()
+    return [t for t, _ in found], [n for _, n in found]
+
+
+# ---------- Matching ----------
+def _nearest(a, q):
+    """For each value in q, the index of the nearest element of sorted a."""
+    if np is not None:
+        a, q = np.asarray(a, dtype=float), np.asarray(q, dtype=float)
+        if len(a) == 1:
+            return np.zeros(len(q), dtype=np.intp)
+        j = np.clip(np.searchsorted(a, q), 1, len(a) - 1)
+        return np.where(q - a[j - 1] <= a[j] - q, j - 1, j)
+    out = []
+    last = len(a) - 1
+    for x in q:
+        j = bisect.bisect_left(a, x)
+        if j > last:
+            j = last
+        elif j > 0 and x - a[j - 1] <= a[j] - x:
+            j -= 1
+        out.append(j)
+    return out
+
+
+def match(exp, img, tol, rounds=ROUNDS):
+    """Pair two sorted time arrays: a pair is an image and an exposure that are
+    each other's nearest within `tol`. Once the lag is taken out and `tol` is
+    under half the exposure period, no image has two exposures in reach, so
+    this is the best one-to-one matching there is. Returns (exp_idx, img_idx)."""
+    if np is not None:
+        exp, img = np.asarray(exp, dtype=float), np.asarray(img, dtype=float)
+        e_idx, i_idx = np.arange(len(exp)), np.arange(len(img))
+        out_e, out_i = [], []
+        for _ in range(rounds):
+            if not len(e_idx) or not len(i_idx):
+                break
+            ev, iv = exp[e_idx], img[i_idx]
+            to_e = _nearest(ev, iv)
+            to_i = _nearest(iv, ev)
+            mutual = (to_i[to_e] == np.arange(len(iv))) & (np.abs(iv - ev[to_e]) <= tol)
+            if not mutual.any():
+                break
+            out_e.append(e_idx[to_e[mutual]])
+            out_i.append(i_idx[mutual])
+            keep = np.ones(len(ev), dtype=bool)
+            keep[to_e[mutual]] = False
+            e_idx, i_idx = e_idx[keep], i_idx[~mutual]
+        if not out_e:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+        e_out, i_out = np.concatenate(out_e), np.concatenate(out_i)
+        order = np.argsort(e_out, kind="stable")
+        return e_out[order], i_out[order]
+
+    e_idx, i_idx = list(range(len(exp))), list(range(len(img)))
+    pairs = []
+    for _ in range(rounds):
+        if not e_idx or not i_idx:
+            break
+        ev, iv = [exp[k] for k in e_idx], [img[k] for k in i_idx]
+        to_e = _nearest(ev, iv)
+        to_i = _nearest(iv, ev)
+        taken = set()
+        for k, j in enumerate(to_e):
+            if to_i[j] == k and abs(iv[k] - ev[j]) <= tol:
+                pairs.append((e_idx[j], i_idx[k]))
+                taken.add(k)
+        if not taken:
+            break
+        used = {to_e[k] for k in taken}
+        e_idx = [e for j, e in enumerate(e_idx) if j not in used]
+        i_idx = [i for k, i in enumerate(i_idx) if k not in taken]
+    pairs.sort()
+    return [e for e, _ in pairs], [i for _, i in pairs]
+
+
+def _median(xs):
+    xs = sorted(xs)
+    return xs[len(xs) // 2] if xs else 0.0
+
+
+def estimate_lag(exp, img, period, anchor=ANCHOR_FRAMES):
+    """Image minus exposure time. The first images of a session belong to the
+    first exposures (the same assumption a live run starts from); the rough
+    lag from those is then refined on every image within half a period."""
+    k = min(anchor, len(exp), len(img))
+    lag = _median([img[j] - exp[j] for j in range(k)])
+    shifted = [t - lag for t in img]
+    near = _nearest(exp, shifted)
+    resid = [s - exp[j] for s, j in zip(shifted, near)]
+    return lag + _median([r for r in resid if abs(r) < period / 2])
+
+
+# ---------- One session ----------
+def _pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(len(xs) * p))] if xs else None
+
+
+def repair_session(path, image_dir=None, out_dir=None, timestamps="mtime", lag_ms=None, run=None):
+    """Re-pair one session (a CSV, or run `run` of a session database) and write
+    <out_dir>/<name>_repaired.csv. Returns its summary dict."""
+    with _gc_paused():
+        return _repair_session(path, image_dir, out_dir, timestamps, lag_ms, run)
+
+
+def _repair_session(path, image_dir, out_dir, timestamps, lag_ms, run):
+    t0 = time.perf_counter()
+    name = os.path.splitext(os.path.basename(path))[0]
+    if run is None:
+        exp_t, exp_text, counts, errs, csv_img_t, csv_img_text, csv_img_names, was = load_session(path)
+    else:
+        exp_t, exp_text, counts, errs, csv_img_t, csv_img_text, csv_img_names, was = \
+            load_db_session(path, run, timestamps)
+        name = f"{name}_run{run}"
+    order = sorted(range(len(exp_t)), key=exp_t.__getitem__)
+    exp = [exp_t[k] for k in order]
+    summary = {"session": name if run is not None else os.path.basename(path), "exposures": len(exp),
+               "images": 0, "pairs": 0}
+    if not exp:
+        return summary
+
+    if image_dir:
+        img, names = load_folder(image_dir, exp[0] - MATCH_TOLERANCE_SEC, exp[-1] + MATCH_TOLERANCE_SEC + 10.0,
+                                 timestamps)
+        texts = None
+    else:
+        img_order = sorted(range(len(csv_img_t)), key=csv_img_t.__getitem__)
+        img, names = [csv_img_t[k] for k in img_order], [csv_img_names[k] for k in img_order]
+        texts = [csv_img_text[k] for k in img_order] if csv_img_text is not None else None
+    summary["images"] = len(img)
+    if not img:
+        return summary
+
+    period = _median([b - a for a, b in zip(exp, exp[1:])]) or MATCH_TOLERANCE_SEC
+    tol = min(MATCH_TOLERANCE_SEC, MATCH_PERIODS * period)
+    lag = lag_ms / 1e3 if lag_ms is not None else estimate_lag(exp, img, period)
+    shifted = [t - lag for t in img]
+    e_idx, i_idx = match(exp, shifted, tol)
+
+    # exif times are on the camera clock; report them on the exposure clock
+    clock_shift = lag if timestamps == "exif" and (image_dir or run is not None) else 0.0
+    # output columns, built with map/zip rather than row by row
+    if np is not None:
+        e_idx, i_idx = e_idx.tolist(), i_idx.tolist()
+    src = list(map(order.__getitem__, e_idx))
+    ets = list(map(exp.__getitem__, e_idx))
+    its = [img[i] - clock_shift for i in i_idx]
+    delta = [int(round((b - a) * 1000.0)) for a, b in zip(ets, its)]
+    deltas = sorted(map(abs, delta))       # sorted once for both percentiles
+    paired = list(map(names.__getitem__, i_idx))
+    paired_counts = list(map(counts.__getitem__, src))
+    changed = sum(map(operator.ne, map(was.get, paired), paired_counts))
+    paired_errs = list(map(errs.__getitem__, src))
+    if exp_text is None and not texts:
+        both = _format_times(ets + its)          # mostly the same seconds: format them once
+        exp_col, img_col = both[:len(ets)], both[len(ets):]
+    else:
+        exp_col = map(exp_text.__getitem__, src) if exp_text is not None else _format_times(ets)
+        img_col = map(texts.__getitem__, i_idx) if texts else _format_times(its)
+    rows = zip(exp_col, paired_counts, img_col, paired, delta, paired_errs)
+
+    out_dir = out_dir or os.path.dirname(os.path.abspath(path))
+    out_path = os.path.join(out_dir, f"{name}_repaired.csv")
+    with open(out_path, "w", newline="", buffering=1 << 16) as f:
+        w = csv.writer(f)
+        w.writerow(CSV_HEADER)
+        if _plain(paired, paired_counts, paired_errs):
+            # what csv.writer would write, a few times faster
+            f.writelines(f"{a},{b},{c},{d},{e},{g}\r\n" for a, b, c, d, e, g in rows)
+        else:
+            w.writerows(rows)
+
+    pairs = len(deltas)
+    summary.update({
+        "pairs": pairs,
+        "unmatched_exposures": len(exp) - pairs,
+        "unmatched_images": len(img) - pairs,
+        "lag_ms": round(lag * 1000.0, 1),
+        "period_ms": round(period * 1000.0, 1),
+        "tolerance_ms": round(tol * 1000.0, 1),
+        "abs_delta_p50_ms": _pct(deltas, 0.5),
+        "abs_delta_p99_ms": _pct(deltas, 0.99),
+        "changed": changed,
+        "output": out_path,
+        "seconds": round(time.perf_counter() - t0, 3),
+    })
+    return summary
+
+
+def _run(job):
+    try:
+        return repair_session(*job)
+    except Exception as e:
+        run = job[5] if len(job) > 5 else None
+        return {"session": os.path.basename(job[0]) + ("" if run is None else f"#{run}"), "error": str(e)}
+
+
+def parse_session(spec, image_dir=None):
+    """CSV[@IMAGE_DIR] or DB[#RUN][@IMAGE_DIR] -> (path, folder, run). The folder
+    defaults to --image-dir (None = the session's own images); no run = all runs."""
+    path, _, folder = spec.partition("@")
+    path, _, run = path.partition("#")
+    return path, folder or image_dir, int(run) if run else None
+
+
+def format_summary(results):
+    cols = ("session", "exposures", "images", "pairs", "unmatched_exposures", "unmatched_images",
+            "lag_ms", "abs_delta_p50_ms", "abs_delta_p99_ms", "changed", "seconds")
+    heads = ("session", "exp", "img", "pairs", "lone exp", "lone img", "lag ms", "|d| p50", "|d| p99",
+             "changed", "sec")
+    lines = [f"{heads[0]:<40}" + "".join(f"{h:>10}" for h in heads[1:])]
+    for r in results:
+        if "error" in r:
+            lines.append(f"{r['session']:<40}  ERROR {r['error']}")
+            continue
+        cells = ["-" if r.get(c) is None else str(r[c]) for c in cols[1:]]
+        lines.append(f"{r['session'][:40]:<40}" + "".join(f"{c:>10}" for c in cells))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("sessions", nargs="+", metavar="CSV[@IMAGE_DIR] | DB[#RUN][@IMAGE_DIR]")
+    ap.add_argument("--image-dir", help="camera folder for sessions without @IMAGE_DIR")
+    ap.add_argument("--image-timestamps", choices=["mtime", "exif"], default="mtime",
+                    help="time folder images by file mtime or by the Exif capture time")
+    ap.add_argument("--out", help="folder for the *_repaired.csv files (default: next to each CSV)")
+    ap.add_argument("--lag-ms", type=float, help="image minus exposure time, if known (default: estimated)")
+    ap.add_argument("--json", help="also write the per-session summary here")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="sessions re-paired in parallel")
+    args = ap.parse_args(argv)
+
+    jobs = []
+    for spec in args.sessions:
+        path, folder, run = parse_session(spec, args.image_dir)
+        for p in sorted(glob.glob(path)) or [path]:
+            if is_session_db(p):
+                for r in [run] if run is not None else db_runs(p):
+                    jobs.append((p, folder, args.out, args.image_timestamps, args.lag_ms, r))
+                continue
+            if _PART.search(p) or p.endswith("_repaired.csv"):
+                continue        # rotated parts are read with their first file
+            jobs.append((p, folder, args.out, args.image_timestamps, args.lag_ms))
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    if len(jobs) == 1 or args.jobs <= 1:
+        results = [_run(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(jobs))) as pool:
+            results = list(pool.map(_run, jobs))
+
+    print(format_summary(results))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if any("error" in r for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
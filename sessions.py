@@ -0,0 +1,114 @@
+"""
+Questions about a session database (main.py --db sessions.db) without parsing
+CSVs.
+
+    python sessions.py sessions.db runs
+    python sessions.py sessions.db pairs --since 7d --min-delta-ms 500
+    python sessions.py sessions.db pairs --unit port --since 2024-05-01 --until 2024-05-02
+    python sessions.py sessions.db unmatched 12
+    python sessions.py sessions.db export 12 run12.csv
+
+Times are local dates/times (2024-05-01, "2024-05-01 10:00") or ages such as
+90m, 12h or 7d. The database can be read while a run is still writing to it.
+"""
+import argparse
+import datetime
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from main import export_run_csv, query_pairs, unmatched
+
+_AGE = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_when(text):
+    """Epoch seconds from an age (7d, 12h, 90m, 30s) or a local ISO date/time."""
+    m = _AGE.match(text.strip())
+    if m:
+        return time.time() - float(m.group(1)) * _UNITS[m.group(2)]
+    try:
+        return datetime.datetime.fromisoformat(text.strip()).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a time or age: {text!r}")
+
+
+def _ts(ts):
+    return "-" if ts is None else datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+def show_runs(db):
+    rows = db.execute("SELECT r.id, r.unit, r.started, r.stopped, r.csv_path, "
+                      "(SELECT COUNT(*) FROM exposures e WHERE e.run = r.id), "
+                      "(SELECT COUNT(*) FROM images i WHERE i.run = r.id), "
+                      "(SELECT COUNT(*) FROM pairs p WHERE p.run = r.id) "
+                      "FROM runs r ORDER BY r.id").fetchall()
+    print(f"{'run':>5}  {'unit':<10}{'started':<25}{'stopped':<25}{'exp':>8}{'img':>8}{'pairs':>8}  csv")
+    for run, unit, started, stopped, csv_path, exp, img, pairs in rows:
+        print(f"{run:>5}  {unit or '-':<10}{_ts(started):<25}{_ts(stopped):<25}{exp:>8}{img:>8}{pairs:>8}  "
+              f"{csv_path or '-'}")
+
+
+def show_pairs(db, args):
+    start = time.perf_counter()
+    rows = query_pairs(db, since=args.since, until=args.until, min_abs_delta_ms=args.min_delta_ms,
+                       unit=args.unit, limit=args.limit)
+    took = (time.perf_counter() - start) * 1e3
+    print(f"{'unit':<10}{'run':>5}{'count':>8}  {'exposure':<25}{'image':<25}{'delta':>7}{'err':>6}  file")
+    for unit, run, count, image, ets, its, delta, err in rows:
+        print(f"{unit or '-':<10}{run:>5}{count:>8}  {_ts(ets):<25}{_ts(its):<25}{delta:>7}"
+              f"{'-' if err is None else round(err):>6}  {image}")
+    print(f"{len(rows)} pairs in {took:.1f} ms", file=sys.stderr)
+
+
+def show_unmatched(db, run):
+    exposures, images = unmatched(db, run)
+    for count, ts in exposures:
+        print(f"exposure {count:>8}  {_ts(ts)}")
+    for name, ts in images:
+        print(f"image    {name:>8}  {_ts(ts)}")
+    print(f"run {run}: {len(exposures)} unmatched exposures, {len(images)} unmatched images", file=sys.stderr)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("db", help="SQLite file written by main.py --db")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("runs", help="list runs with their row counts")
+    p = sub.add_parser("pairs", help="stored pairs, oldest first")
+    p.add_argument("--since", type=parse_when, help="exposures at or after this time/age")
+    p.add_argument("--until", type=parse_when, help="exposures before this time/age")
+    p.add_argument("--min-delta-ms", type=int, help="only pairs with |Delta| above this")
+    p.add_argument("--unit", help="only this unit's runs ('' for single-controller runs)")
+    p.add_argument("--limit", type=int, help="at most this many pairs")
+    p = sub.add_parser("unmatched", help="exposures and images of a run that never paired")
+    p.add_argument("run", type=int)
+    p = sub.add_parser("export", help="write a run's pairs as an exposure_log CSV")
+    p.add_argument("run", type=int)
+    p.add_argument("out")
+    args = ap.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"{args.db}: no such file", file=sys.stderr)
+        return 1
+    db = sqlite3.connect(args.db, timeout=10.0)
+    try:
+        if args.command == "runs":
+            show_runs(db)
+        elif args.command == "pairs":
+            show_pairs(db, args)
+        elif args.command == "unmatched":
+            show_unmatched(db, args.run)
+        elif args.command == "export":
+            n = export_run_csv(db, args.run, args.out)
+            print(f"run {args.run}: {n} pairs -> {args.out}", file=sys.stderr)
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,463 @@
+"""
+Local stand-in for the Aquorea Mk3 Nano (CurrentArduinoCode.ino) and the Sony
+camera, for load and latency testing without hardware.
+
+    python simulator.py --fps 20
+    python simulator.py --fps 30 --latency-ms 4 --jitter-ms 2 --split 0.3 --image-dir /tmp/cam
+    python main.py --headless --host 127.0.0.1 --image-dir /tmp/cam
+    python simulator.py --fps 20 --drop-every 15 --drop-mode stall     # reconnect testing
+
+Like the real Nano it serves one client at a time, one command at a time.
+"""
+import argparse
+import datetime
+import heapq
+import os
+import random
+import select
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+SIM_HOST = "127.0.0.1"
+SIM_PORT = 9000
+NANO_LINE_MAX = 120         # handleCommand() never sees more than this
+RS485_CHAR_SEC = 10 / 9600  # one byte on the 9600 baud RS-485 bus
+JPEG_STUB = b"\xff\xd8\xff\xd9"
+
+
+def exif_jpeg(capture, pad=0):
+    """A JPEG stub whose Exif header says it was captured at `capture` (epoch
+    seconds, written as local time with millisecond SubSecTimeOriginal), the
+    way the camera stamps its files. `pad` bytes stand in for the thumbnail."""
+    when = datetime.datetime.fromtimestamp(capture)
+    stamp = when.strftime("%Y:%m:%d %H:%M:%S").encode() + b"\0"
+    subsec = f"{when.microsecond // 1000:03d}".encode() + b"\0"
+    # little-endian TIFF: IFD0 -> Exif IFD -> DateTimeOriginal, SubSecTimeOriginal
+    ifd0, exif_ifd = 8, 8 + 2 + 12 + 4
+    data = exif_ifd + 2 + 2 * 12 + 4
+    tiff = b"II*\0" + struct.pack("<I", ifd0)
+    tiff += struct.pack("<HHHII", 1, 0x8769, 4, 1, exif_ifd) + struct.pack("<I", 0)
+    tiff += struct.pack("<H", 2)
+    tiff += struct.pack("<HHII", 0x9003, 2, len(stamp), data)
+    tiff += struct.pack("<HHI", 0x9291, 2, len(subsec)) + subsec
+    tiff += struct.pack("<I", 0) + stamp + b"\0" * pad
+    app1 = b"Exif\0\0" + tiff
+    return b"\xff\xd8\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + b"\xff\xd9"
+
+
+class NanoSimulator:
+    """TCP server speaking the firmware's line protocol.
+
+    Exposures fire at `fps` (each period jittered by `fps_jitter`, a fraction of
+    the period) while counting, and every registered listener is called with
+    (count, time.monotonic()). Replies are held back by `latency` +/- `jitter`
+    seconds, half before the command is handled and half after, and with
+    probability `split` a reply goes out in 2-3 separate TCP segments.
+    """
+
+    def __init__(self, host=SIM_HOST, port=SIM_PORT, fps=10.0, fps_jitter=0.0, latency=0.0, jitter=0.0,
+                 split=0.0, split_gap=0.001, rs485_echo=True, limit=None, seed=None):
+        self.fps = fps
+        self.fps_jitter = fps_jitter
+        self.latency = latency
+        self.jitter = jitter
+        self.split = split
+        self.split_gap = split_gap
+        self.rs485_echo = rs485_echo
+        self.limit = limit                  # stop firing after this many exposures per START
+        self.rng = random.Random(seed)
+
+        self.strobe_intensity = 0
+        self.lamp_intensity = 0
+        self.lamp_on = False
+        self.count = 0
+        self.counting = False
+        self.run_id = 0                     # bumped by every START so the trigger restarts its phase
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+
+        self.commands = 0
+        self.clients = 0
+        self.rs485_sent = []                # every line put on the bus
+        self._rs485_pending = []            # (due, line) echoes waiting for the bus
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(4)
+        self.address = self.server.getsockname()
+        self.closed = False
+        self.conn = None
+        self.stalled_until = 0.0            # stall(): stop serving the current client until then
+        self.drops = 0
+        self.threads = [threading.Thread(target=self._serve, daemon=True),
+                        threading.Thread(target=self._trigger_loop, daemon=True)]
+
+    def start(self):
+        for t in self.threads:
+            t.start()
+        return self
+
+    def add_listener(self, fn):
+        self.listeners.append(fn)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.wake.notify_all()
+        for s in (self.server, self.conn):
+            if s is None:
+                continue
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            try:
+                s.close()
+            except OSError:
+                pass
+        for t in self.threads:
+            t.join(timeout=1.0)
+
+    # ---------- Faults ----------
+    def drop_client(self):
+        """Close the current connection, as if the link went down."""
+        conn = self.conn
+        if conn is not None:
+            self.drops += 1
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def stall(self, seconds):
+        """Stop reading and replying on the current connection (no FIN, no RST) for
+        `seconds`, then drop it. New clients wait in the backlog meanwhile, like
+        the Nano stuck in loop() with a dead client."""
+        if self.conn is not None:
+            self.drops += 1
+            self.stalled_until = time.monotonic() + seconds
+
+    def reboot(self):
+        """Power-cycle: drop the client and forget the count and intensities."""
+        with self.lock:
+            self.count = 0
+            self.counting = False
+            self.strobe_intensity = self.lamp_intensity = 0
+        self.drop_client()
+
+    # ---------- Exposure pin ----------
+    def _trigger_loop(self):
+        period = 1.0 / self.fps
+        next_edge = None
+        run = None
+        while True:
+            with self.lock:
+                while not self.closed and not self.counting:
+                    self.wake.wait()
+                if self.closed:
+                    return
+                if run != self.run_id:
+                    run = self.run_id
+                    next_edge = time.monotonic() + period
+            wait = next_edge - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            with self.lock:
+                if run != self.run_id or not self.counting:
+                    continue
+                if self.limit is not None and self.count >= self.limit:
+                    self.wake.wait(0.05)
+                    continue
+                self.count += 1
+                n = self.count
+            now = time.monotonic()
+            for fn in self.listeners:
+                fn(n, now)
+            next_edge += period * (1.0 + self.rng.uniform(-self.fps_jitter, self.fps_jitter))
+
+    # ---------- Commands ----------
+    def handle_command(self, line):
+        """Mirror of handleCommand() in the sketch. Returns the reply line or None."""
+        cmd = line.strip()
+        if not cmd:
+            return None
+        self.commands += 1
+        if cmd[0] in "~$":
+            self._rs485_send(cmd)
+            return "OK FORWARDED"
+
+        upper = cmd.upper()
+        if upper == "START_EXPOSURE_COUNT":
+            with self.lock:
+                self.count = 0
+                self.counting = True
+                self.run_id += 1
+                self.wake.notify_all()
+            return "OK EXPOSURE COUNT STARTED"
+        if upper == "STOP_EXPOSURE_COUNT":
+            with self.lock:
+                self.counting = False
+            return "OK EXPOSURE COUNT STOPPED"
+        if upper == "GET_EXPOSURE_COUNT":
+            with self.lock:
+                return f"EXPOSURE_COUNT {self.count}"
+        if upper == "LAMP OFF":
+            self._rs485_send("~device set lamp:000|SUBC24991")
+            self.lamp_on = False
+            return "OK LAMP OFF"
+
+        # startsWith() is case-sensitive on the Nano, and a missing value gets no reply at all
+        for name in ("STROBE_INTENSITY", "LAMP_INTENSITY"):
+            if cmd.startswith(name):
+                sep = cmd.find(" ")
+                if sep <= 0:
+                    return None
+                v = _to_int(cmd[sep + 1:])
+                if not 0 <= v <= 100:
+                    return f"ERR {name} OUT OF RANGE"
+                if name == "STROBE_INTENSITY":
+                    self.strobe_intensity = v
+                    self._rs485_send(f"~device set strobe:{v:03d}|SUBC24991")
+                else:
+                    self.lamp_intensity = v
+                    self._rs485_send(f"~device set lamp:{v:03d}|SUBC24991")
+                return f"OK {name}"
+
+        if upper == "STATUS":
+            self._rs485_send("~comms print status|SUBC24991")
+            return "OK STATUS"
+        return "UNKNOWN CMD"
+
+    def _rs485_send(self, line):
+        self.rs485_sent.append(line)
+        if self.rs485_echo:
+            # out and back over the half-duplex bus, one line at a time
+            start = time.monotonic()
+            if self._rs485_pending:
+                start = max(start, self._rs485_pending[-1][0])
+            self._rs485_pending.append((start + 2 * (len(line) + 2) * RS485_CHAR_SEC, line))
+
+    # ---------- TCP ----------
+    def _serve(self):
+        while not self.closed:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.conn = conn
+            self.clients += 1
+            try:
+                self._client_loop(conn)
+            except OSError:
+                pass
+            finally:
+                self.conn = None
+                self._rs485_pending.clear()
+                try:
+                    conn.close()
+                except OSError:
+                    pass
+
+    def _client_loop(self, conn):
+        buf = b""
+        while not self.closed:
+            if self.stalled_until:
+                while not self.closed and time.monotonic() < self.stalled_until:
+                    time.sleep(0.01)
+                self.stalled_until = 0.0
+                return
+            timeout = 0.05
+            if self._rs485_pending:
+                timeout = max(0.0, self._rs485_pending[0][0] - time.monotonic())
+            r, _, _ = select.select([conn], [], [], timeout)
+            self._pump_rs485(conn)
+            if not r:
+                continue
+            data = conn.recv(4096)
+            if not data:
+                return
+            buf += data
+            while b"\n" in buf:
+                raw, buf = buf.split(b"\n", 1)
+                line = raw.replace(b"\r", b"")[:NANO_LINE_MAX].decode(errors="ignore")
+                self._delay()
+                reply = self.handle_command(line)
+                self._delay()
+                if reply is not None:
+                    self._send(conn, reply)
+                self._pump_rs485(conn)
+
+    def _delay(self):
+        if self.latency or self.jitter:
+            d = self.latency / 2 + self.rng.uniform(-self.jitter, self.jitter) / 2
+            if d > 0:
+                time.sleep(d)
+
+    def _pump_rs485(self, conn):
+        now = time.monotonic()
+        while self._rs485_pending and self._rs485_pending[0][0] <= now:
+            _, line = self._rs485_pending.pop(0)
+            self._send(conn, "RS485: " + line)
+
+    def _send(self, conn, line):
+        data = (line + "\n").encode()
+        if len(data) > 2 and self.rng.random() < self.split:
+            cuts = sorted(self.rng.sample(range(1, len(data)), min(len(data) - 1, self.rng.randint(1, 2))))
+            start = 0
+            for cut in cuts + [len(data)]:
+                conn.sendall(data[start:cut])
+                start = cut
+                if cut < len(data):
+                    time.sleep(self.split_gap)
+        else:
+            conn.sendall(data)
+
+
+def _to_int(text):
+    """Arduino String.toInt(): leading digits, 0 if there are none."""
+    text = text.strip()
+    digits = ""
+    for i, ch in enumerate(text):
+        if ch.isdigit() or (i == 0 and ch in "+-"):
+            digits += ch
+        else:
+            break
+    try:
+        return int(digits)
+    except ValueError:
+        return 0
+
+
+# ---------- Camera ----------
+class FakeCamera:
+    """Drops DSC#####.jpg files into `folder` `delay` (+/- `jitter`) seconds after
+    each exposure. With probability `drop` a frame is missed and no file is
+    written; the file number only advances on written frames, like the camera.
+    With `exif`, each file carries its capture time read off a camera clock
+    that is `clock_offset` seconds off the PC's.
+    """
+
+    def __init__(self, folder, delay=0.15, jitter=0.0, drop=0.0, start=1, prefix="DSC", ext=".jpg", seed=None,
+                 exif=False, clock_offset=0.0, exif_pad=16384):
+        self.folder = folder
+        self.delay = delay
+        self.jitter = jitter
+        self.drop = drop
+        self.next_number = start
+        self.prefix = prefix
+        self.ext = ext
+        self.rng = random.Random(seed)
+        self.exif = exif
+        self.clock_offset = clock_offset
+        self.exif_pad = exif_pad
+        self.written = []               # (exposure count, file name, time.monotonic() written)
+        self.heap = []
+        self.cond = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def on_exposure(self, n, t):
+        if self.rng.random() < self.drop:
+            return
+        due = t + max(0.0, self.delay + self.rng.uniform(-self.jitter, self.jitter))
+        with self.cond:
+            heapq.heappush(self.heap, (due, n, t))
+            self.cond.notify()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join(timeout=1.0)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.closed and not self.heap:
+                    self.cond.wait()
+                if self.closed:
+                    return
+                due, n, t = self.heap[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+                heapq.heappop(self.heap)
+            name = f"{self.prefix}{self.next_number:05d}{self.ext}"
+            self.next_number += 1
+            with open(os.path.join(self.folder, name), "wb") as f:
+                if self.exif:
+                    capture = time.time() - (time.monotonic() - t) + self.clock_offset
+                    f.write(exif_jpeg(capture, self.exif_pad))
+                else:
+                    f.write(JPEG_STUB)
+            self.written.append((n, name, time.monotonic()))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default=SIM_HOST)
+    ap.add_argument("--port", type=int, default=SIM_PORT)
+    ap.add_argument("--fps", type=float, default=10.0, help="exposure rate while counting")
+    ap.add_argument("--fps-jitter", type=float, default=0.0, help="per-frame period jitter, fraction of the period")
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="reply latency")
+    ap.add_argument("--jitter-ms", type=float, default=0.0, help="+/- jitter on the reply latency")
+    ap.add_argument("--split", type=float, default=0.0, help="probability a reply is split across TCP segments")
+    ap.add_argument("--no-rs485-echo", action="store_true", help="don't echo bus lines back as 'RS485: ...'")
+    ap.add_argument("--image-dir", help="run the fake camera into this folder (default: a new temp folder)")
+    ap.add_argument("--no-camera", action="store_true")
+    ap.add_argument("--camera-delay-ms", type=float, default=150.0, help="exposure -> file delay")
+    ap.add_argument("--camera-jitter-ms", type=float, default=0.0)
+    ap.add_argument("--camera-drop", type=float, default=0.0, help="probability a frame produces no file")
+    ap.add_argument("--camera-exif", action="store_true", help="stamp each file with an Exif capture time")
+    ap.add_argument("--camera-clock-sec", type=float, default=0.0, help="camera clock offset from the PC's (Exif)")
+    ap.add_argument("--drop-every", type=float, default=0.0, help="break the connection every N seconds")
+    ap.add_argument("--drop-mode", choices=["close", "stall", "reboot"], default="close",
+                    help="close the socket, go silent for --stall-sec, or power-cycle the counter")
+    ap.add_argument("--stall-sec", type=float, default=5.0)
+    ap.add_argument("--seed", type=int)
+    args = ap.parse_args()
+
+    sim = NanoSimulator(args.host, args.port, fps=args.fps, fps_jitter=args.fps_jitter,
+                        latency=args.latency_ms / 1e3, jitter=args.jitter_ms / 1e3, split=args.split,
+                        rs485_echo=not args.no_rs485_echo, seed=args.seed)
+    cam = None
+    if not args.no_camera:
+        folder = args.image_dir or tempfile.mkdtemp(prefix="aquorea_cam_")
+        os.makedirs(folder, exist_ok=True)
+        cam = FakeCamera(folder, delay=args.camera_delay_ms / 1e3, jitter=args.camera_jitter_ms / 1e3,
+                         drop=args.camera_drop, seed=args.seed, exif=args.camera_exif,
+                         clock_offset=args.camera_clock_sec)
+        sim.add_listener(cam.on_exposure)
+        print(f"camera writing to {folder}")
+    sim.start()
+    print(f"simulated Nano on {sim.address[0]}:{sim.address[1]}, {args.fps:g} fps (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(args.drop_every or 1.0)
+            if args.drop_every and sim.conn is not None:
+                print(f"dropping the client ({args.drop_mode})", flush=True)
+                if args.drop_mode == "stall":
+                    sim.stall(args.stall_sec)
+                elif args.drop_mode == "reboot":
+                    sim.reboot()
+                else:
+                    sim.drop_client()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.close()
+        if cam:
+            cam.close()
+        print(f"{sim.clients} clients, {sim.commands} commands, {sim.count} exposures in the last run")
+
+
+if __name__ == "__main__":
+    main()
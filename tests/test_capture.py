@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import main
+from bench import record_and_replay, same_rows
+from main import CAP_IMAGES, CAP_NOTE, CAP_RUN, CAP_RX, CAP_TX, TrafficCapture, capture_files, read_capture
+
+
+def _events(cap):
+    return [(t, kind, value) for t, kind, value, _ in read_capture(capture_files(cap.base))]
+
+
+def test_records_read_back_in_order_with_their_times(tmp_path):
+    cap = TrafficCapture(tmp_path, keep_files=0)
+    t0 = cap.last
+    cap.mark(CAP_RUN, "D:/cams/port", now=t0 + 0.001)
+    cap.sent("GET_EXPOSURE_COUNT", now=t0 + 0.002)
+    cap.received(["OK GET_EXPOSURE_COUNT", "EXPOSURE_COUNT 7"], now=t0 + 0.0025)
+    cap.images([("DSC00001.JPG", 1000.5), ("DSC00002.JPG", 1000.7, 999.25)], now=t0 + 0.003)
+    cap.mark(CAP_NOTE, "[Disconnected]", now=t0 + 7200.0)       # too long for the header: a sync record
+    cap.close()
+    got = _events(cap)
+    assert [(kind, value) for _, kind, value in got] == [
+        (CAP_RUN, "D:/cams/port"),
+        (CAP_TX, "GET_EXPOSURE_COUNT"),
+        (CAP_RX, ["OK GET_EXPOSURE_COUNT", "EXPOSURE_COUNT 7"]),
+        (CAP_IMAGES, [("DSC00001.JPG", 1000.5, None), ("DSC00002.JPG", 1000.7, 999.25)]),
+        (CAP_NOTE, "[Disconnected]"),
+    ]
+    for (t, _, _), offset in zip(got, (0.001, 0.002, 0.0025, 0.003, 7200.0)):
+        assert t == pytest.approx(t0 + offset, abs=1e-6)
+
+
+def test_rotated_parts_replay_as_one_capture(tmp_path):
+    cap = TrafficCapture(tmp_path, rotate_bytes=2000, keep_files=3, flush_sec=0)
+    for i in range(500):
+        cap.received([f"EXPOSURE_COUNT {i}"])
+    cap.close()
+    files = capture_files(cap.base)
+    assert len(files) == 3 and not os.path.exists(cap.base)     # older parts pruned
+    counts = [int(value[0].split()[1]) for _, kind, value in _events(cap) if kind == CAP_RX]
+    assert counts == list(range(counts[0], 500)) and counts[0] > 0
+
+
+def test_a_record_cut_off_by_a_crash_ends_the_file(tmp_path):
+    cap = TrafficCapture(tmp_path, keep_files=0)
+    cap.sent("STROBE_ON")
+    cap.sent("STROBE_OFF")
+    cap.close()
+    with open(cap.base, "r+b") as f:
+        f.truncate(os.path.getsize(cap.base) - 3)
+    assert [value for _, _, value in _events(cap)] == ["STROBE_ON"]
+
+
+def test_replay_writes_the_live_csv(tmp_path):
+    live, capture, replays = record_and_replay(str(tmp_path), fps=20, seconds=3)
+    assert capture.error is None and len(live) > 30
+    ((speed, replay, rows),) = replays
+    assert speed == 0 and replay.seconds < replay.span
+    assert len(rows) == len(live) and same_rows(live, rows) == len(live)
+
+
+def test_replay_is_rejected_with_units(capsys):
+    with pytest.raises(SystemExit) as e:
+        main.main(["--headless", "--unit", "A=127.0.0.1:9000", "--replay", "x.aqcap"])
+    assert e.value.code == 2
+    assert "--unit" in capsys.readouterr().err
@@ -0,0 +1,58 @@
+import socket
+import time
+
+import pytest
+
+from main import TcpClient
+
+
+def test_replies_resolve_their_commands():
+    ours, nano = socket.socketpair()
+    client = TcpClient(lambda line: None)
+    client.attach(ours)
+    try:
+        status = client.send_line("STATUS")
+        count = client.send_line("GET_EXPOSURE_COUNT")
+        received = b""
+        while received.count(b"\n") < 2:
+            received += nano.recv(100)
+        assert received == b"STATUS\nGET_EXPOSURE_COUNT\n"
+        nano.sendall(b"OK STATUS strobe=0\nEXPOSURE_COUNT 12\n")
+        assert status.result(2) == "OK STATUS strobe=0"
+        assert count.result(2) == "EXPOSURE_COUNT 12"
+    finally:
+        client.close()
+        nano.close()
+
+
+def test_old_receive_thread_leaves_a_new_link_alone():
+    notes = []
+    client = TcpClient(notes.append)
+    links = [socket.socketpair() for _ in range(20)]
+    for ours, _ in links:
+        client.attach(ours)                     # a reconnect, without closing the old link first
+    for _, nano in links[:-1]:
+        nano.close()                            # the old links drop while the new one is up
+    time.sleep(0.3)
+    ours, nano = links[-1]
+    assert client.alive and client.sock is ours
+    nano.sendall(b"OK STATUS\n")
+    time.sleep(0.2)
+    assert "OK STATUS" in notes
+    assert "[Disconnected]" not in notes
+    client.close()
+    nano.close()
+    time.sleep(0.2)
+    assert notes.count("[Disconnected]") == 1
+
+
+def test_pending_command_fails_when_the_link_drops():
+    ours, nano = socket.socketpair()
+    client = TcpClient(lambda line: None)
+    client.attach(ours)
+    future = client.send_line("STATUS")
+    time.sleep(0.1)
+    nano.close()
+    with pytest.raises(ConnectionError):
+        future.result(2)
+    client.close()
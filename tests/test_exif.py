@@ -0,0 +1,107 @@
+import os
+import struct
+import time
+
+import pytest
+
+from bench import _exif_pairing, _pct
+from main import CameraClock, ExifReader, parse_exif_time, read_exif_time, _exif_segment
+from simulator import JPEG_STUB, exif_jpeg
+
+CAPTURE = 1714557600.123                        # any local time with whole milliseconds
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_capture_time_round_trip(tmp_path):
+    path = _write(tmp_path / "DSC00001.JPG", exif_jpeg(CAPTURE, pad=60000))
+    assert read_exif_time(path) == pytest.approx(CAPTURE, abs=1e-6)
+
+
+def test_tags_past_the_first_read_are_fetched(tmp_path):
+    path = _write(tmp_path / "DSC00001.JPG", exif_jpeg(CAPTURE))
+    assert read_exif_time(path, head_bytes=48) == pytest.approx(CAPTURE, abs=1e-6)
+
+
+def test_files_without_a_capture_time(tmp_path):
+    assert read_exif_time(_write(tmp_path / "stub.jpg", JPEG_STUB)) is None
+    assert read_exif_time(_write(tmp_path / "note.jpg", b"not a jpeg at all")) is None
+    # a complete APP1 segment whose IFD offset points nowhere is malformed, not cut short
+    data = bytearray(exif_jpeg(CAPTURE))
+    start, _ = _exif_segment(bytes(data))
+    data[start + 4:start + 8] = (60000).to_bytes(4, "little")
+    assert read_exif_time(_write(tmp_path / "bad.jpg", bytes(data))) is None
+
+
+def test_big_endian_tiff():
+    stamp = b"2024:05:01 10:00:00\0"
+    subsec = b"25\0"
+    ifd0, exif_ifd = 8, 8 + 2 + 12 + 4
+    data = exif_ifd + 2 + 2 * 12 + 4
+    tiff = b"MM\0*" + struct.pack(">I", ifd0)
+    tiff += struct.pack(">HHHII", 1, 0x8769, 4, 1, exif_ifd) + struct.pack(">I", 0)
+    tiff += struct.pack(">H", 2)
+    tiff += struct.pack(">HHII", 0x9003, 2, len(stamp), data)
+    tiff += struct.pack(">HHI", 0x9291, 2, len(subsec)) + subsec + b"\0"
+    tiff += struct.pack(">I", 0) + stamp
+    expected = time.mktime(time.strptime("2024:05:01 10:00:00", "%Y:%m:%d %H:%M:%S")) + 0.25
+    assert parse_exif_time(tiff) == pytest.approx(expected)
+
+
+def test_reader_caches_by_name_size_and_mtime(tmp_path):
+    path = _write(tmp_path / "DSC00001.JPG", exif_jpeg(CAPTURE))
+    reader = ExifReader(workers=1)
+    try:
+        assert reader.capture_time(path) == reader.capture_time(path)
+        assert reader.stats()["reads"] == 1 and reader.hits == 1
+        _write(path, exif_jpeg(CAPTURE + 5))     # the camera reused the name
+        os.utime(path, (time.time() + 10, time.time() + 10))
+        assert reader.capture_time(path) == pytest.approx(CAPTURE + 5, abs=1e-6)
+        assert reader.stats()["reads"] == 2
+    finally:
+        reader.close()
+
+
+def test_reader_submit_keeps_the_order(tmp_path):
+    found = []
+    for k in range(20):
+        _write(tmp_path / f"DSC{k:05d}.JPG", exif_jpeg(CAPTURE + k) if k % 5 else JPEG_STUB)
+        found.append((f"DSC{k:05d}.JPG", 1000.0 + k))
+    reader = ExifReader(workers=3)
+    got = []
+    try:
+        reader.submit(str(tmp_path), found, got.append)
+        deadline = time.monotonic() + 5
+        while not got and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        reader.close()
+    (results,) = got
+    assert [name for name, _, _ in results] == [name for name, _ in found]
+    for k, (_, mtime, capture) in enumerate(results):
+        assert mtime == 1000.0 + k
+        assert capture is None if k % 5 == 0 else capture == pytest.approx(CAPTURE + k, abs=1e-6)
+
+
+def test_camera_clock_learns_the_offset():
+    clock = CameraClock(frames=4, warmup=2)
+    period, offset = 0.2, 42.0                  # the camera clock runs 42 s behind
+    for n in range(1, 30):
+        t = 100.0 + n * period
+        clock.add_exposure(n, t)
+        mapped = clock.to_exposure_time(t - offset, t - offset + 0.3)
+    assert clock.calibrated and clock.offset == pytest.approx(offset)
+    assert mapped == pytest.approx(100.0 + 29 * period)
+
+
+def test_exif_times_pair_where_mtimes_cannot():
+    pairs, wrong, deltas = _exif_pairing("exif", fps=20, seconds=4)
+    _, mtime_wrong, _ = _exif_pairing("mtime", fps=20, seconds=4)
+    assert pairs > 50
+    assert wrong <= 16                          # only while the offset is being learnt
+    assert mtime_wrong > 3 * wrong
+    assert _pct(deltas, 0.5) < 30
@@ -0,0 +1,79 @@
+import random
+import socket
+
+import pytest
+
+from main import LineFramer
+
+
+def _lines(n, rnd):
+    return [f"EXPOSURE_COUNT {k}" if rnd.random() < 0.9 else "x" * rnd.randrange(0, 300) for k in range(n)]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_any_chunking_gives_the_same_lines(seed):
+    rnd = random.Random(seed)
+    lines = _lines(500, rnd)
+    data = "".join(f"{line}\r\n" for line in lines).encode()
+    framer = LineFramer(recv_size=64)
+    got, i = [], 0
+    while i < len(data):
+        n = rnd.randrange(1, 200)
+        framer.feed(data[i:i + n])
+        got += framer.pop_lines()
+        i += n
+    assert got == lines
+
+
+def test_partial_line_waits_for_its_newline():
+    framer = LineFramer(recv_size=16)
+    framer.feed(b"OK STA")
+    assert framer.pop_lines() == []
+    framer.feed(b"TUS\nEXPOSURE_")
+    assert framer.pop_lines() == ["OK STATUS"]
+    framer.feed(b"COUNT 7\n")
+    assert framer.pop_lines() == ["EXPOSURE_COUNT 7"]
+    assert framer.start == framer.end == 0
+
+
+def test_line_longer_than_the_buffer_grows_it():
+    framer = LineFramer(recv_size=8)
+    long = "y" * 1000
+    framer.feed(long.encode())
+    assert framer.pop_lines() == []
+    framer.feed(b"\nnext\n")
+    assert framer.pop_lines() == [long, "next"]
+
+
+def test_only_the_partial_tail_is_moved():
+    framer = LineFramer(recv_size=32)
+    for k in range(1000):
+        framer.feed(f"EXPOSURE_COUNT {k}\n".encode())
+        framer.pop_lines()
+    assert framer.moved == 0
+    framer.feed(b"EXPOSURE_COUNT 1\nEXPOSU")
+    framer.pop_lines()
+    for _ in range(10):
+        framer.feed(b"RE_COUNT 2\nEXPOSU")
+        assert framer.pop_lines() == ["EXPOSURE_COUNT 2"]
+    assert framer.moved <= 10 * len(b"EXPOSU")
+
+
+def test_bad_utf8_is_dropped_not_raised():
+    framer = LineFramer()
+    framer.feed(b"OK \xff\xfeSTATUS\n")
+    assert framer.pop_lines() == ["OK STATUS"]
+
+
+def test_recv_into_from_a_socket():
+    a, b = socket.socketpair()
+    try:
+        framer = LineFramer(recv_size=16)
+        a.sendall(b"OK LAMP OFF\nEXPOSURE_COUNT 3\n")
+        a.close()
+        got = []
+        while framer.recv_into(b):
+            got += framer.pop_lines()
+        assert got == ["OK LAMP OFF", "EXPOSURE_COUNT 3"]
+    finally:
+        b.close()
@@ -0,0 +1,120 @@
+import os
+import time
+
+import pytest
+
+from main import ImageIndex, ScandirWatcher
+
+
+def test_membership_and_gaps():
+    index = ImageIndex(max_gaps=100)
+    assert index.add("DSC00001.jpg")
+    assert not index.add("DSC00001.jpg")
+    assert index.add("DSC00005.jpg")
+    assert "DSC00004.jpg" not in index           # skipped, may still turn up
+    assert index.add("DSC00004.jpg")
+    assert "DSC00004.jpg" in index
+    assert not index.add("DSC00004.jpg")
+    assert "DSC00006.jpg" not in index
+    assert index.add("notes.jpg") and "notes.jpg" in index and not index.add("notes.jpg")
+
+
+def test_old_gaps_are_dropped():
+    index = ImageIndex(max_gaps=10)
+    index.add("DSC00001.jpg")
+    index.add("DSC00100.jpg")
+    assert len(index.gaps) <= 10
+    assert "DSC00050.jpg" in index               # too old to wait for
+    assert "DSC00095.jpg" not in index
+
+
+def test_restarts_when_numbering_wraps():
+    index = ImageIndex(max_gaps=100)
+    for n in range(99990, 100000):
+        index.add(f"DSC{n:05d}.jpg")
+    assert index.add("DSC00001.jpg")
+    assert index.high == 1
+    assert index.add("DSC00002.jpg")
+    assert "DSC00003.jpg" not in index
+    assert "DSC99995.jpg" in index               # a leftover from before the wrap
+    assert "DSC00050.jpg" not in index           # where the new sequence goes next
+
+
+class _Counted:
+    def __init__(self, entry, stats):
+        self.entry = entry
+        self.name = entry.name
+        self.path = entry.path
+        self.stats = stats
+
+    def is_file(self):
+        return self.entry.is_file()
+
+    def stat(self):
+        self.stats[0] += 1
+        return self.entry.stat()
+
+
+class _CountingScandir:
+    def __init__(self, scandir, stats):
+        self.scandir = scandir
+        self.stats = stats
+
+    def __call__(self, path):
+        stats = self.stats
+
+        class It:
+            def __enter__(it):
+                it.inner = self.scandir(path)
+                return (_Counted(e, stats) for e in it.inner.__enter__())
+
+            def __exit__(it, *exc):
+                return it.inner.__exit__(*exc)
+
+        return It()
+
+
+def _touch(folder, n, mtime):
+    path = os.path.join(folder, f"DSC{n:05d}.JPG")
+    with open(path, "wb") as f:
+        f.write(b"x")
+    os.utime(path, (mtime, mtime))
+
+
+def test_scandir_wrap_past_99999_stops_restatting_leftovers(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    now = time.time()
+    for n in range(97000, 100000):
+        _touch(folder, n, now - 1000)
+    watcher = ScandirWatcher(folder)
+    watcher.snapshot()
+    now = time.time()                           # the new sequence starts after the snapshot
+    stats = [0]
+    monkeypatch.setattr(os, "scandir", _CountingScandir(os.scandir, stats))
+
+    _touch(folder, 1, now + 1)
+    assert [name for name, _ in watcher.poll()] == ["DSC00001.JPG"]
+    per_poll = []
+    for n in range(2, 8):
+        _touch(folder, n, now + n)
+        stats[0] = 0
+        assert [name for name, _ in watcher.poll()] == [f"DSC{n:05d}.JPG"]
+        per_poll.append(stats[0])
+    # only the new file is looked at, not the 3000 files from before the wrap
+    assert max(per_poll) <= 2, per_poll
+
+
+@pytest.mark.skipif(not hasattr(os, "scandir"), reason="needs os.scandir")
+def test_scandir_new_sequence_reaches_leftover_numbers(tmp_path):
+    folder = str(tmp_path)
+    now = time.time()
+    for n in range(90, 100):
+        _touch(folder, n, now - 1000)
+    watcher = ScandirWatcher(folder)
+    watcher.seen.max_gaps = 5
+    watcher.snapshot()
+    reported = []
+    for n in range(1, 100):
+        _touch(folder, n, now + n)              # the camera overwrites the old files as it gets there
+        reported += [name for name, _ in watcher.poll()]
+    assert reported == [f"DSC{n:05d}.JPG" for n in range(1, 100)]
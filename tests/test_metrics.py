@@ -0,0 +1,51 @@
+import json
+import urllib.request
+
+from main import METRICS_PORT, Metrics, MetricsExporter
+
+
+def _metrics():
+    m = Metrics()
+    m.counter("pairs", "exposures paired with an image")
+    m.histogram("delta_ms", [10, 100, 1000], "image minus exposure")
+    m.inc("pairs", 3)
+    for v in (5, 50, 60, 5000):
+        m.observe("delta_ms", v)
+    return m
+
+
+def test_prometheus_buckets_are_cumulative():
+    text = _metrics().prometheus()
+    assert "aquorea_pairs 3" in text
+    assert 'aquorea_delta_ms_bucket{le="10"} 1' in text
+    assert 'aquorea_delta_ms_bucket{le="100"} 3' in text
+    assert 'aquorea_delta_ms_bucket{le="+Inf"} 4' in text
+    assert "aquorea_delta_ms_count 4" in text
+
+
+def test_collectors_run_on_read():
+    m = Metrics()
+    m.gauge("queue")
+    m.add_collector(lambda metrics: metrics.set("queue", 7))
+    assert m.snapshot()["gauges"]["queue"] == 7
+
+
+def test_endpoint_is_off_unless_asked_for():
+    assert METRICS_PORT is None
+    exporter = MetricsExporter(_metrics())
+    assert exporter.server is None
+    exporter.close()
+
+
+def test_endpoint_and_snapshot_file(tmp_path):
+    path = tmp_path / "metrics.json"
+    exporter = MetricsExporter(_metrics(), port=0, path=str(path), interval=60)
+    try:
+        base = f"http://127.0.0.1:{exporter.port}"
+        with urllib.request.urlopen(base + "/metrics", timeout=5) as r:
+            assert b"aquorea_pairs 3" in r.read()
+        with urllib.request.urlopen(base + "/metrics.json", timeout=5) as r:
+            assert json.load(r)["counters"]["pairs"] == 3
+    finally:
+        exporter.close()
+    assert json.loads(path.read_text())["histograms"]["delta_ms"]["count"] == 4
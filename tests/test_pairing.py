@@ -0,0 +1,105 @@
+import random
+import time
+from bisect import bisect_left, bisect_right
+
+import pytest
+
+from main import PairingEngine
+
+
+class ListPairer:
+    """The same greedy rule on plain sorted lists: slow, obviously right."""
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+        self.exposures = []
+        self.images = []
+
+    def add_exposure(self, t, item):
+        ts = [x for x, _ in self.images]
+        i = bisect_left(ts, t)
+        best = None
+        if i > 0 and t - ts[i - 1] <= self.tolerance:
+            best = i - 1
+        if i < len(ts) and ts[i] - t <= self.tolerance and (best is None or ts[i] - t < t - ts[best]):
+            best = i
+        if best is None:
+            self.exposures.insert(bisect_right([x for x, _ in self.exposures], t), (t, item))
+            return None
+        return item, self.images.pop(best)[1]
+
+    def add_image(self, t, item):
+        ts = [x for x, _ in self.exposures]
+        i = bisect_left(ts, t - self.tolerance)
+        if i < len(ts) and ts[i] <= t + self.tolerance:
+            return self.exposures.pop(i)[1], item
+        self.images.insert(bisect_right([x for x, _ in self.images], t), (t, item))
+        return None
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_matches_plain_greedy(seed):
+    rnd = random.Random(seed)
+    eng = PairingEngine(0.5, expiry=None)
+    eng.exposures.load = eng.images.load = 4        # many small buckets: splits and removals
+    ref = ListPairer(0.5)
+    for k in range(500):
+        t = round(rnd.uniform(0, 60), 2)            # out of order, with ties
+        if rnd.random() < 0.5:
+            assert eng.add_exposure(t, k) == ref.add_exposure(t, k)
+        else:
+            assert eng.add_image(t, k) == ref.add_image(t, k)
+    assert len(eng.exposures) == len(ref.exposures)
+    assert len(eng.images) == len(ref.images)
+
+
+def test_closest_image_and_oldest_exposure():
+    eng = PairingEngine(2.0, expiry=None)
+    eng.add_image(9.0, "far")
+    eng.add_image(10.4, "near")
+    assert eng.add_exposure(10.0, "e") == ("e", "near")
+    eng.add_exposure(20.0, "old")
+    eng.add_exposure(21.0, "new")
+    assert eng.add_image(21.0, "i") == ("old", "i")
+
+
+def test_expiry_drops_old_entries():
+    eng = PairingEngine(1.0, expiry=10.0)
+    eng.exposures.load = 2
+    for k in range(10):
+        eng.add_exposure(k * 3.0, k)
+    assert eng.expired_exposures == 6 and len(eng.exposures) == 4
+    assert eng.add_image(26.5, "i") == (9, "i")
+
+
+def test_buckets_stay_bounded():
+    eng = PairingEngine(0.1, expiry=None)
+    rnd = random.Random(3)
+    for k in range(20000):
+        eng.add_exposure(rnd.uniform(0, 1e6), k)
+    side = eng.exposures
+    assert len(side) == 20000
+    assert max(len(ts) for ts in side.ts) <= 2 * side.load
+    assert all(ts == sorted(ts) for ts in side.ts)
+    assert side.maxes == [ts[-1] for ts in side.ts]
+
+
+def _per_event(backlog, events=4000):
+    """us per event for matches and inserts landing inside a `backlog` of waiting items."""
+    eng = PairingEngine(2.0, expiry=None)
+    for k in range(backlog):
+        eng.add_exposure(k * 10.0, k)
+        eng.add_image(k * 10.0 + 5.0, k)
+    rnd = random.Random(1)
+    start = time.perf_counter()
+    for j in range(events // 2):
+        k = rnd.randrange(backlog)
+        eng.add_exposure(k * 10.0 + 4.0, j)          # pairs with a backlog image
+        eng.add_image(k * 10.0 + 7.5, j)             # waits between two backlog entries
+    return (time.perf_counter() - start) / events * 1e6
+
+
+def test_cost_does_not_grow_with_backlog():
+    small = min(_per_event(1000) for _ in range(3))
+    large = min(_per_event(200000) for _ in range(3))
+    assert large < 8 * small
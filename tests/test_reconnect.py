@@ -0,0 +1,64 @@
+import socket
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from bench import reconnect_run
+from main import RECONNECT_BASE_SEC, RECONNECT_MAX_SEC, CoalescingSender, TcpClient, backoff_delay
+
+
+@pytest.mark.parametrize("mode", ["close", "reboot"])
+def test_reconnect_keeps_csv_numbering_continuous(mode):
+    recoveries, logged, fired, gaps, dups, strobe_ok = reconnect_run(mode, drops=2, gap=1.0)
+    assert len(recoveries) == 2
+    assert max(recoveries) < 3.0
+    assert gaps == 0 and dups == 0
+    assert logged > 0
+    assert strobe_ok
+
+
+def test_backoff_doubles_with_jitter_up_to_the_cap():
+    assert backoff_delay(0, rnd=lambda: 1.0) == RECONNECT_BASE_SEC
+    assert backoff_delay(0, rnd=lambda: 0.0) == RECONNECT_BASE_SEC / 2
+    assert backoff_delay(3, rnd=lambda: 1.0) == RECONNECT_BASE_SEC * 8
+    assert backoff_delay(50, rnd=lambda: 1.0) == RECONNECT_MAX_SEC
+
+
+def _ok(line):
+    f = Future()
+    f.set_result(f"OK {line.split()[0]}")
+    return f
+
+
+def test_slider_value_is_resent_on_a_new_link():
+    client = TcpClient(lambda line: None)
+    sent = []
+
+    def send(channel, value):
+        text = f"{channel} {value}"
+        sent.append(text)
+        client._remember(text)                      # as send_line does
+        return _ok(text)
+
+    now = [0.0]
+    cs = CoalescingSender(send, clock=lambda: now[0], client=client)
+    links = []
+    try:
+        for _ in range(2):
+            ours, nano = socket.socketpair()
+            links.append(nano)
+            client.attach(ours)
+            for _ in range(2):
+                now[0] += 1.0
+                cs.update("STROBE_INTENSITY", 40)
+        assert sent == ["STROBE_INTENSITY 40"] * 2       # once per link, not once per update
+        client.settings["STROBE"] = "STROBE_INTENSITY 90"   # typed command on the same link
+        now[0] += 1.0
+        cs.update("STROBE_INTENSITY", 40)
+        assert sent[-1] == "STROBE_INTENSITY 40" and len(sent) == 3
+    finally:
+        client.close()
+        for nano in links:
+            nano.close()
+        time.sleep(0.05)
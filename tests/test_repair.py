@@ -0,0 +1,100 @@
+import csv
+import os
+
+import pytest
+
+import repair
+from bench import _mispaired_db, _mispaired_session, _repair_check
+
+
+@pytest.fixture
+def session(tmp_path):
+    path = str(tmp_path / "exposure_log_1.csv")
+    return path, _mispaired_session(path, 3000)
+
+
+def _rows(path):
+    with open(path, newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_shifted_pairs_are_put_back(session, tmp_path):
+    path, truth = session
+    assert _repair_check({"output": path}, truth) > 2000          # the input is badly shifted
+    out = tmp_path / "out"
+    out.mkdir()
+    summary = repair.repair_session(path, out_dir=str(out))
+    assert summary["output"] == str(out / "exposure_log_1_repaired.csv")
+    assert _repair_check(summary, truth) == 0
+    assert summary["pairs"] == len(truth) and summary["changed"] > 2000
+    assert 290 < summary["lag_ms"] < 310
+
+
+def test_numpy_and_bisect_write_the_same_file(session, tmp_path, monkeypatch):
+    path, _ = session
+    if repair.np is None:
+        pytest.skip("numpy not installed")
+    outputs = []
+    for k, mod in enumerate((repair.np, None)):
+        monkeypatch.setattr(repair, "np", mod)
+        out = tmp_path / f"out{k}"
+        out.mkdir()
+        outputs.append(_rows(repair.repair_session(path, out_dir=str(out))["output"]))
+    assert outputs[0] == outputs[1]
+
+
+def test_rotated_parts_are_read_with_their_session(tmp_path):
+    path = str(tmp_path / "exposure_log_1.csv")
+    truth = _mispaired_session(path, 600)
+    rows = _rows(path)
+    with open(path, "w", newline="") as f:
+        csv.writer(f).writerows(rows[:301])
+    with open(str(tmp_path / "exposure_log_1_part2.csv"), "w", newline="") as f:
+        csv.writer(f).writerows(rows[:1] + rows[301:])
+    summary = repair.repair_session(path)
+    assert summary["exposures"] == 600 and _repair_check(summary, truth) == 0
+    assert os.path.basename(summary["output"]) == "exposure_log_1_repaired.csv"
+
+
+def test_session_specs():
+    assert repair.parse_session("a.csv") == ("a.csv", None, None)
+    assert repair.parse_session("a.csv", "cams") == ("a.csv", "cams", None)
+    assert repair.parse_session("a.csv@left", "cams") == ("a.csv", "left", None)
+    assert repair.parse_session("s.db#12@left") == ("s.db", "left", 12)
+
+
+def test_database_runs_are_repaired_from_every_event(session, tmp_path):
+    path, truth = session
+    db = str(tmp_path / "sessions.db")
+    assert _mispaired_db(db, 3000) == truth
+    assert repair.is_session_db(db) and not repair.is_session_db(path)
+    summary = repair.repair_session(db, run=1)
+    assert summary["session"] == "sessions_run1"
+    assert os.path.basename(summary["output"]) == "sessions_run1_repaired.csv"
+    assert _repair_check(summary, truth) == 0 and summary["changed"] > 2000
+    with open(summary["output"], newline="") as f:
+        from_db = [(row[1], row[3]) for row in csv.reader(f)]
+    (tmp_path / "out").mkdir()
+    csv_summary = repair.repair_session(path, out_dir=str(tmp_path / "out"))
+    with open(csv_summary["output"], newline="") as f:
+        assert [(row[1], row[3]) for row in csv.reader(f)] == from_db    # the CSV's times are rounded to ms
+
+
+def test_cli_repairs_every_run_of_a_database(tmp_path, capsys):
+    db = str(tmp_path / "sessions.db")
+    _mispaired_db(db, 500)
+    _mispaired_db(db, 500, seed=3)
+    assert repair.main([db, "--jobs", "1"]) == 0
+    out = capsys.readouterr().out
+    assert "sessions_run1" in out and "sessions_run2" in out
+    assert repair.main([db + "#2", "--jobs", "1"]) == 0
+    assert "sessions_run1" not in capsys.readouterr().out
+
+
+def test_cli_skips_rotated_parts_and_repaired_outputs(session, tmp_path, capsys):
+    path, _ = session
+    part = str(tmp_path / "exposure_log_1_part2.csv")
+    with open(part, "w", newline="") as f:
+        csv.writer(f).writerows(_rows(path)[:1])
+    assert repair.main([path, part]) == 0
+    assert capsys.readouterr().out.count("exposure_log_1") == 1
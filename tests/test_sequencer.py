@@ -0,0 +1,98 @@
+import csv
+
+import pytest
+
+import main
+from main import CAP_TX, Sequencer, TcpClient, TrafficCapture, capture_files, parse_sequence, read_capture
+from simulator import NanoSimulator
+
+SCRIPT = """
+# a sweep
+0      STROBE_INTENSITY 0
++0.5   LAMP_INTENSITY 40
+1      ramp STROBE_INTENSITY 0 100 over 0.2 every 0.1
++1     table LAMP_INTENSITY every 0.5 10 20
+2      repeat 2 every 1
+0        STROBE_ON
+0.25     STROBE_OFF
+       end
+"""
+
+
+def test_script_expands_to_timed_steps():
+    assert parse_sequence(SCRIPT) == [
+        (0.0, "STROBE_INTENSITY 0"),
+        (0.5, "LAMP_INTENSITY 40"),
+        (1.0, "STROBE_INTENSITY 0"),
+        (1.1, "STROBE_INTENSITY 50"),
+        (1.2, "STROBE_INTENSITY 100"),
+        (2.0, "STROBE_ON"),
+        (2.2, "LAMP_INTENSITY 10"),
+        (2.25, "STROBE_OFF"),
+        (2.7, "LAMP_INTENSITY 20"),
+        (3.0, "STROBE_ON"),
+        (3.25, "STROBE_OFF"),
+    ]
+
+
+@pytest.mark.parametrize("script, message", [
+    ("0 STROBE_ON\nend", "line 2: 'end' without 'repeat'"),
+    ("0 repeat 3 every 1\n0 STROBE_ON", "line 1: 'repeat' without 'end'"),
+    ("0 ramp STROBE_INTENSITY 0 100 over 5", "line 1: 0 ramp STROBE_INTENSITY 0 100 over 5: missing value"),
+    ("0 STROBE_ON\n-1 STROBE_OFF", "line 2: -1 STROBE_OFF: negative time"),
+    ("0 table LAMP_INTENSITY each 0.5 10", "expected 'every'"),
+    ("soon STROBE_ON", "line 1: soon STROBE_ON"),
+])
+def test_script_errors_name_the_line(script, message):
+    with pytest.raises(ValueError, match=message):
+        parse_sequence(script)
+
+
+def test_steps_go_out_in_order_and_on_time(tmp_path):
+    sim = NanoSimulator(host="127.0.0.1", port=0, latency=0.002, jitter=0.001, seed=2).start()
+    client = TcpClient(lambda line: None)
+    client.capture = TrafficCapture(tmp_path, keep_files=0)
+    client.connect(*sim.address)
+    steps = [(k * 0.02, f"STROBE_INTENSITY {k}") for k in range(25)] + [(0.6, "STROBE_ON"), (0.61, "STROBE_OFF")]
+    csv_path = str(tmp_path / "sequence_log.csv")
+    try:
+        seq = Sequencer(client, steps, csv_path=csv_path).start()
+        assert seq.wait(10)
+    finally:
+        client.close()
+        sim.close()
+        client.capture.close()
+    sent = [value for _, kind, value, _ in read_capture(capture_files(client.capture.base)) if kind == CAP_TX]
+    assert sent == [cmd for _, cmd in steps]
+    errors = seq.errors_ms()
+    assert len(errors) == len(steps) and max(map(abs, errors)) < 50
+    with open(csv_path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == main.SEQUENCE_CSV_HEADER and len(rows) == len(steps) + 1
+    assert [r[1] for r in rows[1:]] == [cmd for _, cmd in steps]
+
+
+def test_stopped_sequence_marks_the_rest_not_run(tmp_path):
+    sim = NanoSimulator(host="127.0.0.1", port=0).start()
+    client = TcpClient(lambda line: None)
+    client.connect(*sim.address)
+    steps = [(0.0, "STROBE_ON"), (5.0, "STROBE_OFF")]
+    try:
+        seq = Sequencer(client, steps, csv_path=str(tmp_path / "seq.csv")).start()
+        seq.stop()
+        assert seq.wait(5)
+    finally:
+        client.close()
+        sim.close()
+    assert seq.results[1] is None
+    with open(tmp_path / "seq.csv", newline="") as f:
+        assert list(csv.reader(f))[2][-1] == "not run"
+
+
+def test_sequence_is_rejected_with_units(tmp_path, capsys):
+    script = tmp_path / "sweep.txt"
+    script.write_text("0 STROBE_ON\n")
+    with pytest.raises(SystemExit) as e:
+        main.main(["--headless", "--unit", "A=127.0.0.1:9000", "--sequence", str(script)])
+    assert e.value.code == 2
+    assert "--unit" in capsys.readouterr().err
@@ -0,0 +1,73 @@
+import csv
+import os
+
+import pytest
+
+from main import CSV_HEADER, SessionWriter
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    calls = []
+    real = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: (calls.append(fd), real(fd)))
+    return calls
+
+
+def _row(k):
+    return [f"2024-05-01 10:00:{k % 60:02d}.000", k, "2024-05-01 10:00:00.300", f"DSC{k:05d}.jpg", 300, 1.5]
+
+
+def _read(path):
+    with open(path, newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_rows_are_buffered_until_the_row_limit(tmp_path, fsyncs):
+    clock = [0.0]
+    w = SessionWriter(tmp_path / "log.csv", flush_rows=10, flush_sec=60, fsync_sec=None, clock=lambda: clock[0])
+    w.write_rows([_row(k) for k in range(9)])
+    assert _read(w.path) == []                  # not even the header yet
+    w.write_rows([_row(9)])
+    assert len(_read(w.path)) == 11
+    assert w.flushes == 1 and fsyncs == []
+    w.close()
+    assert len(fsyncs) == 1                     # close always reaches the disk
+
+
+def test_tick_flushes_old_rows_then_fsyncs(tmp_path, fsyncs):
+    clock = [0.0]
+    w = SessionWriter(tmp_path / "log.csv", flush_rows=1000, flush_sec=1.0, fsync_sec=5.0, clock=lambda: clock[0])
+    w.write_rows([_row(1)])
+    clock[0] = 0.5
+    w.tick()
+    assert w.flushes == 0
+    clock[0] = 1.0
+    w.tick()
+    assert w.flushes == 1 and fsyncs == [] and w.unsynced
+    assert _read(w.path)[1][1] == "1"
+    clock[0] = 5.0
+    w.tick()
+    assert len(fsyncs) == 1 and not w.unsynced
+    clock[0] = 20.0
+    w.tick()                                    # nothing new: no more fsyncs
+    assert len(fsyncs) == 1
+    w.close()
+
+
+def test_rotation_continues_in_part_files_with_headers(tmp_path, fsyncs):
+    w = SessionWriter(tmp_path / "exposure_log.csv", flush_rows=10, rotate_bytes=2000)
+    rows = [_row(k) for k in range(200)]
+    for k in range(0, 200, 10):
+        w.write_rows(rows[k:k + 10])
+    w.close()
+    parts = sorted(p.name for p in tmp_path.iterdir())
+    assert parts[0] == "exposure_log.csv" and len(parts) > 2
+    assert all(p.startswith("exposure_log_part") for p in parts[1:])
+    got = []
+    for name in ["exposure_log.csv"] + sorted(parts[1:], key=lambda p: int(p[17:-4])):
+        table = _read(tmp_path / name)
+        assert table[0] == CSV_HEADER
+        assert os.path.getsize(tmp_path / name) < 2000 + 10 * 100
+        got += table[1:]
+    assert [int(r[1]) for r in got] == list(range(200))
@@ -0,0 +1,74 @@
+from concurrent.futures import Future
+
+import pytest
+
+from bench import simulate_drag
+from main import CoalescingSender
+
+
+@pytest.mark.parametrize("rate, most", [(5, 12), (10, 22), (20, 42)])
+def test_drag_is_coalesced(rate, most):
+    events, sent, acked, final = simulate_drag(rate)
+    # a 2 s drag sends about rate * 2 commands instead of one per motion event
+    assert sent <= most < events
+    assert acked == final
+
+
+class Device:
+    """Answers every command with OK straight away, on a clock the test moves."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sent = []
+
+    def send(self, channel, value):
+        self.sent.append((channel, value))
+        f = Future()
+        f.set_result(f"OK {channel}")
+        return f
+
+    def tick(self, sender):
+        self.now += 1.0
+        sender.pump()
+
+
+def test_acknowledged_value_is_not_resent():
+    dev = Device()
+    cs = CoalescingSender(dev.send, clock=lambda: dev.now)
+    cs.update("STROBE_INTENSITY", 40)
+    dev.tick(cs)
+    cs.update("STROBE_INTENSITY", 40)
+    dev.tick(cs)
+    assert dev.sent == [("STROBE_INTENSITY", 40)]
+
+
+def test_release_always_sends():
+    dev = Device()
+    cs = CoalescingSender(dev.send, clock=lambda: dev.now)
+    cs.update("LAMP_INTENSITY", 70)
+    dev.tick(cs)
+    cs.update("LAMP_INTENSITY", 70, force=True)
+    dev.tick(cs)
+    assert dev.sent == [("LAMP_INTENSITY", 70)] * 2
+
+
+def test_forget_resends_after_reconnect_or_other_commands():
+    dev = Device()
+    cs = CoalescingSender(dev.send, clock=lambda: dev.now)
+    cs.update("STROBE_INTENSITY", 40)
+    dev.tick(cs)
+    cs.forget()                                 # e.g. reconnected, or a typed STROBE_INTENSITY 90
+    cs.update("STROBE_INTENSITY", 40)
+    dev.tick(cs)
+    assert dev.sent == [("STROBE_INTENSITY", 40)] * 2
+
+
+def test_failed_send_is_not_remembered():
+    dev = Device()
+    cs = CoalescingSender(lambda ch, v: dev.sent.append((ch, v)), clock=lambda: dev.now)
+    cs.update("STROBE_INTENSITY", 10)
+    dev.tick(cs)
+    cs.update("STROBE_INTENSITY", 10)
+    dev.tick(cs)
+    assert dev.sent == [("STROBE_INTENSITY", 10)] * 2
+    assert cs.acked == {}
@@ -0,0 +1,132 @@
+import csv
+import datetime
+import os
+import sqlite3
+import time
+
+import pytest
+
+import sessions
+from main import (CSV_HEADER, ExposurePipeline, SessionStore, TcpClient, export_run_csv, query_pairs,
+                  unmatched)
+from simulator import FakeCamera, NanoSimulator
+
+T0 = datetime.datetime(2024, 5, 1, 10, 0).timestamp()
+
+
+def _fill(store, unit="port", started=T0):
+    run = store.begin_run(unit, "exposure_log.csv", "cam", started)
+    store.add_exposures([(run, k, started + k, 2.0) for k in range(1, 6)])
+    store.add_images([(run, f"DSC{k}.jpg", started + k + 0.2, None) for k in (1, 2, 3, 5, 9)])
+    store.add_pairs([(run, k, f"DSC{k}.jpg", started + k, started + k + 0.2, 200, 2.0) for k in (1, 2)]
+                    + [(run, 3, "DSC3.jpg", started + 3, started + 3.9, 900, None)])
+    store.end_run(run, started + 10)
+    return run
+
+
+def test_rows_come_back_through_the_queries(tmp_path):
+    path = tmp_path / "sessions.db"
+    store = SessionStore(path)
+    _fill(store)
+    _fill(store, unit="stbd", started=T0 + 86400)
+    assert store.flush(5)
+    store.close()
+    assert store.rows_written == 2 * 15 and store.rows_dropped == 0
+    assert len(query_pairs(path)) == 6
+    slow = query_pairs(path, min_abs_delta_ms=500)
+    assert [(unit, run, count, image) for unit, run, count, image, *_ in slow] == \
+        [("port", 1, 3, "DSC3.jpg"), ("stbd", 2, 3, "DSC3.jpg")]
+    assert [row[0] for row in query_pairs(path, since=T0 + 3600)] == ["stbd"] * 3
+    assert len(query_pairs(path, unit="port", until=T0 + 2.5)) == 2
+    exposures, images = unmatched(path, 1)
+    assert exposures == [(4, T0 + 4), (5, T0 + 5)]
+    assert images == [("DSC5.jpg", T0 + 5.2), ("DSC9.jpg", T0 + 9.2)]
+    out = tmp_path / "run1.csv"
+    assert export_run_csv(path, 1, out) == 3
+    with open(out, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == CSV_HEADER
+    assert rows[1][1:] == ["1", rows[1][2], "DSC1.jpg", "200", "2"] and rows[1][0].endswith(".000")
+    assert rows[3][-1] == ""
+
+
+def test_two_writers_share_one_file(tmp_path):
+    path = tmp_path / "sessions.db"
+    a, b = SessionStore(path), SessionStore(path)
+    run_a = _fill(a, unit="port")
+    run_b = _fill(b, unit="stbd")
+    assert run_a == run_b == 1                      # handles are per store ...
+    a.close()
+    b.close()
+    db = sqlite3.connect(path)
+    try:
+        units = dict(db.execute("SELECT id, unit FROM runs"))
+        assert sorted(units.values()) == ["port", "stbd"]   # ... the stored ids are not
+        for run, unit in units.items():
+            assert db.execute("SELECT COUNT(*) FROM pairs WHERE run = ?", (run,)).fetchone()[0] == 3
+    finally:
+        db.close()
+
+
+def test_rows_for_an_unknown_run_are_dropped_alone(tmp_path, capsys):
+    store = SessionStore(tmp_path / "sessions.db")
+    _fill(store)
+    store.add_exposures([(99, 1, T0, None)])
+    store.close()
+    assert store.rows_dropped == 1 and store.rows_written == 15
+    assert "[DB ERROR]" in capsys.readouterr().err
+    assert "1 dropped" in store.stats()
+
+
+def test_a_live_run_is_stored_as_written_to_the_csv(tmp_path):
+    cam_dir = tmp_path / "cam"
+    cam_dir.mkdir()
+    sim = NanoSimulator(host="127.0.0.1", port=0, fps=20, limit=40).start()
+    cam = FakeCamera(str(cam_dir), delay=0.3, jitter=0.05, drop=0.1, seed=5)
+    sim.add_listener(cam.on_exposure)
+    store = SessionStore(tmp_path / "sessions.db")
+    pipe = None
+    client = TcpClient(None, on_lines=lambda lines: pipe.on_lines(lines))
+    pipe = ExposurePipeline(client, store=store)
+    client.connect(*sim.address)
+    live = tmp_path / "live.csv"
+    try:
+        pipe.start_run(str(live), str(cam_dir)).result(5)
+        time.sleep(3.0)
+        pipe.stop_run().result(5)
+    finally:
+        pipe.close()
+        client.close()
+        sim.close()
+        cam.close()
+        store.close()
+    with open(live, newline="") as f:
+        live_rows = list(csv.reader(f))
+    exported = tmp_path / "run1.csv"
+    assert export_run_csv(store.path, 1, exported) == len(live_rows) - 1 > 20
+    with open(exported, newline="") as f:
+        assert [r[:5] for r in csv.reader(f)] == [r[:5] for r in live_rows]
+    exposures, images = unmatched(store.path, 1)
+    assert len(exposures) >= 1 and images == []     # dropped frames, every image paired
+
+
+def test_cli(tmp_path, capsys):
+    path = tmp_path / "sessions.db"
+    store = SessionStore(path)
+    _fill(store)
+    store.close()
+    assert sessions.main([str(path), "runs"]) == 0
+    assert "port" in capsys.readouterr().out
+    assert sessions.main([str(path), "pairs", "--min-delta-ms", "500"]) == 0
+    out = capsys.readouterr()
+    assert "DSC3.jpg" in out.out and "1 pairs" in out.err
+    assert sessions.main([str(path), "export", "1", str(tmp_path / "r.csv")]) == 0
+    assert os.path.exists(tmp_path / "r.csv")
+    assert sessions.main([str(tmp_path / "missing.db"), "runs"]) == 1
+
+
+def test_times_and_ages():
+    assert sessions.parse_when("2024-05-01 10:00") == pytest.approx(T0)
+    assert sessions.parse_when("7d") == pytest.approx(time.time() - 7 * 86400, abs=5)
+    with pytest.raises(Exception, match="not a time or age"):
+        sessions.parse_when("last tuesday")
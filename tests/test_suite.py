@@ -0,0 +1,48 @@
+import json
+
+from bench import _feed_pairing, _pairing_workload, compare_results, suite_pairing
+from main import MATCH_TOLERANCE_SEC, PairingEngine
+
+
+def test_pairing_workload_matches_inside_the_backlog_out_of_order():
+    stale, live = _pairing_workload(1000, 2000)
+    eng = PairingEngine(MATCH_TOLERANCE_SEC, expiry=None)
+    assert _feed_pairing(eng, stale) == 0
+    assert _feed_pairing(eng, live) == 1000
+    assert len(eng.exposures) == len(eng.images) == 1000     # the backlog is still all there
+    times = [t for _, t, _ in live]
+    lo, hi = min(t for _, t, _ in stale), max(t for _, t, _ in stale)
+    assert sum(lo < t < hi for t in times) > 0.9 * len(times)
+    assert sum(b < a for a, b in zip(times, times[1:])) > len(times) // 3    # out of time order
+    # pairs overlap: other events arrive between a pair's two halves, image first about half the time
+    first = {}
+    overlapped = image_first = 0
+    for k, (side, _, item) in enumerate(live):
+        if item in first:
+            overlapped += k - first[item][0] > 1
+            image_first += first[item][1] == 1
+        else:
+            first[item] = (k, side)
+    assert overlapped > 800 and 300 < image_first < 700
+
+
+def test_suite_pairing_reports_every_event():
+    r = suite_pairing(100, events=2000)
+    assert r["n"] == 2000 and r["unit"] == "events/s" and r["throughput"] > 0
+
+
+def _write(path, commit, results):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"meta": {"commit": commit}, "results": results}, f)
+
+
+def test_compare_flags_only_regressions(tmp_path, capsys):
+    old, new = tmp_path / "old.json", tmp_path / "new.json"
+    _write(old, "aaa", {"rx/1000": {"throughput": 1000.0, "p50_us": 10.0, "p99_us": 50.0, "peak_kib": 100.0}})
+    _write(new, "bbb", {"rx/1000": {"throughput": 1100.0, "p50_us": 9.0, "p99_us": 55.0, "peak_kib": 100.0},
+                        "scan/1000": {"throughput": 5.0}})
+    assert compare_results(old, new, 0.2) == 0
+    assert "(new case)" in capsys.readouterr().out
+    _write(new, "ccc", {"rx/1000": {"throughput": 700.0, "p50_us": 10.0, "p99_us": 50.0, "peak_kib": 100.0}})
+    assert compare_results(old, new, 0.2) == 1
+    assert "REGRESSION" in capsys.readouterr().out
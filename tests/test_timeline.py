@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+from bench import _pct, simulate_timeline
+from main import EXPOSURE_POLL_DITHER, ExposureTimeline
+
+
+@pytest.mark.parametrize("poll", [0.25, 1.0, 5.0])
+def test_every_frame_gets_a_time_inside_its_bound(poll):
+    old_err, new_err, bounds, old_n, new_n = simulate_timeline(poll, seconds=300)
+    assert new_n == 5 * 300 - 1                 # one time per frame, however slow the polls
+    inside = sum(e <= b for e, b in zip(new_err, bounds)) / len(new_err)
+    assert inside >= 0.98
+    assert _pct(new_err, 0.5) < _pct(old_err, 0.5) / 3
+
+
+def test_steady_rate_does_not_drift():
+    tl = ExposureTimeline()
+    tl.reset(0.0)
+    period, phase, frames = 0.2, 0.07, []       # frame n fires at phase + n * period
+    rnd = random.Random(8)
+    t = 0.0
+    while t < 3600:
+        t += 0.5 * (1.0 + rnd.uniform(-EXPOSURE_POLL_DITHER, EXPOSURE_POLL_DITHER))    # as the poller does
+        count = int((t - phase) / period)
+        frames += tl.observe(t - 0.01, t + 0.01, count)
+    assert [n for n, _, _ in frames] == list(range(1, len(frames) + 1))
+    errors = [(abs(t - phase - n * period), err) for n, t, err in frames]
+    assert sum(e <= err for e, err in errors) / len(errors) >= 0.99
+    early = _pct([e for e, _ in errors[:2000]], 0.5)
+    late = _pct([e for e, _ in errors[-2000:]], 0.5)
+    assert late < 0.03 and late < 2 * early + 0.005    # an hour in, no worse than at the start
+
+
+def test_frames_are_numbered_once_in_order():
+    tl = ExposureTimeline()
+    tl.reset(0.0)
+    got = []
+    for k, count in enumerate([0, 2, 2, 5, 9, 9, 10]):
+        got += [n for n, _, _ in tl.observe(k * 0.5, k * 0.5 + 0.02, count)]
+    assert got == list(range(1, 11))
+
+
+def test_counter_going_back_starts_over():
+    tl = ExposureTimeline()
+    tl.reset(0.0)
+    tl.observe(0.5, 0.52, 5)
+    assert tl.observe(1.0, 1.02, 1) == []       # the Nano restarted its count
+    assert [n for n, _, _ in tl.observe(1.5, 1.52, 3)] == [2, 3]
@@ -0,0 +1,131 @@
+import socket
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import main
+from main import SessionManager
+from simulator import NanoSimulator
+
+
+@pytest.fixture
+def sims():
+    started = [NanoSimulator(host="127.0.0.1", port=0, fps=20).start() for _ in range(3)]
+    yield started
+    for sim in started:
+        sim.close()
+
+
+def _closed_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def test_connect_all_returns_at_once_and_skips_units_that_are_up(sims):
+    mgr = SessionManager()
+    try:
+        for k, sim in enumerate(sims):
+            mgr.add_unit(f"u{k}", "127.0.0.1", sim.address[1], ".")
+        start = time.monotonic()
+        futures = mgr.connect_all()
+        assert time.monotonic() - start < 0.1
+        for f in futures.values():
+            assert f.result(5) is None
+        socks = {name: u.client.sock for name, u in mgr.units.items()}
+        assert all(socks.values())
+        assert mgr.connect_all() == {}
+        assert {name: u.client.sock for name, u in mgr.units.items()} == socks
+        time.sleep(0.3)                             # let the simulators accept
+        assert sum(sim.clients for sim in sims) == 3
+    finally:
+        mgr.close()
+
+
+def test_one_unreachable_unit_does_not_hold_up_the_others(sims):
+    mgr = SessionManager()
+    try:
+        mgr.add_unit("up", "127.0.0.1", sims[0].address[1], ".")
+        mgr.add_unit("down", "127.0.0.1", _closed_port(), ".")
+        futures = mgr.connect_all(supervise=False)
+        assert futures["up"].result(5) is None
+        with pytest.raises(OSError):
+            futures["down"].result(5)
+        assert mgr.units["up"].client.sock and mgr.units["down"].client.sock is None
+        again = mgr.connect_all(supervise=False)
+        assert list(again) == ["down"]              # only the unit that is still down is retried
+        with pytest.raises(OSError):
+            again["down"].result(5)
+    finally:
+        mgr.close()
+
+
+def test_supervised_units_are_left_to_the_supervisor(sims):
+    mgr = SessionManager()
+    try:
+        mgr.add_unit("up", "127.0.0.1", sims[0].address[1], ".")
+        mgr.add_unit("down", "127.0.0.1", _closed_port(), ".")
+        futures = mgr.connect_all()
+        futures["up"].result(5)
+        with pytest.raises(OSError):
+            futures["down"].result(5)
+        time.sleep(0.1)
+        assert {u.client for u in mgr.units.values()} <= set(mgr.supervisor.links)
+        assert mgr.connect_all() == {}              # the supervisor is already retrying "down"
+    finally:
+        mgr.close()
+
+
+def test_connect_gives_up_after_its_timeout():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(0)
+    port = listener.getsockname()[1]
+    fillers = []
+    for _ in range(4):                              # fill the accept queue so further SYNs go unanswered
+        s = socket.socket()
+        s.setblocking(False)
+        s.connect_ex(("127.0.0.1", port))
+        fillers.append(s)
+    mgr = SessionManager()
+    try:
+        mgr.add_unit("slow", "127.0.0.1", port, ".")
+        client = mgr.units["slow"].client
+        future = client.connect_async("127.0.0.1", port, timeout=0.3)
+        with pytest.raises(TimeoutError):
+            future.result(3)
+        assert client.connecting is None and client.sock is None
+    finally:
+        mgr.close()
+        for s in fillers:
+            s.close()
+        listener.close()
+
+
+def test_unit_flags_that_would_be_ignored_are_rejected(capsys):
+    with pytest.raises(SystemExit) as e:
+        main.main(["--headless", "--unit", "A=127.0.0.1:9000", "--metrics-port", "9464"])
+    assert e.value.code == 2
+    assert "--unit" in capsys.readouterr().err
+
+
+def test_stuck_start_is_logged_and_the_rest_still_run(sims, tmp_path, monkeypatch, capsys):
+    real = SessionManager.start_all
+
+    def start_all(self, csv_dir="."):
+        futures = real(self, csv_dir)
+        futures["u1"] = Future()                    # never answers
+        return futures
+
+    monkeypatch.setattr(SessionManager, "start_all", start_all)
+    argv = ["--headless", "--quiet", "--duration", "0.5", "--csv-dir", str(tmp_path), "--image-dir", str(tmp_path),
+            "--capture-dir", str(tmp_path)]
+    for k, sim in enumerate(sims[:2]):
+        argv += ["--unit", f"u{k}=127.0.0.1:{sim.address[1]}"]
+    assert main.main(argv) == 0
+    out = capsys.readouterr().out
+    assert "[u1] start timed out" in out
+    assert "[u0] logging to" in out